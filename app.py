@@ -28,10 +28,12 @@
 ######################################################################## INFO ##
 
 # Import python modules
-from os.path    import join
+from os.path    import join, isfile
+from time       import perf_counter
 from select     import select
 from threading  import Thread
 from math       import radians
+from random     import randrange
 from datetime   import datetime
 from subprocess import Popen, PIPE
 from queue      import Queue, Empty
@@ -51,16 +53,24 @@ import bge
 from mathutils import Vector, Matrix, Euler, Quaternion
 
 # Import user modules
-from hud      import Text
-from hand     import Hands
-from surface  import Surface
-from callback import CallbackManager
-from utils    import save_to_file, load_from_file
+from hud       import Text
+from hand      import Hands
+from journal   import Journal
+from stats     import dump_counters
+from surface   import Surface, SerialisedDataUnmatched
+from ownership import MASTER_RANK
+from callback  import CallbackManager
+from utils     import save_to_file, load_from_file
 
 # Import global level constants
 from const import (INT_TEMP_SAVE_FILE,
                    INT_AUTO_SAVE_FILE,
+                   INT_JOURNAL_FILE,
+                   INT_JOURNAL_INTERVAL,
+                   INT_RECOVER_ON_START,
                    INT_TEXT_INTERVAL,
+                   INT_STATISTICS_FILE,
+                   INT_STATISTICS_INTERVAL,
                    INT_AUTO_SAVE_INTERVAL,
                    INT_TEMPORARY_FOLDER,
                    INT_PERMANENT_FOLDER,
@@ -88,30 +98,37 @@ from const import (INT_TEMP_SAVE_FILE,
                    OBJ_HUD_SCENE,
                    PROP_TEXT_TIMER,
                    COLOR_GEOMETRY_DARK,
+                   SCULPT_SOFT_SELECTION,
+                   SCULPT_DETAIL_LEVELS,
                    LEAP_MULTIPLIER,
                    RIFT_MULTIPLIER,
                    RIFT_POSITION_SHIFT_Y,
                    RIFT_POSITION_SHIFT_Z,
                    RIFT_ORIENTATION_SHIFT,
                    COMM_IS_PAIRED,
+                   COMM_TRANSPORT,
                    COMM_DEVICE_NAME,
                    COMM_THIS_HOST,
                    COMM_THIS_PORT,
                    COMM_OTHER_HOST,
                    COMM_OTHER_PORT,
                    COMM_IS_MASTER,
+                   COMM_IS_HUB,
+                   COMM_MAX_CLIENTS,
                    COMM_RUNNING,
-                   COMM_RESTART)
+                   COMM_RESTART,
+                   COMM_UDP)
 
 # Import conditional user modules
 if COMM_IS_PAIRED:
-    if COMM_IS_MASTER:
-        from communication import sizeof_pow2, Server as Connection
+    if COMM_IS_MASTER and COMM_IS_HUB:
+        from hub import Hub
+    elif COMM_TRANSPORT == COMM_UDP:
+        from communication import Exchange, Datagram as Connection
+    elif COMM_IS_MASTER:
+        from communication import Exchange, Server as Connection
     else:
-        from communication import sizeof_pow2, Client as Connection
-    # Conditional module level constant
-    BUFFER_SIZE = sizeof_pow2([(int(), float(), float(), float()),
-                               (int(), float(), float(), float())])
+        from communication import Exchange, Client as Connection
 
 # TODO: make build-script work :)
 # Import cutils modules => versioning
@@ -127,6 +144,11 @@ MOUNTED_ON_DESK = 1
 S_KEY           = bge.events.SKEY
 R_KEY           = bge.events.RKEY
 L_KEY           = bge.events.LKEY
+P_KEY           = bge.events.PKEY
+B_KEY           = bge.events.BKEY
+M_KEY           = bge.events.MKEY
+PAGE_UP_KEY     = bge.events.PAGEUPKEY
+PAGE_DOWN_KEY   = bge.events.PAGEDOWNKEY
 HOME_KEY        = bge.events.HOMEKEY
 SPACE_KEY       = bge.events.SPACEKEY
 ESCAPE_KEY      = bge.events.ESCKEY
@@ -167,6 +189,11 @@ class Application(CallbackManager):
     def vertex_origo(self):
         return self._vertex_origo
 
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    @property
+    def journal(self):
+        return self._journal
+
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def __init__(self, mounted_on_desk, *args, **kwargs):
@@ -200,6 +227,13 @@ class Application(CallbackManager):
         makedirs(INT_TEMP_SAVE_FOLDER,  exist_ok=True)
         makedirs(INT_AUTO_SAVE_FOLDER,  exist_ok=True)
 
+        # Open the journal of the edits made since the last auto-save (if the
+        # last session is not continued, its edits are not needed anymore)
+        self._journal = Journal(INT_JOURNAL_FILE,
+                                INT_JOURNAL_INTERVAL,
+                                fresh=not INT_RECOVER_ON_START)
+        self._last_statistics = perf_counter()
+
         ## Start input-daemon
         #self._lines_queue = Queue()
         #def get_input():
@@ -216,13 +250,24 @@ class Application(CallbackManager):
         #self._should_shut_down = False
 
         try:
+            # Accept any number of clients
+            if COMM_IS_MASTER and COMM_IS_HUB:
+                self._connection = Hub(this_host=COMM_THIS_HOST,
+                                       this_port=COMM_THIS_PORT,
+                                       device=COMM_DEVICE_NAME,
+                                       max_clients=COMM_MAX_CLIENTS)
             # Create connection
-            self._connection = Connection(this_host=COMM_THIS_HOST,
-                                          this_port=COMM_THIS_PORT,
-                                          buffer_size=BUFFER_SIZE,
-                                          device=COMM_DEVICE_NAME)
-            self._connection.connect(other_host=COMM_OTHER_HOST,
-                                     other_port=COMM_OTHER_PORT)
+            else:
+                connection = Connection(this_host=COMM_THIS_HOST,
+                                        this_port=COMM_THIS_PORT,
+                                        device=COMM_DEVICE_NAME)
+                # Connect, exchange messages and reconnect if the connection
+                # is lost on a background thread, so starting never hangs
+                self._connection = Exchange(connection,
+                                            address=(COMM_OTHER_HOST,
+                                                     COMM_OTHER_PORT),
+                                            reconnect=True)
+            self._connection.start()
         # If connection is not imported
         except NameError:
             pass
@@ -267,7 +312,13 @@ class Application(CallbackManager):
         #       like that..
         self._surface = Surface(blender_scene.objects[OBJ_PROTOTYPE_SURFACE],
                                 blender_scene.objects[OBJ_PROTOTYPE_VERTEX_ALL],
-                                COLOR_GEOMETRY_DARK)
+                                COLOR_GEOMETRY_DARK,
+                                # Master wins the ties of simultaneous picks
+                                rank=(MASTER_RANK if COMM_IS_MASTER
+                                                  else randrange(1, 1 << 32)),
+                                # Without a peer, nobody collects the claims
+                                shared=COMM_IS_PAIRED,
+                                detail_levels=SCULPT_DETAIL_LEVELS)
 
         # TODO: fake casted shadow with negative lamp:
         #       https://www.youtube.com/watch?v=iJUlqwKEdVQ
@@ -294,6 +345,13 @@ class Application(CallbackManager):
         # Last time saved
         self._auto_save_time = self._origo[PROP_TEXT_TIMER]
 
+        # If grabbing moves the neighbours of the selected vertices as well
+        self._soft_selection = SCULPT_SOFT_SELECTION
+        # If grabbing smooths the vertices under the hand instead
+        self._smoothing      = False
+        # If picking and grabbing are mirrored
+        self._mirroring      = False
+
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def reset_view(self):
@@ -306,6 +364,33 @@ class Application(CallbackManager):
         self._surface.update()
 
 
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def toggle_soft_selection(self):
+        self._soft_selection = not self._soft_selection
+        self._text.write('Soft selection {}'.format('on' if self._soft_selection
+                                                         else 'off'))
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def toggle_smoothing(self):
+        self._smoothing = not self._smoothing
+        self._text.write('Smoothing brush {}'.format('on' if self._smoothing
+                                                          else 'off'))
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def toggle_mirroring(self):
+        self._mirroring = not self._mirroring
+        self._text.write('Mirror mode {}'.format('on' if self._mirroring
+                                                      else 'off'))
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def change_level(self, step):
+        level = self._surface.set_level(self._surface.level + step)
+        self._text.write('Level of detail #{}'.format(level))
+
+
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def save(self):
         # Save created mesh
@@ -320,6 +405,7 @@ class Application(CallbackManager):
             file_path = join(INT_TEMP_SAVE_FOLDER,
                              next(reversed(sorted(listdir(INT_TEMP_SAVE_FOLDER)))))
             self._surface.deserialise(load_from_file(file_path))
+            self._surface.update()
             print('[OKAY] file has been loaded from:', file_path)
         except StopIteration:
             print('[FAIL] there is no file in:', INT_TEMP_SAVE_FOLDER)
@@ -331,17 +417,62 @@ class Application(CallbackManager):
         if self._auto_save_time + INT_AUTO_SAVE_INTERVAL <= current_time:
             # Update last-time checked value
             self._auto_save_time = current_time
-            # Save created mesh
-            save_to_file(path=INT_AUTO_SAVE_FILE,
-                         data=self._surface.serialise())
-            print('[OKAY] file has been auto-saved to:', INT_AUTO_SAVE_FILE)
+            self.save_snapshot()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def save_snapshot(self):
+        # Save created mesh (on the journal's thread, after the records of the
+        # edits made so far, and compact the journal to the records given)
+        self._journal.snapshot(coords=self._surface.serialise(),
+                               path=INT_AUTO_SAVE_FILE,
+                               records=self.journal_records())
+        print('[OKAY] file has been auto-saved to:', INT_AUTO_SAVE_FILE)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def dump_statistics(self):
+        # Save the update counters of the last interval, with the network
+        # statistics of it, if the session is paired
+        now = perf_counter()
+        if (INT_STATISTICS_INTERVAL and
+            now - self._last_statistics >= INT_STATISTICS_INTERVAL):
+                self._last_statistics = now
+                counters = self._surface.update_counters()
+                try:
+                    self._connection.statistics.dump(INT_STATISTICS_FILE,
+                                                     counters)
+                # If app is not paired
+                except AttributeError:
+                    dump_counters(INT_STATISTICS_FILE, counters)
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def recover_from_auto_save(self):
+    def journal_records(self) -> 'list of kind and payload pairs or None':
+        # Nothing to compact the journal to
+        return None
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def replay_journal(self):
+        # Nothing to redo the journalled edits with
+        pass
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def recover_from_auto_save(self, replay=False):
+        # NOTE: if replay is set, the edits journalled after the auto-save are
+        #       redone as well, e.g. to continue the last session
         self._auto_save_time = self._origo[PROP_TEXT_TIMER]
+        # Wait for the snapshot being saved, if there is one
+        self._journal.flush()
         self._surface.deserialise(load_from_file(INT_AUTO_SAVE_FILE))
+        if replay:
+            self.replay_journal()
+        self._surface.update()
         print('[OKAY] file has been recovered from:', INT_AUTO_SAVE_FILE)
+        # Start the journal over from the recovered state
+        self.save_snapshot()
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -364,9 +495,18 @@ class Application(CallbackManager):
                                   interval=INT_TEXT_INTERVAL)
             except IndexError:
                 return
+            # Continue from where the last session was left, if requested
+            if INT_RECOVER_ON_START and isfile(INT_AUTO_SAVE_FILE):
+                try:
+                    self.recover_from_auto_save(replay=True)
+                except SerialisedDataUnmatched:
+                    print('[FAIL] auto-saved file does not match the surface:',
+                          INT_AUTO_SAVE_FILE)
 
         # Try to create backup
         self.auto_save()
+        # Save the statistics of the last interval
+        self.dump_statistics()
 
         #try:
         #    print('input:', self._lines_queue.get_nowait())
@@ -389,6 +529,16 @@ class Application(CallbackManager):
             self.load()
         elif bge.logic.keyboard.events[HOME_KEY] == JUST_ACTIVATED:
             self.reset_view()
+        elif bge.logic.keyboard.events[P_KEY] == JUST_ACTIVATED:
+            self.toggle_soft_selection()
+        elif bge.logic.keyboard.events[B_KEY] == JUST_ACTIVATED:
+            self.toggle_smoothing()
+        elif bge.logic.keyboard.events[M_KEY] == JUST_ACTIVATED:
+            self.toggle_mirroring()
+        elif bge.logic.keyboard.events[PAGE_UP_KEY] == JUST_ACTIVATED:
+            self.change_level(+1)
+        elif bge.logic.keyboard.events[PAGE_DOWN_KEY] == JUST_ACTIVATED:
+            self.change_level(-1)
         elif bge.logic.keyboard.events[BACK_SPACE_KEY] == JUST_ACTIVATED:
             self._text.clear()
 
@@ -404,6 +554,8 @@ class Application(CallbackManager):
 
         # If leap was unable to get a proper frame
         if not leap_frame.is_valid:
+            # Apply the changes of the keyboard shortcuts anyway
+            self._surface.refresh()
             return print('(leap) Invalid frame', file=stderr)
 
         # Update messaging system
@@ -438,6 +590,9 @@ class Application(CallbackManager):
                     hand.finger_by_leap(finger.type()).position = positioner(finger.tip_position)
                 hand.execute_all_callbacks()
             self._hands.execute_all_callbacks()
+            # Update the mesh at most once per logic tick, after all the
+            # callbacks requested their updates
+            self._surface.refresh()
         except EscapeApplication:
             self._clean_up()
             bge.logic.endGame()
@@ -489,8 +644,10 @@ class Application(CallbackManager):
     def _clean_up(self):
         # Close connection if app is paired
         try:
-            self.connection.stop()
+            self._connection.stop()
         except AttributeError:
             pass
         # Save created mesh
         self.save()
+        # Write the rest of the journal
+        self._journal.close()
@@ -0,0 +1,1915 @@
+## INFO ########################################################################
+##                                                                            ##
+##                                  plastey                                   ##
+##                                  =======                                   ##
+##                                                                            ##
+##      Oculus Rift + Leap Motion + Python 3 + C + Blender + Arch Linux       ##
+##                       Version: 0.2.4.144 (20150514)                        ##
+##                             File: benchmark.py                             ##
+##                                                                            ##
+##               For more information about the project, visit                ##
+##                         <http://plastey.kibu.hu>.                          ##
+##              Copyright (C) 2015 Peter Varo, Kitchen Budapest               ##
+##                                                                            ##
+##  This program is free software: you can redistribute it and/or modify it   ##
+##   under the terms of the GNU General Public License as published by the    ##
+##       Free Software Foundation, either version 3 of the License, or        ##
+##                    (at your option) any later version.                     ##
+##                                                                            ##
+##    This program is distributed in the hope that it will be useful, but     ##
+##         WITHOUT ANY WARRANTY; without even the implied warranty of         ##
+##            MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.            ##
+##            See the GNU General Public License for more details.            ##
+##                                                                            ##
+##     You should have received a copy of the GNU General Public License      ##
+##     along with this program, most likely a file in the root directory,     ##
+##        called 'LICENSE'. If not, see <http://www.gnu.org/licenses>.        ##
+##                                                                            ##
+######################################################################## INFO ##
+
+# Import python modules
+from sys         import argv, getsizeof
+from os.path     import join, getsize
+from tempfile    import mkdtemp
+from struct      import Struct
+from select      import select
+from itertools   import count, cycle
+from heapq       import heappush, heappop
+from threading   import Thread
+from math        import sqrt, sin, cos
+from random      import random, sample, seed
+from socket      import socket, socketpair, AF_INET, SOCK_DGRAM
+from statistics  import pstdev
+from numpy       import array, arange, zeros
+from collections import OrderedDict
+from time        import perf_counter, process_time, sleep
+
+# Import user modules
+from hub           import Hub
+from sync          import VertexSync
+from ownership     import Ownership
+from surface       import Surface
+from levels        import Levels
+from history       import History, Movement
+from journal       import Journal, RECORD_PUSH
+from operations    import OperationLog
+from callback      import CallbackManager
+from utils         import name_of_vertex, index_of_vertex, load_from_file
+from stats         import Statistics
+from snapshot      import (encode,
+                           decode,
+                           checksum,
+                           SnapshotSender,
+                           SnapshotReceiver)
+from socket        import timeout as SocketTimeout
+from communication import (HEADER,
+                           BACKOFF_LIMIT,
+                           MSG_DELTA,
+                           MSG_RESTART,
+                           MSG_CLAIM,
+                           MSG_SNAPSHOT,
+                           MSG_CONNECTED,
+                           ConnectionClosed,
+                           ConnectionTimeout,
+                           Peer,
+                           Server,
+                           Client,
+                           Datagram,
+                           Exchange)
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Module level constants
+LOOPBACK = '127.0.0.1'
+TICK     = 1/75
+STAMP    = Struct('!d')
+REPORT   = '[ BENCH ] {:<48} {}'
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Module level variables
+benchmarks = OrderedDict()
+
+
+
+# Helper functions
+#------------------------------------------------------------------------------#
+def benchmark(function):
+    benchmarks[function.__name__] = function
+    return function
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def report(name, value):
+    print(REPORT.format(name, value))
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def timeit(function, repeat):
+    start = perf_counter()
+    for _ in range(repeat):
+        function()
+    return (perf_counter() - start)/repeat
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values)*percent/100))]
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def random_vertices(count):
+    return [(i, random(), random(), random()) for i in range(count)]
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def connected_pair():
+    server = Server(this_host=LOOPBACK, this_port=0)
+    client = Client(this_host=LOOPBACK, this_port=0)
+    thread = Thread(target=server.connect)
+    thread.start()
+    client.connect(*server._socket.getsockname())
+    thread.join()
+    return server, client
+
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+class StandIn:
+
+    # Blender-free object, with any attribute (e.g. localPosition or color)
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+class StandInVertex(StandIn):
+
+    # Like blender, returns a new vector on every read of the local position
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, localPosition, **attributes):
+        super().__init__(**attributes)
+        self.localPosition = localPosition
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    @property
+    def localPosition(self):
+        return list(self._position)
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    @localPosition.setter
+    def localPosition(self, position):
+        self._position = list(position)
+
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+class StandInChildren(dict):
+
+    # Children of a blender object: can be looked up by name, iterates values
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __iter__(self):
+        return iter(self.values())
+
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def stand_in_surface(count, detail_levels=1) -> 'Surface':
+    # Surface of a plane with count vertices and a bit of a noise on it
+    # (the parent of the vertices is not moved, so the world positions of the
+    # vertices are the same as their local positions)
+    side     = max(1, int(count**0.5))
+    children = StandInChildren()
+    for i in range(count):
+        name     = name_of_vertex(i)
+        position = [i%side, i//side, random()/10]
+        children[name] = StandInVertex(name=name,
+                                       color=None,
+                                       localPosition=position,
+                                       worldPosition=position)
+    return Surface(StandIn(update=lambda: None),
+                   StandIn(children=children,
+                           worldPosition=(0, 0, 0),
+                           worldOrientation=((1, 0, 0), (0, 1, 0), (0, 0, 1)),
+                           worldScale=(1, 1, 1)),
+                   0,
+                   detail_levels=detail_levels)
+
+
+
+#------------------------------------------------------------------------------#
+def peer_pair():
+    return tuple(Peer(connection) for connection in socketpair())
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def hiccuping_echo(peer, every=100, hiccup=0.1):
+    # Echo back every message, but stall the network every now and then
+    def echo():
+        try:
+            for i in range(1, 1 << 32):
+                kind, payload = peer.receive()
+                if not i % every:
+                    sleep(hiccup)
+                peer.send(kind, bytes(payload))
+        except (ConnectionClosed, OSError):
+            pass
+    thread = Thread(target=echo, daemon=True)
+    thread.start()
+    return thread
+
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def lossy_link(source, receive, forward,
+               loss=0.05, delay=0.002, jitter=0.03, ordered=False, stall=0.2):
+    # Forward everything received from source with random delays: if ordered,
+    # lost packets are emulated as retransmission-stalls (head-of-line
+    # blocking, like TCP does), otherwise they are dropped and the rest can be
+    # reordered (like UDP does)
+    def link():
+        queue   = []
+        last    = 0
+        counter = count()
+        try:
+            while True:
+                timeout = (max(0, queue[0][0] - perf_counter()) if queue else
+                           None)
+                readable, _, _ = select((source,), (), (), timeout)
+                if readable:
+                    item = receive()
+                    # If source has been closed
+                    if item is None:
+                        return
+                    due  = perf_counter() + delay + random()*jitter
+                    if random() < loss:
+                        if not ordered:
+                            continue
+                        due += stall
+                    if ordered:
+                        due = last = max(due, last)
+                    heappush(queue, (due, next(counter), item))
+                now = perf_counter()
+                while queue and queue[0][0] <= now:
+                    forward(heappop(queue)[2])
+        except (ConnectionClosed, OSError, ValueError):
+            pass
+    thread = Thread(target=link, daemon=True)
+    thread.start()
+    return thread
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def lossy_stream_pair(**link):
+    this, this_relay   = socketpair()
+    other_relay, other = socketpair()
+    for source, target in ((this_relay, other_relay),
+                           (other_relay, this_relay)):
+        lossy_link(source,
+                   lambda source=source: source.recv(65536) or None,
+                   target.sendall,
+                   ordered=True,
+                   **link)
+    return Peer(this), Peer(other)
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def lossy_datagram_pair(**link):
+    relay = socket(AF_INET, SOCK_DGRAM)
+    relay.bind((LOOPBACK, 0))
+    this  = Datagram(this_host=LOOPBACK, this_port=0)
+    other = Datagram(this_host=LOOPBACK, this_port=0)
+    this.connect(*relay.getsockname())
+    other.connect(*relay.getsockname())
+    peers = {this._socket.getsockname() : other._socket.getsockname(),
+             other._socket.getsockname(): this._socket.getsockname()}
+    def receive():
+        data, address = relay.recvfrom(65536)
+        return data, peers[address]
+    lossy_link(relay, receive, lambda item: relay.sendto(*item), **link)
+    return this, other
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def wire_protocol():
+    # Round-trip throughput over the loopback interface
+    server, client = connected_pair()
+    for count in (2, 100, 1000, 10000):
+        vertices = random_vertices(count)
+        repeat   = 200
+        payload  = VertexSync().pack(vertices)
+        thread   = Thread(target=lambda: [client.transfer(MSG_DELTA, payload)
+                                          for _ in range(repeat)])
+        thread.start()
+        start = perf_counter()
+        for _ in range(repeat):
+            kind, received = server.transfer(MSG_DELTA, payload)
+        elapsed = perf_counter() - start
+        thread.join()
+        assert len(received) == len(payload)
+        report('round-trip ({} vertices)'.format(count),
+               '{:.1f} frames/s, {:.2f} MB/s'.format(
+                   repeat/elapsed,
+                   2*repeat*(HEADER.size + len(payload))/elapsed/2**20))
+    client.stop()
+    server.stop()
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def delta_sync():
+    # Full selection of a 10x10 region surface (11x11 dots), which is held for
+    # 10 seconds at 75 Hz, but only dragged around during 1 second of it
+    count    = 121
+    frames   = 750
+    grabbing = range(300, 375)
+    vertices = random_vertices(count)
+
+    # Previous protocol: every selected vertex is sent every frame, and the
+    # receiver unlocks, relocks, recolors and moves all of them
+    full_bytes = frames*(HEADER.size + count*14)
+    full_calls = frames*(4*count + 1)
+
+    # Delta protocol
+    this, other = VertexSync(), VertexSync()
+    delta_bytes = delta_calls = 0
+    elapsed = 0.0
+    for frame in range(frames):
+        if frame in grabbing:
+            vertices = [(i, x + 0.01, y, z) for i, x, y, z in vertices]
+        start    = perf_counter()
+        sent     = this.pack(vertices)
+        moved, locked, unlocked = other.unpack(sent)
+        this.unpack(other.pack(()))
+        elapsed += perf_counter() - start
+        delta_bytes += HEADER.size + len(sent)
+        delta_calls += (len(moved) + 2*len(locked) +
+                        2*len(unlocked) + (1 if moved else 0))
+    assert set(other.remote()) == set(i for i, *_ in vertices)
+
+    # The same grab, while the peer is not acknowledging anything
+    lonely = VertexSync()
+    for frame in range(frames):
+        lonely.pack([(i, x + frame/1000, y, z) for i, x, y, z in vertices])
+
+    report('bytes sent (full / delta)',
+           '{} / {} bytes'.format(full_bytes, delta_bytes))
+    report('blender calls on receiver (full / delta)',
+           '{} / {}'.format(full_calls, delta_calls))
+    report('pack+unpack per frame (delta)',
+           '{:.2f} us'.format(elapsed/frames*1e6))
+    report('unacknowledged records kept after {} frames'.format(frames),
+           sum(map(len, lonely._pending.values())))
+
+    # The indices of a 100k vertex surface do not fit into 16 bits
+    far       = 99999
+    moved     = VertexSync().unpack(VertexSync().pack([(far, 1, 2, 3)]))[0]
+    ownership = Ownership(rank=1)
+    ownership.claim(far)
+    locked    = Ownership(rank=2).apply(*ownership.flush()[0])[0]
+    report('vertex #{} in a delta / a claim'.format(far),
+           '{} / {}'.format(moved == [(far, (1, 2, 3))], locked == [far]))
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def network_thread():
+    # Logic ticks at 75 Hz for 2 seconds, against a peer which stalls for
+    # 100 ms after every 100 messages it has received
+    ticks = int(2/TICK)
+    for name in ('synchronous', 'exchange'):
+        this, other = peer_pair()
+        hiccuping_echo(other)
+        if name == 'exchange':
+            this = Exchange(this)
+            this.start()
+            def tick():
+                this.send(MSG_DELTA, STAMP.pack(perf_counter()))
+                return this.receive()
+        else:
+            def tick():
+                this.send(MSG_DELTA, STAMP.pack(perf_counter()))
+                kind, payload = this.receive()
+                return [(kind, bytes(payload))]
+
+        durations = []
+        latencies = []
+        for _ in range(ticks):
+            start = perf_counter()
+            for kind, payload in tick():
+                latencies.append(perf_counter() - STAMP.unpack(payload)[0])
+            stop = perf_counter()
+            durations.append(stop - start)
+            sleep(max(0, TICK - (stop - start)))
+        this.stop()
+
+        report('{} tick (median / p99 / max)'.format(name),
+               '{:.3f} / {:.3f} / {:.3f} ms'.format(
+                   percentile(durations, 50)*1e3,
+                   percentile(durations, 99)*1e3,
+                   max(durations)*1e3))
+        report('{} round-trip (median / p99)'.format(name),
+               '{:.3f} / {:.3f} ms'.format(percentile(latencies, 50)*1e3,
+                                           percentile(latencies, 99)*1e3))
+        report('{} jitter (stdev of round-trip)'.format(name),
+               '{:.3f} ms'.format(pstdev(latencies)*1e3))
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def transport_loss():
+    # Latest-state messages at 75 Hz for 3 seconds over a link with 5% packet
+    # loss, 2-32 ms delay and a single reliable restart message in the middle;
+    # staleness is the age of the newest state known by the receiver per tick
+    ticks = int(3/TICK)
+    for name, pair in (('tcp', lossy_stream_pair),
+                       ('udp', lossy_datagram_pair)):
+        this, other = (Exchange(connection) for connection in pair())
+        this.start()
+        other.start()
+        newest    = None
+        staleness = []
+        restarts  = 0
+        for tick in range(ticks):
+            start = perf_counter()
+            this.send(MSG_DELTA, STAMP.pack(start))
+            if tick == ticks//2:
+                this.send(MSG_RESTART)
+            for kind, payload in other.receive():
+                if kind == MSG_RESTART:
+                    restarts += 1
+                else:
+                    newest = max(newest or 0, STAMP.unpack(payload)[0])
+            if newest is not None:
+                staleness.append(perf_counter() - newest)
+            sleep(max(0, TICK - (perf_counter() - start)))
+        sleep(0.5)
+        restarts += sum(1 for kind, _ in other.receive() if kind == MSG_RESTART)
+        this.stop()
+        other.stop()
+
+        report('{} staleness (median / p99 / max)'.format(name),
+               '{:.1f} / {:.1f} / {:.1f} ms'.format(
+                   percentile(staleness, 50)*1e3,
+                   percentile(staleness, 99)*1e3,
+                   max(staleness)*1e3))
+        report('{} restart messages delivered'.format(name), restarts)
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def reliable_order():
+    # Numbered reliable messages at 75 Hz for 3 seconds over a link with 5%
+    # packet loss and reordering, the receiver has to get them in order
+    ticks = int(3/TICK)
+    this, other = lossy_datagram_pair()
+    receiver = other
+    this, other = Exchange(this), Exchange(other)
+    this.start()
+    other.start()
+    received = []
+    for tick in range(ticks):
+        start = perf_counter()
+        for number in range(4*tick, 4*tick + 4):
+            this.send(MSG_CLAIM, STAMP.pack(number))
+        received.extend(STAMP.unpack(payload)[0]
+                        for _, payload in other.receive())
+        sleep(max(0, TICK - (perf_counter() - start)))
+    sleep(0.5)
+    received.extend(STAMP.unpack(payload)[0]
+                    for _, payload in other.receive())
+    this.stop()
+    other.stop()
+
+    report('reliable messages sent / received', '{} / {}'.format(4*ticks,
+                                                              len(received)))
+    report('reliable messages in order',
+           received == [float(number) for number in range(4*ticks)])
+    report('reliable messages still held back', len(receiver._held))
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def datagram_fragments():
+    # 5000 held vertices moved at 75 Hz for 2 seconds (so every delta is larger
+    # than a single datagram) and a claim of 40000 vertices, over a link with
+    # 5% packet loss and reordering
+    ticks    = int(2/TICK)
+    vertices = random_vertices(5000)
+    this, other = (Exchange(connection)
+                       for connection in lossy_datagram_pair())
+    this.start()
+    other.start()
+    sync, peer = VertexSync(), VertexSync()
+    ownership  = Ownership(rank=1)
+    for index in range(40000):
+        ownership.claim(index)
+    claim,  = ownership.flush()
+    size     = 0
+    deltas   = 0
+    claims   = 0
+    errors   = 0
+    for tick in range(ticks):
+        start = perf_counter()
+        delta = sync.pack([(i, x + tick/1000, y, z) for i, x, y, z in vertices])
+        size  = max(size, len(delta))
+        this.send(MSG_DELTA, delta)
+        if tick == ticks//2:
+            this.send(*claim)
+        try:
+            for kind, payload in other.receive():
+                if kind == MSG_DELTA:
+                    deltas += bool(peer.unpack(payload)[0])
+                elif kind == MSG_CLAIM:
+                    claims += payload == claim[1]
+                elif kind == MSG_CONNECTED:
+                    errors += 1
+            this.receive()
+        except (ConnectionClosed, OSError):
+            errors += 1
+            break
+        sleep(max(0, TICK - (perf_counter() - start)))
+    sleep(0.5)
+    claims += sum(payload == claim[1] for kind, payload in other.receive()
+                      if kind == MSG_CLAIM)
+    this.stop()
+    other.stop()
+
+    report('largest delta', '{} bytes'.format(size))
+    report('deltas delivered (of sent)', '{} of {}'.format(deltas, ticks))
+    report('large claims delivered (of sent)', '{} of 1'.format(claims))
+    report('connection errors', errors)
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def exchange_simultaneous():
+    # Both sides send a large message at the same time (e.g. snapshots right
+    # after a reconnection), neither of them can be waiting for the other one
+    for name, pair, size in (('socketpair', peer_pair,      8 << 20),
+                             ('tcp',        connected_pair, 4 << 20)):
+        this, other = (Exchange(connection) for connection in pair())
+        this.start()
+        other.start()
+        start = perf_counter()
+        this.send(MSG_SNAPSHOT, bytes(size))
+        other.send(MSG_SNAPSHOT, bytes(size))
+        received = [0, 0]
+        while perf_counter() - start < 10 and not all(received):
+            for i, exchange in enumerate((this, other)):
+                received[i] += sum(len(payload)
+                                   for _, payload in exchange.receive())
+            sleep(TICK)
+        elapsed = perf_counter() - start
+        this.stop()
+        other.stop()
+
+        report('{} bytes received by both'.format(name),
+               '{} / {}'.format(*received))
+        report('{} elapsed'.format(name), '{:.2f} s'.format(elapsed))
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def hub_fan_out():
+    # Every simulated client holds and moves its own vertex at 75 Hz for 2
+    # seconds, the moved coordinate is the time of the movement, so each client
+    # can measure how old the movements of the others are when they arrive
+    ticks = int(2/TICK)
+    for clients in (2, 4, 8, 16):
+        hub = Hub(this_host=LOOPBACK, this_port=0, max_clients=clients)
+        hub.start()
+        address = hub._connection.listener().getsockname()
+        peers   = []
+        for _ in range(clients):
+            client = Client(this_host=LOOPBACK, this_port=0)
+            client.connect(*address)
+            exchange = Exchange(client)
+            exchange.start()
+            ownership = Ownership(rank=len(peers) + 1)
+            ownership.claim(len(peers))
+            peers.append((exchange, VertexSync(), ownership))
+
+        # A truncated claim, which the hub has to drop instead of stopping
+        peers[0][0].send(MSG_CLAIM, b'\0')
+        origin    = perf_counter()
+        latencies = []
+        for _ in range(ticks):
+            start = perf_counter()
+            for index, (exchange, sync, ownership) in enumerate(peers):
+                for message in ownership.flush():
+                    exchange.send(*message)
+                exchange.send(MSG_DELTA,
+                              sync.pack([(index, perf_counter() - origin, 0, 0)]))
+                for kind, payload in exchange.receive():
+                    if kind != MSG_DELTA:
+                        continue
+                    now = perf_counter() - origin
+                    for _, (x, y, z) in sync.unpack(payload)[0]:
+                        latencies.append(now - x)
+            hub.receive()
+            sleep(max(0, TICK - (perf_counter() - start)))
+        for exchange, *_ in peers:
+            exchange.stop()
+        dropped = hub.statistics.messages_dropped
+        hub.stop()
+
+        report('hub with {:>2} clients latency (median / p99)'.format(clients),
+               '{:.3f} / {:.3f} ms'.format(percentile(latencies, 50)*1e3,
+                                           percentile(latencies, 99)*1e3))
+        report('hub with {:>2} clients updates per client per tick'.format(
+                   clients),
+               '{:.2f} of {}'.format(len(latencies)/ticks/clients, clients - 1))
+        report('hub with {:>2} clients malformed messages dropped'.format(
+                   clients), dropped)
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def ownership_churn():
+    # Two users hold 50 vertices each for 2 seconds at 75 Hz, and every half a
+    # second both of them release those and pick 50 others, where one of the
+    # vertices is picked by both of them at the same time
+    ticks   = int(2/TICK)
+    held    = 50
+    this    = Ownership(rank=0)
+    other   = Ownership(rank=1)
+    alone   = Ownership(rank=0, shared=False)
+    users   = (this, []), (other, [])
+    changes = 0
+    flips   = 0
+    size    = 0
+    for tick in range(ticks):
+        if not tick % int(0.5/TICK):
+            base = 2*held*tick
+            for offset, (ownership, picked) in enumerate(users):
+                for index in picked:
+                    ownership.release(index)
+                picked[:] = range(base + offset*held, base + (offset + 1)*held)
+                picked.append(base + 2*held)
+                for index in picked:
+                    ownership.claim(index)
+                    # The same changes made without a peer to flush them to
+                    alone.claim(index)
+                    alone.release(index)
+        # Exchange messages in both directions simultaneously
+        messages = this.flush(), other.flush()
+        for (ownership, picked), received in zip(users, reversed(messages)):
+            for kind, payload in received:
+                size += len(payload)
+                locked, unlocked, lost, gained = ownership.apply(kind, payload)
+                changes += len(locked) + len(unlocked) + len(lost) + len(gained)
+                flips   += len(lost)
+
+    report('lock changes (per-frame rebuild / ownership)',
+           '{} / {}'.format(2*ticks*2*(held + 1), changes))
+    report('ownership bytes in 2 seconds', size)
+    report('contested picks lost (of {})'.format(-(-ticks//int(0.5/TICK))),
+           flips)
+    report('tables agree', sorted(this) == sorted(other))
+    report('messages queued without a peer', len(alone.flush()))
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def surface_snapshot():
+    for vertices in (1000, 10000):
+        surface = stand_in_surface(vertices)
+        coords  = surface.serialise()
+        prefix  = 'snapshot {:>5} vertices'.format(vertices)
+        report(prefix + ' float32 (raw / zlib)',
+               '{} / {} bytes'.format(4*len(coords), len(encode(coords))))
+        report(prefix + ' quantised (zlib)',
+               '{} bytes'.format(len(encode(coords, 16))))
+        data = encode(coords)
+        report(prefix + ' encode / decode',
+               '{:.3f} / {:.3f} ms'.format(
+                   timeit(lambda: encode(coords), 10)*1e3,
+                   timeit(lambda: decode(data), 10)*1e3))
+        report(prefix + ' checksum',
+               '{:.3f} ms'.format(timeit(lambda: checksum(coords), 10)*1e3))
+
+        # Time spent on sending and receiving per logic tick
+        sender   = SnapshotSender()
+        receiver = SnapshotReceiver()
+        sender.start(coords)
+        durations = []
+        received  = None
+        while received is None:
+            start = perf_counter()
+            for _, payload in sender.next():
+                received = receiver.add(payload)
+            durations.append(perf_counter() - start)
+        report(prefix + ' ticks (max per tick)',
+               '{} ({:.3f} ms)'.format(len(durations), max(durations)*1e3))
+
+        # Applying received coordinates, one name lookup per vertex vs bulk
+        children = surface._vertices.children
+        def by_name():
+            for i, coord in enumerate(zip(*(iter(received),)*3)):
+                children[name_of_vertex(i)].localPosition = coord
+        # (every vertex is moved by every bulk apply, and written to blender)
+        resyncs = cycle(([c + 1 for c in received], received))
+        def bulk():
+            surface.deserialise(next(resyncs))
+            surface.refresh()
+        report(prefix + ' apply (by name / bulk)',
+               '{:.3f} / {:.3f} ms'.format(timeit(by_name, 10)*1e3,
+                                           timeit(bulk, 10)*1e3))
+        report(prefix + ' surfaces agree',
+               checksum(surface.serialise()) == checksum(coords))
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def statistics_overhead():
+    # Cost of the counters compared to the cost of the messages they count
+    messages = 100000
+    payload  = bytes(64)
+    this, other = peer_pair()
+    def exchange():
+        for _ in range(100):
+            this.post(MSG_DELTA, payload)
+        this.flush()
+        while other.statistics.messages_received < this.statistics.messages_sent:
+            other.receive_nowait()
+    message_path = timeit(exchange, messages//100)/100
+    this.stop()
+    other.stop()
+
+    # NOTE: the cost of calling the measured function itself is subtracted
+    statistics = Statistics()
+    empty      = timeit(lambda: None, messages)
+    def count():
+        statistics.messages_sent     += 1
+        statistics.bytes_sent        += 69
+        statistics.messages_received += 1
+        statistics.bytes_received    += 69
+    counters = timeit(count, messages) - empty
+    def tick():
+        statistics.queue(1, 69)
+        statistics.time('blender_read', 1e-5)
+        statistics.time('pack', 1e-5)
+        statistics.time('unpack', 1e-5)
+        statistics.time('blender_write', 1e-5)
+        statistics.round_trip(1e-3)
+    timings = timeit(tick, messages) - empty
+
+    report('message path (post, flush, receive)',
+           '{:.3f} us/message'.format(message_path*1e6))
+    report('byte and message counters',
+           '{:.3f} us/message ({:.1f}%)'.format(counters*1e6,
+                                               counters/message_path*100))
+    report('queue, timings and round-trip per logic tick',
+           '{:.3f} us/tick ({:.4f}% of a tick)'.format(timings*1e6,
+                                                       timings/TICK*100))
+    report('snapshot', '{:.3f} us'.format(timeit(statistics.snapshot,
+                                                 1000)*1e6))
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def reconnect():
+    # A client waits for a stand-in server, which goes up and down three times
+    probe = socket(AF_INET)
+    probe.bind((LOOPBACK, 0))
+    address = probe.getsockname()
+    probe.close()
+
+    def wait_for(exchange, kind, limit=10):
+        start = perf_counter()
+        while perf_counter() - start < limit:
+            if any(k == kind for k, _ in exchange.receive()):
+                return perf_counter() - start
+            sleep(0.001)
+
+    # Nobody is listening, connecting should give up after the timeout
+    start = perf_counter()
+    try:
+        Client(this_host=LOOPBACK, this_port=0).connect(*address, timeout=0.3)
+    except ConnectionTimeout:
+        report('connect with 0.3 s timeout gave up after',
+               '{:.3f} s'.format(perf_counter() - start))
+
+    client = Exchange(Client(this_host=LOOPBACK, this_port=0),
+                      address=address,
+                      reconnect=True)
+    start = perf_counter()
+    client.start()
+    report('starting the client exchange took',
+           '{:.3f} ms'.format((perf_counter() - start)*1e3))
+    for cycle in range(3):
+        # Server is down
+        wall = perf_counter()
+        cpu  = process_time()
+        sleep(1)
+        report('cycle {} cpu used while server is down'.format(cycle),
+               '{:.1f}%'.format((process_time() - cpu)/
+                                (perf_counter() - wall)*100))
+        # Server is up
+        server = Exchange(Server(this_host=address[0], this_port=address[1]),
+                          address=address)
+        server.start()
+        latency = wait_for(client, MSG_CONNECTED)
+        client.send(MSG_RESTART)
+        report('cycle {} reconnected after server is up'.format(cycle),
+               '{:.3f} s'.format(latency))
+        report('cycle {} message delivered after reconnect'.format(cycle),
+               wait_for(server, MSG_RESTART) is not None)
+        server.stop()
+    # Stopped while the server is down, the client should neither retry, nor
+    # connect later, when the server is up again
+    start = perf_counter()
+    client.stop()
+    report('stopping the retrying client took',
+           '{:.3f} s'.format(perf_counter() - start))
+    server   = Server(this_host=address[0], this_port=address[1])
+    listener = server.listener()
+    listener.settimeout(2*BACKOFF_LIMIT)
+    try:
+        listener.accept()[0].close()
+        ghost = True
+    except SocketTimeout:
+        ghost = False
+    server.stop()
+    report('stopped client connected later', ghost)
+    report('stopped client worker still alive', client.is_alive())
+
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def spatial_pick():
+    # Picking a vertex by checking every one of them (as on_pick did) vs asking
+    # the spatial index, half of the picks are in the air between the vertices
+    radius = 0.25
+    for vertices in (1000, 10000, 100000):
+        surface = stand_in_surface(vertices)
+        side    = int(vertices**0.5)
+        picks   = [(random()*side, random()*side, random()/10)
+                      for _ in range(100)]
+        def linear(point):
+            for vertex in surface:
+                position = vertex.worldPosition
+                if sqrt((position[0] - point[0])**2 +
+                        (position[1] - point[1])**2 +
+                        (position[2] - point[2])**2) < radius:
+                    return vertex
+        picked = iter(picks)
+        prefix = 'pick {:>6} vertices'.format(vertices)
+        report(prefix + ' linear scan',
+               '{:.3f} ms'.format(
+                   timeit(lambda: linear(next(picked)), len(picks))*1e3))
+        start = perf_counter()
+        surface.nearest(picks[0], radius)
+        report(prefix + ' index build (first pick)',
+               '{:.3f} ms'.format((perf_counter() - start)*1e3))
+        picked = iter(picks)
+        report(prefix + ' index',
+               '{:.3f} ms'.format(timeit(lambda: surface.nearest(next(picked),
+                                                                 radius),
+                                         len(picks))*1e3))
+
+        # Grabbing 50 vertices moves them every tick
+        grabbed = sample(range(vertices), 50)
+        def grab():
+            surface.move_vertices(grabbed, translation=(0, 0, 0.01))
+            surface.nearest(picks[0], radius)
+        report(prefix + ' index update (50 moved)',
+               '{:.3f} ms'.format(timeit(grab, 100)*1e3))
+        surface.refresh()
+        for vertex in surface:
+            vertex.worldPosition = vertex.localPosition
+
+        # Both find the same vertices, even if the surface is rotated and scaled
+        def closest(point):
+            distances = [(sum((a - b)**2 for a, b in zip(v.worldPosition,
+                                                         point)), v)
+                            for v in surface]
+            distance, vertex = min(distances, key=lambda item: item[0])
+            return vertex if distance < radius*radius else None
+        def agree():
+            return all((surface.nearest(point, radius) or (None, None))[1] is
+                       closest(point) for point in picks[:10])
+        agree_before = agree()
+        angle  = 0.5
+        parent = surface._vertices
+        parent.worldPosition    = 1, 2, 3
+        parent.worldOrientation = ((cos(angle), -sin(angle), 0),
+                                   (sin(angle),  cos(angle), 0),
+                                   (         0,           0, 1))
+        parent.worldScale       = 2, 2, 2
+        def to_world(position):
+            x, y, z = (2*c for c in position)
+            return (1 + cos(angle)*x - sin(angle)*y,
+                    2 + sin(angle)*x + cos(angle)*y,
+                    3 + z)
+        for vertex in surface:
+            vertex.worldPosition = to_world(vertex.localPosition)
+        picks = [to_world(point) for point in picks]
+        report(prefix + ' linear scan and index agree',
+               agree_before and agree())
+
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def position_store():
+    # Per-vertex attribute access of the blender objects (as the surface did)
+    # vs the array of positions mirrored into blender in bulk, with a 1000 of
+    # the vertices selected and moved in every tick
+    for vertices in (10000, 100000):
+        surface  = stand_in_surface(vertices)
+        children = surface._vertices.children
+        by_index = [children[name_of_vertex(i)] for i in range(vertices)]
+        selected = sorted(sample(range(vertices), 1000))
+        for i in selected:
+            surface.select(i)
+        prefix = 'store {:>6} vertices'.format(vertices)
+
+        def serialise():
+            coords = []
+            for vertex in by_index:
+                coords.extend(vertex.localPosition)
+            return coords
+        report(prefix + ' serialise (objects / array)',
+               '{:.3f} / {:.3f} ms'.format(timeit(serialise, 10)*1e3,
+                                           timeit(surface.serialise, 10)*1e3))
+
+        def collect():
+            return [(i,) + tuple(vertex.localPosition)
+                       for i, vertex in zip(selected, map(by_index.__getitem__,
+                                                          selected))]
+        report(prefix + ' collect selected (objects / array)',
+               '{:.3f} / {:.3f} ms'.format(
+                   timeit(collect, 100)*1e3,
+                   timeit(surface.selected_positions, 100)*1e3))
+
+        def grab():
+            for i in selected:
+                vertex   = by_index[i]
+                position = vertex.localPosition
+                vertex.localPosition = [position[0] + 0.01,
+                                        position[1],
+                                        position[2]]
+        rows = surface.selected_indices()
+        def grab_array():
+            surface.move_vertices(rows, translation=(0.01, 0, 0))
+            surface.refresh()
+        report(prefix + ' grab (objects / array + flush)',
+               '{:.3f} / {:.3f} ms'.format(timeit(grab, 100)*1e3,
+                                           timeit(grab_array, 100)*1e3))
+
+        moved = [(i, (random(), random(), random())) for i in selected]
+        def apply():
+            for i, position in moved:
+                children[name_of_vertex(i)].localPosition = position
+        def apply_array():
+            surface.place(*zip(*moved))
+            surface.refresh()
+        report(prefix + ' apply remote (objects / array + flush)',
+               '{:.3f} / {:.3f} ms'.format(timeit(apply, 100)*1e3,
+                                           timeit(apply_array, 100)*1e3))
+        report(prefix + ' array and objects agree',
+               checksum(serialise()) == checksum(surface.serialise()))
+
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def bulk_transform():
+    # Moving the vertices one by one (as on_grab did) vs one call transforming
+    # all of them, the blender objects are written by the next update
+    for vertices in (1000, 10000, 100000):
+        surface  = stand_in_surface(vertices)
+        by_index = [surface[i] for i in range(vertices)]
+        rows     = arange(vertices)
+        angle    = 0.01
+        rotation = ((cos(angle), -sin(angle), 0),
+                    (sin(angle),  cos(angle), 0),
+                    (         0,           0, 1))
+        weights  = [random() for _ in rows]
+        prefix   = 'move {:>6} vertices'.format(vertices)
+
+        def one_by_one():
+            for vertex in by_index:
+                position = vertex.localPosition
+                vertex.localPosition = [position[0] + 0.01,
+                                        position[1],
+                                        position[2]]
+        report(prefix + ' translate (one by one / bulk)',
+               '{:.3f} / {:.3f} ms'.format(
+                   timeit(one_by_one, 10)*1e3,
+                   timeit(lambda: surface.move_vertices(
+                       rows, translation=(0.01, 0, 0)), 10)*1e3))
+        report(prefix + ' rotate and scale (bulk)',
+               '{:.3f} ms'.format(timeit(lambda: surface.move_vertices(
+                   rows, rotation=rotation, scale=1.001), 10)*1e3))
+        report(prefix + ' weighted translate (bulk)',
+               '{:.3f} ms'.format(timeit(lambda: surface.move_vertices(
+                   rows, translation=(0.01, 0, 0), weights=weights), 10)*1e3))
+        report(prefix + ' write to blender (refresh)',
+               '{:.3f} ms'.format(timeit(surface.refresh, 1)*1e3))
+
+        # Rotating a full turn around the pivot, and scaling back, leaves the
+        # vertices where they were, and the locked ones are never moved
+        surface.lock(0)
+        original = surface.positions.copy()
+        for _ in range(4):
+            surface.move_vertices(rows, rotation=((0, -1, 0),
+                                                  (1,  0, 0),
+                                                  (0,  0, 1)),
+                                  scale=2, pivot=(1, 2, 3))
+        surface.move_vertices(rows, scale=1/16, pivot=(1, 2, 3))
+        report(prefix + ' transformations are consistent',
+               abs(surface.positions - original).max() < 1e-3)
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def soft_selection():
+    # Computing the neighbours and the weights of a selection once (at the
+    # start of a grab), then moving them at each frame of the grab
+    for vertices in (10000, 100000):
+        surface = stand_in_surface(vertices)
+        rest    = surface.positions.copy()
+        side    = int(vertices**0.5)
+        centre  = side//2*side + side//2
+        prefix  = 'soft {:>6} vertices'.format(vertices)
+        # The spatial index of the generated surface is built on first use
+        report(prefix + ' build index (first falloff)',
+               '{:.3f} ms'.format(timeit(lambda: surface.falloff([0], 1), 1)*1e3))
+        for patch, radius in ((1, 10), (5, 10), (30, 5)):
+            selection = array([centre + i*side + j for i in range(patch)
+                                                   for j in range(patch)])
+            # Different radius for each repetition, so nothing is cached
+            radii = iter(radius + i*1e-6 for i in count())
+            rows, weights = surface.falloff(selection, radius, 'smooth')
+            name = prefix + ' {:>4} selected, radius {:>2}'.format(patch*patch,
+                                                                  radius)
+            report(name + ' affected',
+                   '{} vertices'.format(len(rows)))
+            report(name + ' precompute / cached',
+                   '{:.3f} / {:.3f} ms'.format(
+                       timeit(lambda: surface.falloff(selection, next(radii),
+                                                      'smooth'), 5)*1e3,
+                       timeit(lambda: surface.falloff(selection, radius,
+                                                      'smooth'), 100)*1e3))
+            report(name + ' frame (hard / soft)',
+                   '{:.3f} / {:.3f} ms'.format(
+                       timeit(lambda: surface.move_vertices(
+                           selection, translation=(0, 0, 0.01)), 100)*1e3,
+                       timeit(lambda: surface.move_vertices(
+                           rows, translation=(0, 0, 0.01),
+                           weights=weights), 100)*1e3))
+
+        # The selected vertices move all the way, the others less by distance,
+        # and the weights are measured on the generated surface, so they stay
+        # the same, however the vertices were moved since
+        rows, weights = surface.falloff([centre], 3, 'linear')
+        distances = ((rest[rows] - rest[centre])**2).sum(axis=1)**0.5
+        report(prefix + ' weights follow the falloff',
+               abs(weights - (1 - distances/3)).max() < 1e-6)
+        surface.move_vertices(rows, translation=(0, 0, 100))
+        again, same = surface.falloff([centre], 3 + 1e-9, 'linear')
+        report(prefix + ' weights are independent of sculpting',
+               rows.tolist() == again.tolist() and
+               abs(weights - same).max() < 1e-6)
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def vertex_identity():
+    # Vertices looked up by their names (formatted and parsed at every pick,
+    # and probed one by one when serialised, as the surface did) vs by their
+    # indices in the table collected once
+    for vertices in (10000, 100000):
+        surface  = stand_in_surface(vertices)
+        children = surface._vertices.children
+        # (the wire format of the ownership messages has 16 bit indices)
+        picks    = sample(range(min(vertices, 1 << 16)), 1000)
+        prefix   = 'identity {:>6} vertices'.format(vertices)
+
+        def serialise_by_name():
+            coords = []
+            try:
+                for i in count():
+                    coords.extend(children[name_of_vertex(i)].localPosition)
+            except KeyError:
+                return coords
+        report(prefix + ' serialise (names / indices)',
+               '{:.3f} / {:.3f} ms'.format(
+                   timeit(serialise_by_name, 10)*1e3,
+                   timeit(surface.serialise, 10)*1e3))
+
+        # A pick selects (claims) and colors a vertex, a swipe deselects all
+        ownership = Ownership(0)
+        selected  = {}
+        def pick_by_name():
+            for i in picks:
+                name   = name_of_vertex(i)
+                vertex = children[name]
+                ownership.claim(index_of_vertex(vertex.name))
+                selected[name] = vertex
+                vertex.color   = None
+            for vertex in selected.values():
+                ownership.release(index_of_vertex(vertex.name))
+            selected.clear()
+            ownership.flush()
+        def pick_by_index():
+            for i in picks:
+                surface.select(i).color = None
+            surface.deselect_all()
+            surface.ownership_messages()
+        report(prefix + ' 1000 picks (names / indices)',
+               '{:.3f} / {:.3f} ms'.format(timeit(pick_by_name, 10)*1e3,
+                                           timeit(pick_by_index, 10)*1e3))
+        report(prefix + ' same vertices',
+               all(surface[i] is children[name_of_vertex(i)] for i in picks) and
+               checksum(serialise_by_name()) == checksum(surface.serialise()))
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def coalesced_update():
+    # A second of logic ticks at 75Hz: a grab step in most of the ticks, two
+    # packets of the opponent user in every third one, and a request without
+    # any change in every fifth one. Every update request updated the mesh (as the
+    # surface did) vs one refresh at the end of the tick, if anything changed
+    for vertices in (1000, 10000):
+        prefix  = 'update {:>5} vertices'.format(vertices)
+        results = []
+        for eager in (True, False):
+            seed(vertices)
+            surface = stand_in_surface(vertices)
+            updates = [0]
+            # Stand-in of the armature and mesh update, touching every vertex
+            def deform():
+                updates[0] += 1
+                for vertex in surface:
+                    vertex.worldPosition
+            surface._surface.update = deform
+            grabbed = arange(50)
+            remote  = arange(50, 100)
+            def update():
+                surface.update()
+                if eager:
+                    surface.flush()
+                    deform()
+            def ticks():
+                for tick in range(75):
+                    if tick%5:
+                        surface.move_vertices(grabbed, translation=(0, 0, 0.01))
+                        update()
+                    else:
+                        update()
+                    for packet in range(0 if tick%3 else 2):
+                        surface.place(remote, surface.positions[remote] + 0.01)
+                        update()
+                    if not eager:
+                        surface.refresh()
+            surface.update_counters()
+            duration = timeit(ticks, 1)
+            counted  = surface.update_counters()
+            results.append((updates[0], duration,
+                            counted['updates_requested'],
+                            [tuple(v.localPosition) for v in surface]))
+        (eager_updates, eager_time, requested, eager_positions), \
+        (lazy_updates, lazy_time, _, lazy_positions) = results
+        report(prefix + ' requests per second',
+               '{}'.format(requested))
+        report(prefix + ' mesh updates per second (eager / coalesced)',
+               '{} / {}'.format(eager_updates, lazy_updates))
+        report(prefix + ' second of ticks (eager / coalesced)',
+               '{:.3f} / {:.3f} ms'.format(eager_time*1e3, lazy_time*1e3))
+        report(prefix + ' surfaces agree',
+               eager_positions == lazy_positions)
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def detail_levels():
+    # Only the vertices of the coarse level are shown and picked, the hidden
+    # ones follow them, and the region where the user works is refined
+    for vertices in (10000, 100000):
+        prefix = 'levels {:>6} vertices'.format(vertices)
+        start  = perf_counter()
+        surface = stand_in_surface(vertices, detail_levels=4)
+        report(prefix + ' surface with 4 levels (create)',
+               '{:.3f} ms'.format((perf_counter() - start)*1e3))
+        for level in range(4):
+            start = perf_counter()
+            surface.set_level(level)
+            built = perf_counter() - start
+            start = perf_counter()
+            surface.nearest((0, 0, 0), 1)
+            report(prefix + ' level #{} shown vertices'.format(level),
+                   '{} ({:.3f} ms to set, {:.3f} ms to index)'.format(
+                        sum(map(surface.is_active, range(vertices))),
+                        built*1e3, (perf_counter() - start)*1e3))
+
+        # Grabbing 50 vertices of the coarsest level moves their followers too
+        shown   = [i for i in range(vertices) if surface.is_active(i)]
+        grabbed = array(sample(shown, 50))
+        surface.move_vertices(grabbed, translation=(0, 0, 0.01))
+        report(prefix + ' grab 50 (coarsest level, with followers)',
+               '{:.3f} ms'.format(timeit(lambda: surface.move_vertices(
+                   grabbed, translation=(0, 0, 0.01)), 100)*1e3))
+        # (the index of the generated surface is built by the first one)
+        surface.refine(grabbed[1:2], 10)
+        report(prefix + ' refine around a vertex (radius 10)',
+               '{:.3f} ms'.format(timeit(lambda: surface.refine(
+                   grabbed[:1], 10), 1)*1e3))
+
+        # Moving all the shown vertices the same way moves the hidden ones the
+        # same way as well, and the refined ones can be picked
+        shown    = [i for i in range(vertices) if surface.is_active(i)]
+        original = surface.positions.copy()
+        surface.move_vertices(array(shown), translation=(0, 0, 1))
+        report(prefix + ' hidden vertices follow',
+               abs(surface.positions - original - (0, 0, 1)).max() < 1e-3)
+        index = surface.falloff(grabbed[:1], 10)[0][-1]
+        report(prefix + ' refined vertices can be picked',
+               surface.nearest(surface.positions[index].tolist(),
+                               0.01)[0] == index)
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def volume_select():
+    # Selecting the vertices of a volume one by one (a pick for each of them)
+    # vs a single query over all the vertices, and a batched selection
+    for vertices in (10000, 100000):
+        surface = stand_in_surface(vertices)
+        side    = int(vertices**0.5)
+        prefix  = 'volume {:>6} vertices'.format(vertices)
+        for fraction in (0.01, 0.1, 0.5):
+            edge   = side*fraction**0.5
+            first  = (side/2 - edge/2, side/2 - edge/2, -1)
+            second = (side/2 + edge/2, side/2 + edge/2,  1)
+            def one_by_one():
+                return [i for i, vertex in enumerate(surface)
+                            if all(a <= c <= b for a, c, b in
+                                       zip(first, vertex.worldPosition, second))]
+            name = prefix + ' {:>4.0%} in box'.format(fraction)
+            report(name + ' query (one by one / batched)',
+                   '{:.3f} / {:.3f} ms'.format(
+                       timeit(one_by_one, 1)*1e3,
+                       timeit(lambda: surface.inside('box', first, second),
+                              10)*1e3))
+            report(name + ' query sphere (batched)',
+                   '{:.3f} ms'.format(timeit(lambda: surface.inside(
+                       'sphere', first, second), 10)*1e3))
+            inside = surface.inside('box', first, second)
+            report(name + ' select / deselect (batched)',
+                   '{:.3f} / {:.3f} ms'.format(
+                       timeit(lambda: surface.select_many(inside), 1)*1e3,
+                       timeit(lambda: surface.deselect_many(inside), 1)*1e3))
+            # NOTE: the wire format can only address the first 65536 vertices
+            if vertices <= 1 << 16:
+                surface.ownership_messages()
+            report(name + ' agrees', inside.tolist() == one_by_one())
+
+        # Both shapes are in world space, even if the surface is rotated
+        angle  = 0.5
+        parent = surface._vertices
+        parent.worldPosition    = 1, 2, 3
+        parent.worldOrientation = ((cos(angle), -sin(angle), 0),
+                                   (sin(angle),  cos(angle), 0),
+                                   (         0,           0, 1))
+        parent.worldScale       = 2, 2, 2
+        world = [(1 + 2*cos(angle)*x - 2*sin(angle)*y,
+                  2 + 2*sin(angle)*x + 2*cos(angle)*y,
+                  3 + 2*z) for x, y, z in surface.positions.tolist()]
+        first, second = (0, 0, 0), (side/2, side/2, 10)
+        centre = [(a + b)/2 for a, b in zip(first, second)]
+        radius = sum((b - a)**2 for a, b in zip(first, second))/4
+        report(prefix + ' shapes agree when transformed',
+               surface.inside('box', first, second).tolist() ==
+                   [i for i, w in enumerate(world)
+                          if all(a - 1e-3 <= c <= b + 1e-3
+                                     for a, c, b in zip(first, w, second))] and
+               surface.inside('sphere', first, second).tolist() ==
+                   [i for i, w in enumerate(world)
+                          if sum((c - m)**2 for c, m in zip(w, centre)) <=
+                             radius])
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def smoothing():
+    # Relaxing the vertices under the brush with the adjacent vertices looked
+    # up one by one (in the spatial index) vs precomputed and averaged at once
+    for vertices in (10000, 100000):
+        seed(vertices)
+        surface = stand_in_surface(vertices)
+        side    = int(vertices**0.5)
+        centre  = side//2*side + side//2
+        prefix  = 'smooth {:>6} vertices'.format(vertices)
+        # The adjacent vertices of the generated surface are found once
+        report(prefix + ' find adjacent (create surface)',
+               '{:.3f} ms'.format(timeit(lambda: Levels(surface.positions,
+                                                        1).adjacent(), 1)*1e3))
+
+        # A single iteration moves each vertex to the average of the vertices
+        # around it, more iterations make the noise smaller, and the stroke
+        # can be undone
+        rows, _   = surface.falloff([centre], 5)
+        positions = surface.positions.copy()
+        expected  = []
+        for index in rows.tolist():
+            distances = ((positions - positions[index])**2).sum(axis=1)
+            around    = (distances < 1.5**2) & (distances > 0)
+            expected.append(positions[around].mean(axis=0))
+        _, before, after = surface.smooth(rows, strength=1)
+        report(prefix + ' vertices move to the average',
+               abs(after - array(expected)).max() < 1e-4)
+        inner = surface.falloff([centre], 3)[0]
+        surface.smooth(rows, iterations=10)
+        report(prefix + ' noise of the stroke (before / after)',
+               '{:.4f} / {:.4f}'.format(positions[inner, 2].std(),
+                                        surface.positions[inner, 2].std()))
+        surface.restore(rows, positions[rows])
+        report(prefix + ' stroke can be undone',
+               (surface.positions == positions).all())
+
+        # (the spatial index is built by the first query)
+        surface.within((0, 0, 0), 1)
+        for radius in (2, 10, 30):
+            rows, weights = surface.falloff([centre], radius)
+            def one_by_one():
+                positions = surface.positions
+                averages  = []
+                for index in rows.tolist():
+                    around = [i for i, _ in surface.within(
+                                  positions[index].tolist(), 1.5)
+                                  if i != index]
+                    averages.append(positions[around].mean(axis=0))
+                surface.place(rows, positions[rows] + 0.5*weights[:, None]*
+                                    (array(averages) - positions[rows]))
+            name = prefix + ' radius {:>2} ({:>4} vertices)'.format(radius,
+                                                                   len(rows))
+            report(name + ' iteration (one by one / bulk)',
+                   '{:.3f} / {:.3f} ms'.format(
+                       timeit(one_by_one, 1)*1e3,
+                       timeit(lambda: surface.smooth(rows, weights), 20)*1e3))
+            report(name + ' frame (8 iterations, 4 ms budget)',
+                   '{:.3f} ms'.format(timeit(lambda: surface.smooth(
+                       rows, weights, iterations=8, budget=0.004), 20)*1e3))
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def mirror_editing():
+    # Moving and smoothing the vertices with and without their mirrors (which
+    # are moved in the same batch), and the mirrors found once on each axis
+    for vertices in (10000, 100000):
+        seed(vertices)
+        surface = stand_in_surface(vertices)
+        side    = int(vertices**0.5)
+        centre  = side//2*side + side//4
+        prefix  = 'mirror {:>6} vertices'.format(vertices)
+        for axis in ('x', 'y'):
+            report(prefix + ' find mirrors on {}'.format(axis),
+                   '{:.3f} ms'.format(timeit(lambda: surface.symmetric(
+                       [0], axis), 1)*1e3))
+        # (the last, partial row of the vertices is not symmetric)
+        every = arange(side*side)
+        left  = every[every%side < side//2]
+        rows, _ = surface.symmetric(left, 'x')
+        right   = rows[len(left):]
+        report(prefix + ' vertices of the left side with a mirror',
+               '{:.1%}'.format(len(right)/len(left)))
+
+        for radius in (1, 10, 30):
+            rows, weights = surface.falloff([centre], radius)
+            name = prefix + ' radius {:>2} ({:>4} vertices)'.format(radius,
+                                                                   len(rows))
+            # (moving the mirrors costs as much as moving the vertices of both
+            # sides without mirroring)
+            both, sources = surface.symmetric(rows, 'x')
+            report(name + ' grab (plain / both sides / mirrored)',
+                   '{:.3f} / {:.3f} / {:.3f} ms'.format(
+                       timeit(lambda: surface.move_vertices(
+                           rows, translation=(0, 0, 0.01),
+                           weights=weights), 100)*1e3,
+                       timeit(lambda: surface.move_vertices(
+                           both, translation=(0, 0, 0.01),
+                           weights=weights[sources]), 100)*1e3,
+                       timeit(lambda: surface.move_vertices(
+                           rows, translation=(0, 0, 0.01),
+                           weights=weights, mirror='x'), 100)*1e3))
+            report(name + ' smooth (plain / mirrored)',
+                   '{:.3f} / {:.3f} ms'.format(
+                       timeit(lambda: surface.smooth(rows, weights), 100)*1e3,
+                       timeit(lambda: surface.smooth(both, weights[sources]),
+                              100)*1e3))
+
+        # If the surface is symmetric, it stays symmetric, however the
+        # vertices of one side are moved, rotated and scaled
+        def mirrored(positions):
+            positions = positions.copy()
+            positions[:, 0] = side - 1 - positions[:, 0]
+            return positions
+        surface.place(right, mirrored(surface.positions[left]))
+        angle = 0.3
+        surface.move_vertices(left[:1000],
+                              translation=(1, 2, 3),
+                              rotation=((cos(angle), -sin(angle), 0),
+                                        (sin(angle),  cos(angle), 0),
+                                        (         0,           0, 1)),
+                              scale=1.5,
+                              mirror='x')
+        report(prefix + ' surface stays symmetric',
+               abs(surface.positions[right] -
+                   mirrored(surface.positions[left])).max() < 1e-3)
+        report(prefix + ' mirror of the mirror is the vertex',
+               surface.symmetric(right, 'x')[0][len(right):].tolist() ==
+                   left.tolist())
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def history_memory():
+    # Memory of a moving event with the positions before and after it captured
+    # in dictionaries (as the grabs did) vs the packed offsets, and the time to
+    # pack, undo and redo them
+    def dictionary_size(positions):
+        return (getsizeof(positions) +
+                sum(getsizeof(i) + getsizeof(p) + sum(map(getsizeof, p))
+                        for i, p in positions.items()))
+    surface = stand_in_surface(100000)
+    side    = int(len(surface)**0.5)
+    centre  = side//2*side + side//2
+    for selected in (1000, 10000, 50000):
+        rows, weights = surface.falloff([centre], (selected/3.14)**0.5)
+        rows, weights = rows[:selected], weights[:selected]
+        for kind, move in (('translate', lambda: surface.move_vertices(
+                                rows, translation=(0, 0, 1))),
+                           ('soft', lambda: surface.move_vertices(
+                                rows, translation=(0, 0, 1), weights=weights)),
+                           ('smooth', lambda: surface.smooth(
+                                rows, iterations=4))):
+            name = 'history {:>5} vertices {:<9}'.format(selected, kind)
+            before = surface.positions[rows]
+            move()
+            after  = surface.positions[rows]
+            old    = 2*dictionary_size({i: tuple(p) for i, p in
+                                            zip(rows.tolist(), after.tolist())})
+            start  = perf_counter()
+            movement = Movement(rows, before, after)
+            packed = perf_counter() - start
+            report(name + ' bytes (dictionaries / packed)',
+                   '{} / {}'.format(old, movement.size))
+            def undo():
+                indices, offsets = movement.unpack()
+                surface.shift(indices, -offsets)
+            def redo():
+                surface.shift(*movement.unpack())
+            report(name + ' pack / undo / redo',
+                   '{:.3f} / {:.3f} / {:.3f} ms'.format(
+                       packed*1e3, timeit(undo, 1)*1e3, timeit(redo, 1)*1e3))
+            undo()
+            undone = abs(surface.positions[rows] - before).max()
+            redo()
+            report(name + ' undo and redo are exact',
+                   undone < 1e-4 and
+                   abs(surface.positions[rows] - after).max() < 1e-4)
+
+    # The oldest events are forgotten, when the events exceed the budget
+    history  = History(lambda direction, prefix: None,
+                       max_size=1 << 20, max_bytes=1 << 20)
+    rows     = arange(10000)
+    before   = surface.positions[rows]
+    pushed   = 0
+    for i in range(200):
+        # (offsets, which do not compress well)
+        offsets  = (arange(3*len(rows)).reshape(-1, 3)*0.6180339*(i + 1))%1
+        movement = Movement(rows, before, before + offsets)
+        history.push(None, None, size=movement.size)
+        pushed  += movement.size
+    report('history budget 1 MiB, 200 events (pushed)',
+           '{} kept, {} bytes ({} bytes pushed)'.format(len(history),
+                                                        history.size, pushed))
+    report('history budget is kept', history.size <= 1 << 20)
+
+    # Undone events are dropped by a new event, and an undo and redo with no
+    # events to undo or redo are reported
+    empty   = []
+    done    = []
+    history = History(lambda direction, prefix: empty.append(direction))
+    for i in range(3):
+        history.push(lambda d, p, i=i: done.append(-i),
+                     lambda d, p, i=i: done.append(i))
+    history.undo(); history.undo(); history.redo()
+    history.push(lambda d, p: done.append(-9), lambda d, p: done.append(9))
+    history.redo(); history.undo(); history.undo(); history.undo()
+    history.undo()
+    report('history undo and redo in order',
+           done == [-2, -1, 1, -9, -1, 0] and
+           empty == [History.REDO, History.UNDO])
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def undo_journal():
+    # Time of the appends to the journal on the logic thread, and the recovery
+    # of a session (with its history) from the snapshot and the journal after
+    # a crash, which tore the last record apart
+    folder   = mkdtemp()
+    snapshot = join(folder, 'auto_save.bz2')
+    path     = join(folder, 'journal.bin')
+    def events_of(surface):
+        def events(record):
+            movement = Movement.from_bytes(record)
+            def undo(direction, prefix):
+                indices, offsets = movement.unpack()
+                surface.shift(indices, -offsets)
+            def redo(direction, prefix):
+                surface.shift(*movement.unpack())
+            return undo, redo, movement.size
+        return events
+    def session(surface, history, grabs, rows):
+        # Grabs with an undo and a redo after every fourth of them
+        for i in range(grabs):
+            before = surface.positions[rows]
+            surface.move_vertices(rows, translation=(0, 0, 0.01*(i + 1)))
+            movement = Movement(rows, before, surface.positions[rows])
+            undo, redo, size = events_of(surface)(movement.to_bytes())
+            history.push(undo, redo, size, movement.to_bytes())
+            if not i%4:
+                history.undo()
+                history.redo()
+
+    surface = stand_in_surface(10000)
+    initial = surface.positions.copy()
+    rows    = surface.falloff([5050], 20)[0]
+    journal = Journal(path, interval=0.05)
+    history = History(lambda direction, prefix: None,
+                      max_size=256, journal=journal)
+    # Append latency (the records are written and synced on the other thread)
+    latencies = []
+    record    = Movement(rows, surface.positions[rows],
+                         surface.positions[rows] + 1).to_bytes()
+    for i in range(2000):
+        start = perf_counter()
+        journal.append(RECORD_PUSH, record)
+        latencies.append(perf_counter() - start)
+        if not i%20:
+            sleep(TICK)
+    report('journal append {} bytes (median / p99 / max)'.format(len(record)),
+           '{:.2f} / {:.2f} / {:.2f} us'.format(
+               percentile(latencies, 50)*1e6,
+               percentile(latencies, 99)*1e6,
+               max(latencies)*1e6))
+    start = perf_counter()
+    journal.flush()
+    report('journal flush (write and sync)',
+           '{:.3f} ms'.format((perf_counter() - start)*1e3))
+
+    # Compaction against the snapshot, then the session goes on
+    session(surface, history, 40, rows)
+    journal.snapshot(surface.serialise(), snapshot, history.records())
+    journal.flush()
+    report('journal compacted (bytes)', getsize(path))
+    session(surface, history, 24, rows)
+    history.undo()
+    history.undo()
+    journal.flush()
+    expected = surface.positions.copy()
+    # The crash tears the last record apart
+    journal.append(RECORD_PUSH, record)
+    journal.flush()
+    with open(path, mode='r+b') as file:
+        file.truncate(getsize(path) - 7)
+
+    recovered = stand_in_surface(10000)
+    recovered.deserialise(load_from_file(snapshot))
+    journal   = Journal(path, interval=0.05)
+    history   = History(lambda direction, prefix: None,
+                        max_size=256, journal=journal,
+                        events_of=events_of(recovered))
+    start     = perf_counter()
+    replayed  = history.recover(journal.records(),
+                                checksum(recovered.serialise()))
+    report('journal replay {} records'.format(replayed),
+           '{:.3f} ms'.format((perf_counter() - start)*1e3))
+    report('journal recovered the last state',
+           abs(recovered.positions - expected).max() < 1e-4)
+    for _ in range(len(history)):
+        history.undo()
+    undone = abs(recovered.positions - initial).max() < 1e-4
+    history.redo()
+    history.redo()
+    history.redo()
+    report('journal recovered history undoes and redoes',
+           undone and len(history) == 64)
+
+    # And a second restart recovers the state after the edits on the
+    # recovered history
+    expected = recovered.positions.copy()
+    journal.close()
+    again   = stand_in_surface(10000)
+    again.deserialise(load_from_file(snapshot))
+    journal = Journal(path)
+    history = History(lambda direction, prefix: None,
+                      max_size=256, events_of=events_of(again))
+    history.recover(journal.records(), checksum(again.serialise()))
+    journal.close()
+    report('journal recovered twice',
+           abs(again.positions - expected).max() < 1e-4)
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def history_merging():
+    # Depth and memory of the history after a run of picks and repeated grabs
+    # of the same vertices, with and without merging them
+    surface = stand_in_surface(10000)
+    initial = surface.positions.copy()
+    rows    = surface.falloff([5050], 20)[0]
+    def events_of(record):
+        movement = Movement.from_bytes(record)
+        def undo(direction, prefix):
+            indices, offsets = movement.unpack()
+            surface.shift(indices, -offsets)
+        def redo(direction, prefix):
+            surface.shift(*movement.unpack())
+        return undo, redo, movement.size
+    def grab(history, i):
+        before = surface.positions[rows]
+        surface.move_vertices(rows, translation=(0.01*i, 0, 0.02))
+        movement = Movement(rows, before, surface.positions[rows])
+        undo, redo, size = events_of(movement.to_bytes())
+        history.push(undo, redo, size, movement.to_bytes(),
+                     kind=tuple(rows))
+    for window in (0, 2):
+        surface.place(arange(len(initial)), initial)
+        selected = set()
+        history  = History(lambda direction, prefix: None,
+                           max_size=64, events_of=events_of,
+                           merge_window=window)
+        for i in range(200):
+            index = i%7
+            def select(direction, prefix, index=index):
+                selected.add(index)
+            def deselect(direction, prefix, index=index):
+                selected.discard(index)
+            select(History.NONE, History.NONE_PREFIX)
+            history.push(deselect, select, kind='selection')
+        picks = len(history)
+        start = perf_counter()
+        for i in range(50):
+            grab(history, i)
+        grabbed = (perf_counter() - start)/50
+        name = 'history merge window {}s'.format(window)
+        report(name + ' events (200 picks + 50 grabs)',
+               '{} events, {} bytes'.format(len(history), history.size))
+        report(name + ' grab push',
+               '{:.3f} ms'.format(grabbed*1e3))
+        if window:
+            moved = surface.positions.copy()
+            history.undo()
+            history.undo()
+            undone = (not selected and
+                      abs(surface.positions - initial).max() < 1e-4)
+            history.redo()
+            history.redo()
+            report(name + ' undoes and redoes merged events',
+                   picks == 1 and len(history) == 2 and undone and
+                   selected == set(range(7)) and
+                   abs(surface.positions - moved).max() < 1e-4)
+
+    # The events of a transaction are undone together, in reversed order
+    done    = []
+    history = History(lambda direction, prefix: None)
+    history.push(lambda d, p: done.append(-1), lambda d, p: done.append(1))
+    with history.transaction():
+        for i in (2, 3, 4):
+            history.push(lambda d, p, i=i: done.append(-i),
+                         lambda d, p, i=i: done.append(i))
+    history.push(lambda d, p: done.append(-5), lambda d, p: done.append(5))
+    history.undo(); history.undo(); history.redo()
+    report('history transaction undone and redone together',
+           len(history) == 3 and done == [-5, -4, -3, -2, 2, 3, 4])
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def collaborative_undo():
+    # Two users editing the same surface, sharing their undone and redone
+    # movements over a socket pair: an undo reverts only the movement of the
+    # user undoing it, even if the other user moved the same vertices since,
+    # or holds some of them at the moment
+    class User:
+        def __init__(self, rank, peer, positions):
+            self.peer    = peer
+            self.surface = surface = stand_in_surface(10000)
+            surface.place(arange(len(positions)), positions)
+            self.rows    = []
+            self.start   = None
+            self.log     = OperationLog(rank, peer.send, self.apply)
+            self.history = History(lambda direction, prefix: None,
+                                   events_of=self.events_of, shared=self.log)
+        def events_of(self, record):
+            movement = Movement.from_bytes(record)
+            def undo(direction, prefix):
+                indices, offsets = movement.unpack()
+                self.surface.shift(indices, -offsets)
+            def redo(direction, prefix):
+                self.surface.shift(*movement.unpack())
+            return undo, redo, movement.size
+        def apply(self, indices, offsets):
+            # (as the application does: the grab in progress is rebased)
+            self.surface.shift(indices, offsets)
+            if self.start is not None:
+                moved = zeros(self.surface.positions.shape)
+                moved[indices] = offsets
+                self.start += moved[self.rows]
+        def grab(self, rows, translation, other, release=True):
+            # The moved positions are streamed to the other user meanwhile
+            if self.start is None:
+                self.rows  = rows
+                self.start = self.surface.positions[rows].astype(float)
+                self.surface.select_many(rows)
+                for index in rows.tolist():
+                    other.surface.lock(index)
+            self.surface.move_vertices(rows, translation=translation)
+            other.surface.place(rows, self.surface.positions[rows])
+            if release:
+                movement = Movement(rows, self.start,
+                                    self.surface.positions[rows])
+                undo, redo, size = self.events_of(movement.to_bytes())
+                self.history.push(undo, redo, size, movement.to_bytes())
+                self.surface.deselect_many(rows)
+                for index in rows.tolist():
+                    other.surface.unlock(index)
+                self.start = None
+        def receive(self, count):
+            for _ in range(count):
+                kind, payload = self.peer.receive()
+                self.log.receive(payload)
+
+    this, other = peer_pair()
+    initial = stand_in_surface(10000).positions.copy()
+    a = User(1, this, initial)
+    b = User(2, other, initial)
+    region_a = a.surface.falloff([4040], 15)[0]
+    region_b = a.surface.falloff([5050], 15)[0]
+    shared   = len(set(region_a.tolist()) & set(region_b.tolist()))
+
+    # Both users move their regions, which overlap, then the first user undoes
+    a.grab(region_a, (0, 0, 1), b)
+    b.receive(1)
+    b.grab(region_b, (0, 1, 0), a)
+    a.receive(1)
+    sent    = this.statistics.bytes_sent
+    start   = perf_counter()
+    a.history.undo()
+    b.receive(1)
+    applied = perf_counter() - start
+    sent    = this.statistics.bytes_sent - sent
+    expected = initial.copy()
+    expected[region_b] += (0, 1, 0)
+    report('collaborative undo {} + {} vertices ({} shared)'.format(
+               len(region_a), len(region_b), shared),
+           '{:.3f} ms'.format(applied*1e3))
+    report('collaborative undo message vs positions (bytes)',
+           '{} / {}'.format(sent, len(region_a)*16))
+    report('collaborative undo keeps the other user\'s movement',
+           abs(a.surface.positions - expected).max() < 1e-4 and
+           abs(b.surface.positions - expected).max() < 1e-4)
+
+    # The first user redoes, while the second one is grabbing part of the
+    # region: the second user moves the held vertices, and its grab does not
+    # contain the redone movement, so undoing it reverts only the grab
+    held = region_a[:len(region_a)//2]
+    b.grab(held, (1, 0, 0), a, release=False)
+    a.history.redo()
+    b.receive(1)
+    b.grab(held, (1, 0, 0), a)
+    a.receive(1)
+    expected[region_a] += (0, 0, 1)
+    expected[held]     += (2, 0, 0)
+    converged = (abs(a.surface.positions - expected).max() < 1e-4 and
+                 abs(b.surface.positions - expected).max() < 1e-4)
+    b.history.undo()
+    a.receive(1)
+    expected[held] -= (2, 0, 0)
+    report('collaborative redo rebased on the grab in progress',
+           converged and
+           abs(a.surface.positions - expected).max() < 1e-4 and
+           abs(b.surface.positions - expected).max() < 1e-4)
+    report('collaborative logs of the users (operations)',
+           '{} / {}'.format(len(a.log.operations(1)),
+                            len(a.log.operations(2))))
+    this.stop()
+    other.stop()
+
+
+
+#------------------------------------------------------------------------------#
+@benchmark
+def callback_dispatch():
+    # Dispatch of the callbacks of a frame (the application's, the fingers'
+    # position updates, and the hands'), walking the lists of the callbacks
+    # (as the managers did) vs iterating over the compiled tuples
+    class Walking:
+        def __init__(self, valid_references=None):
+            self._states    = {}
+            self._callbacks = OrderedDict((reference, []) for reference
+                                                          in valid_references)
+        def append_callback(self, reference, callback):
+            self._callbacks[reference].append(callback)
+        def execute_callbacks(self, reference):
+            states = self._states
+            for callback in self._callbacks[reference]:
+                callback(states)
+        def execute_all_callbacks(self):
+            states = self._states
+            for callbacks in self._callbacks.values():
+                for callback in callbacks:
+                    callback(states)
+
+    called = []
+    def callback(states):
+        called.append(1)
+    for manager in (Walking, CallbackManager):
+        application = manager(('exit', 'reset', 'comm'))
+        for reference in ('exit', 'reset', 'comm'):
+            application.append_callback(reference, callback)
+        hands = manager(('grab', 'volume'))
+        hands.append_callback('grab', callback)
+        hands.append_callback('volume', callback)
+        references = ('pick', 'swipe_left_right',
+                      'swipe_up_down', 'swipe_front_back')
+        hand_list  = [manager(references), manager(references)]
+        for hand in hand_list:
+            for reference in references:
+                hand.append_callback(reference, callback)
+        fingers = [manager(('position', 'scale', 'color')) for _ in range(10)]
+        def frame():
+            application.execute_all_callbacks()
+            for hand in hand_list:
+                for finger in fingers:
+                    finger.execute_callbacks('position')
+                hand.execute_all_callbacks()
+            hands.execute_all_callbacks()
+        del called[:]
+        frame()
+        calls = len(called)
+        report('callback dispatch per frame ({}, {} calls)'.format(
+                   manager.__name__, calls),
+               '{:.2f} us'.format(timeit(frame, 20000)*1e6))
+
+    # Every reference has its own list of callbacks
+    finger = CallbackManager(('position', 'scale', 'color'))
+    finger.append_callback('position', callback)
+    finger.append_callback('color', callback)
+    del called[:]
+    finger.execute_callbacks('scale')
+    scaled = len(called)
+    finger.execute_all_callbacks()
+    finger.remove_callback('color')
+    finger.execute_all_callbacks()
+    finger.remove_all_callbacks()
+    finger.execute_all_callbacks()
+    report('callback references have their own callbacks',
+           scaled == 0 and len(called) == 3)
+
+
+
+#------------------------------------------------------------------------------#
+if __name__ == '__main__':
+    for name in (argv[1:] or benchmarks):
+        benchmarks[name]()
@@ -28,9 +28,14 @@
 ######################################################################## INFO ##
 
 # Import python modules
+from itertools   import chain
 from collections import OrderedDict
 
 #------------------------------------------------------------------------------#
+# The callbacks are stored in lists by their references, and every change of
+# them compiles the lists into tuples: one by references and a flat one of all
+# of them, so executing the callbacks (which happens every frame, while the
+# registrations change rarely) only iterates over the tuples
 class CallbackManager:
 
     # Class level constants
@@ -45,7 +50,10 @@ class CallbackManager:
             self._callbacks  = OrderedDict()
         else:
             self._restricted = True
-            self._callbacks  = OrderedDict.fromkeys(valid_references, [])
+            # Each reference has its own list
+            self._callbacks  = OrderedDict((reference, []) for reference
+                                                           in valid_references)
+        self._compile()
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -62,11 +70,13 @@ class CallbackManager:
                 raise KeyError(self.REFERENCE_ERROR.format(reference, self))
             # Create list of callbacks and store the new callback
             self._callbacks[reference] = [callback]
+        self._compile()
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def remove_callback(self, reference, index=-1):
         self._callbacks[reference].pop(index)
+        self._compile()
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -75,14 +85,17 @@ class CallbackManager:
             self._callbacks[reference] = []
         else:
             del self._callbacks[reference]
+        self._compile()
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def remove_all_callbacks(self):
         if self._restricted:
-            self._callbacks = OrderedDict.fromkeys(self._callbacks.keys(), [])
+            self._callbacks = OrderedDict((reference, [])
+                                              for reference in self._callbacks)
         else:
             self._callbacks = OrderedDict()
+        self._compile()
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -92,17 +105,19 @@ class CallbackManager:
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def execute_callbacks(self, reference):
-        states = self._states
-        for callback in self._callbacks[reference]:
-            callback(states)
+        # If nothing is registered to the reference, there is nothing to do
+        callbacks = self._by_reference[reference]
+        if callbacks:
+            states = self._states
+            for callback in callbacks:
+                callback(states)
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def execute_all_callbacks(self):
         states = self._states
-        for callbacks in self._callbacks.values():
-            for callback in callbacks:
-                callback(states)
+        for callback in self._all:
+            callback(states)
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -120,3 +135,11 @@ class CallbackManager:
         _states = self._states
         for state in states:
             _states.pop(state, None)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _compile(self):
+        callbacks = self._callbacks
+        self._by_reference = {reference: tuple(callbacks[reference])
+                                  for reference in callbacks}
+        self._all = tuple(chain.from_iterable(callbacks.values()))
@@ -28,86 +28,343 @@
 ######################################################################## INFO ##
 
 # Import python modules
-from itertools    import count
-from sys          import getsizeof
-from pickle       import dumps, loads, HIGHEST_PROTOCOL
-from socket       import socket, AF_INET, SOCK_STREAM, SHUT_RDWR
-from errno        import (EISCONN,      # Transport endpoint is already connected
-                          EADDRINUSE,   # Address already in use
-                          ECONNREFUSED) # COnnection refused
+from struct       import Struct
+from select       import select
+from threading    import Thread, Event
+from collections  import deque, OrderedDict
+from random       import uniform
+from time         import perf_counter, sleep
+from socket       import (socket, socketpair, timeout as SocketTimeout,
+                          MSG_DONTWAIT, AF_INET, SOCK_STREAM, SOCK_DGRAM,
+                          SHUT_RDWR, SOL_SOCKET, SO_REUSEADDR,
+                          IPPROTO_TCP, TCP_NODELAY)
+from errno        import (EADDRINUSE,   # Address already in use
+                          EMSGSIZE,     # Message too long
+                          ECONNREFUSED, # COnnection refused
+                          ECONNRESET,   # Connection reset by peer
+                          ETIMEDOUT,    # Connection timed out
+                          EHOSTUNREACH, # No route to host
+                          ENETUNREACH)  # Network is unreachable
 
-# Import blender modules
-import bge
+# Import user modules
+from stats import Statistics
 
-# TODO: instead of pickle use struct => https://docs.python.org/3.4/library/struct.html
 
 #------------------------------------------------------------------------------#
-# Helper function
-def sizeof_pow2(data):
-    s = getsizeof(dumps(data, HIGHEST_PROTOCOL))
-    for i in count():
-        size = 2**i
-        if s <= size:
-            return size
+# Wire format: each message is a fixed-size header followed by its payload
+#   header   => message type (uint8), payload size in bytes (uint32)
+#   reliable => reliable message identifier (uint32), followed by the message
+#   ack      => reliable message identifier (uint32)
+#   ping     => time of sending on the pinging side (float64), echoed by pong
+#   fragment => fragmented message identifier (uint32), index of the fragment
+#               (uint16), number of fragments (uint16), followed by a part of
+#               the framed message
+HEADER   = Struct('!BI')
+RELIABLE = Struct('!I')
+PING     = Struct('!d')
+FRAGMENT = Struct('!IHH')
+
+# Message types
+MSG_DELTA    = 0
+MSG_RESTART  = 1
+MSG_RELIABLE = 2
+MSG_ACK      = 3
+MSG_CLAIM    = 4
+MSG_RELEASE  = 5
+MSG_TRANSFER = 6
+MSG_SNAPSHOT = 7
+MSG_CHECKSUM = 8
+MSG_PING     = 9
+MSG_PONG     = 10
+# Delivered locally by the exchange, whenever a connection is (re)established
+MSG_CONNECTED = 11
+MSG_OPERATION = 12
+MSG_FRAGMENT  = 13
+
+# Types of the messages which can be lost or overwritten by newer ones
+LATEST = frozenset((MSG_DELTA, MSG_PING, MSG_PONG))
+
+# Seconds to wait for an acknowledgement before resending a reliable message
+RESEND_INTERVAL = 0.05
+# Number of reliable messages which can be held back, while waiting for the
+# missing ones before them (the ones after the window are neither acknowledged
+# nor kept, so they will be resent later)
+RELIABLE_WINDOW = 1024
+# Number of fragmented messages which can be reassembled at the same time (the
+# oldest incomplete one is dropped, when a new one starts over this limit)
+FRAGMENT_WINDOW = 16
+# Seconds between two round-trip time measurements
+PING_INTERVAL   = 1
+# Seconds to wait for a single connection attempt, and the bounds of the
+# (exponentially growing) waiting between two attempts
+CONNECT_TIMEOUT = 1
+BACKOFF_START   = 0.05
+BACKOFF_LIMIT   = 2
+
+# Errors after which connecting should be tried again
+RETRY_ERRNOS = frozenset((ECONNREFUSED,
+                          ECONNRESET,
+                          ETIMEDOUT,
+                          EHOSTUNREACH,
+                          ENETUNREACH))
+
+
+
+#------------------------------------------------------------------------------#
+class ConnectionClosed(Exception): pass
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+class ConnectionTimeout(Exception): pass
+
+
+
+#------------------------------------------------------------------------------#
+def frame(kind, payload=b'') -> 'bytes':
+    return HEADER.pack(kind, len(payload)) + payload
 
 
 
 #------------------------------------------------------------------------------#
 class Socket:
 
+    # Class level constants
+    TYPE          = SOCK_STREAM
+    # Seconds between two poll calls (None => no polling needed)
+    TIMEOUT       = None
+    # Bind to the address even if the previous socket's connections linger
+    REUSE_ADDRESS = False
+
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def __init__(self, this_host, this_port, device=None, buffer_size=1024):
-        address = this_host, this_port
-        self._buffer_size = buffer_size
-        self._socket = socket(AF_INET, SOCK_STREAM)
-        try:
-            self._socket.bind(address)
-        except OSError as exception:
-            if exception.errno != EADDRINUSE:
-                raise exception
+    @property
+    def unsent(self):
+        return len(self._unsent)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, this_host, this_port, device=None, buffer_size=4096):
+        self._address = this_host, this_port
+        self.statistics = Statistics()
+        self._setup_buffers(buffer_size)
+        self._create_socket()
         print('[ OKAY ] Socket created')
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def stop(self):
-        self._socket.shutdown(SHUT_RDWR)
+        try:
+            self._socket.shutdown(SHUT_RDWR)
+        # If socket is not connected (anymore)
+        except OSError:
+            pass
         self._socket.close()
         print('[ OKAY ] Socket closed')
 
 
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def fileno(self):
+        return self._connection.fileno()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def send(self, kind, payload=b''):
+        data = frame(kind, payload)
+        self._connection.sendall(data)
+        statistics = self.statistics
+        statistics.bytes_sent    += len(data)
+        statistics.messages_sent += 1
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def post(self, kind, payload=b''):
+        # Queue message, which will be sent by the next flush calls
+        self._unsent += frame(kind, payload)
+        self.statistics.messages_sent += 1
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def flush(self):
+        # Send as much of the queued messages as possible without blocking
+        try:
+            sent = self._connection.send(self._unsent, MSG_DONTWAIT)
+        except BlockingIOError:
+            return
+        del self._unsent[:sent]
+        self.statistics.bytes_sent += sent
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def poll(self):
+        pass
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def settled(self) -> 'boolean':
+        return not self._unsent
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def receive(self) -> 'message type and payload':
+        # NOTE: The returned payload is a view into the receiving buffer, which
+        #       is only valid until the next message is received
+        self._receive_into(HEADER.size)
+        kind, size = HEADER.unpack_from(self._buffer)
+        # If payload does not fit into the buffer
+        if size > len(self._buffer):
+            self._buffer = bytearray(1 << size.bit_length())
+        self._receive_into(size)
+        statistics = self.statistics
+        statistics.bytes_received    += HEADER.size + size
+        statistics.messages_received += 1
+        return kind, memoryview(self._buffer)[:size]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def receive_nowait(self) -> 'list of message type and payload pairs':
+        try:
+            data = self._connection.recv(len(self._buffer), MSG_DONTWAIT)
+        except BlockingIOError:
+            return []
+        if not data:
+            raise ConnectionClosed
+        # Cut the complete messages out of the received data
+        unparsed = self._unparsed
+        unparsed += data
+        messages = []
+        offset   = 0
+        while len(unparsed) - offset >= HEADER.size:
+            kind, size = HEADER.unpack_from(unparsed, offset)
+            start = offset + HEADER.size
+            if start + size > len(unparsed):
+                break
+            messages.append((kind, bytes(unparsed[start:start + size])))
+            offset = start + size
+        del unparsed[:offset]
+        statistics = self.statistics
+        statistics.bytes_received    += len(data)
+        statistics.messages_received += len(messages)
+        return messages
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _setup_buffers(self, buffer_size):
+        # Preallocated receiving buffer, it will grow if a message does not fit
+        self._buffer   = bytearray(max(buffer_size, HEADER.size))
+        self._unsent   = bytearray()
+        # Partially received messages of the non-blocking receiving
+        self._unparsed = bytearray()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _create_socket(self):
+        self._socket = socket(AF_INET, self.TYPE)
+        if self.REUSE_ADDRESS:
+            self._socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        try:
+            self._socket.bind(self._address)
+        except OSError as exception:
+            if exception.errno != EADDRINUSE:
+                raise exception
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _receive_into(self, size):
+        # Reassemble the (possibly split) data in the buffer
+        receive = self._connection.recv_into
+        view    = memoryview(self._buffer)
+        offset  = 0
+        while offset < size:
+            received = receive(view[offset:size], size - offset)
+            if not received:
+                raise ConnectionClosed
+            offset += received
+
+
+
+
+#------------------------------------------------------------------------------#
+class Peer(Socket):
+
+    # Wrapper of an already connected stream socket, e.g. one of a socketpair
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, connection, buffer_size=4096):
+        self.statistics = Statistics()
+        self._setup_buffers(buffer_size)
+        self._socket = self._connection = connection
+
 
 
 #------------------------------------------------------------------------------#
 class Server(Socket):
 
+    # Class level constants
+    REUSE_ADDRESS = True
+
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, backlog=1, **kwargs):
         super().__init__(*args, **kwargs)
-        self._socket.listen(1)
+        self._socket.listen(backlog)
         print('[ OKAY ] Server is listening')
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def connect(self, *args, **kwargs):
+    def connect(self, *args, timeout=None, stopped=None, **kwargs):
+        # NOTE: stopping the server interrupts the accepting, so the stopped
+        #       event is not needed here
         print('[ WAIT ] Server is accepting connection request...')
-        self._connection, *rest = self._socket.accept()
+        # If this is a reconnection, drop the previous connection
+        self._close_connection()
+        self._setup_buffers(len(self._buffer))
+        self._socket.settimeout(timeout)
+        try:
+            self._connection, *rest = self._socket.accept()
+        except SocketTimeout:
+            raise ConnectionTimeout
+        finally:
+            self._socket.settimeout(None)
+        self._connection.settimeout(None)
+        # Send small messages immediately (disable Nagle's algorithm)
+        self._connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        print('[ OKAY ] Server is connected')
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def listener(self) -> 'listening socket':
+        return self._socket
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def accept(self) -> 'Peer':
+        # Accept another connection without replacing the current one
+        connection, *rest = self._socket.accept()
+        connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        return Peer(connection)
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def transfer(self, data):
-        self._connection.send(dumps(data, HIGHEST_PROTOCOL))
-        return loads(self._connection.recv(self._buffer_size))
+    def transfer(self, kind, payload=b''):
+        self.send(kind, payload)
+        return self.receive()
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def stop(self):
+        self._close_connection()
+        super().stop()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _close_connection(self):
         # If server already has a connection
         try:
-            self._connection.shutdown(SHUT_RDWR)
-            self._connection.close()
+            connection = self._connection
         except AttributeError:
+            return
+        try:
+            connection.shutdown(SHUT_RDWR)
+        # If connection has already been closed by the other peer
+        except OSError:
             pass
-        super().stop()
+        connection.close()
 
 
 
@@ -117,25 +374,497 @@ class Client(Socket):
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # If the socket has been used for connecting already
+        self._used = False
         print('[ OKAY ] Client is ready')
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def connect(self, other_host, other_port):
+    def connect(self, other_host, other_port, timeout=None, stopped=None):
+        # NOTE: if the stopped event is set, the retrying is given up (and the
+        #       socket is closed), even while waiting for the next attempt
         print('[ WAIT ] Client is sending connection request...')
+        deadline = None if timeout is None else perf_counter() + timeout
+        backoff  = BACKOFF_START
         while True:
+            # If connecting has been given up meanwhile
+            if stopped is not None and stopped.is_set():
+                self._socket.close()
+                raise ConnectionClosed
+            # If this is a reconnection or a retry, start with a fresh socket
+            if self._used:
+                self._socket.close()
+                self._create_socket()
+                self._setup_buffers(len(self._buffer))
+            self._used = True
             try:
+                self._socket.settimeout(CONNECT_TIMEOUT)
                 self._socket.connect((other_host, other_port))
-            except OSError as exception:
-                if exception.errno == ECONNREFUSED:
+                self._socket.settimeout(None)
+                # If connecting has been given up during this attempt
+                if stopped is not None and stopped.is_set():
                     continue
-                elif exception.errno != EISCONN:
+                self._connection = self._socket
+                print('[ OKAY ] Client is connected')
+                return
+            except SocketTimeout:
+                pass
+            except OSError as exception:
+                if exception.errno not in RETRY_ERRNOS:
                     raise exception
+            # Wait before the next attempt, instead of spinning, the jitter
+            # keeps the clients of the same server from retrying in lockstep
+            delay = uniform(backoff/2, backoff)
+            if deadline is not None and perf_counter() + delay > deadline:
+                raise ConnectionTimeout
+            if stopped is None:
+                sleep(delay)
+            else:
+                stopped.wait(delay)
+            backoff = min(2*backoff, BACKOFF_LIMIT)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _create_socket(self):
+        super()._create_socket()
+        # Send small messages immediately (disable Nagle's algorithm)
+        self._socket.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def transfer(self, kind, payload=b''):
+        received = self.receive()
+        self.send(kind, payload)
+        return received
+
+
+
+
+
+
+#------------------------------------------------------------------------------#
+# Connectionless peer: latest-state messages are sent as single datagrams,
+# which can be lost or can arrive out of order (the sequence numbers of the
+# delta messages take care of that), while all the other messages are resent
+# until the other peer acknowledges them, and are delivered in the order they
+# were sent in (e.g. a release is never delivered before its claim). Messages
+# which do not fit into a single datagram are sent in fragments, a fragmented
+# message is delivered only if all of its fragments arrived
+class Datagram(Socket):
+
+    # Class level constants
+    TYPE         = SOCK_DGRAM
+    TIMEOUT      = RESEND_INTERVAL
+    MAX_DATAGRAM = 65507
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._buffer     = bytearray(self.MAX_DATAGRAM)
+        self._connection = self._socket
+        # Identifier of the last reliable message sent
+        self._sent       = 0
+        # Reliable messages => {identifier: (last time sent, datagrams)}
+        self._unacked    = OrderedDict()
+        # Identifier of the last fragmented message sent
+        self._fragmented = 0
+        # Fragmented messages being reassembled
+        # => {identifier: {fragment index: part of the framed message}}
+        self._parts      = OrderedDict()
+        # Identifier of the last reliable message delivered in order: every
+        # message up to this one has already been delivered
+        self._delivered  = 0
+        # Reliable messages received ahead of a missing one within the window
+        # => {identifier: (message type, payload)}
+        self._held       = {}
+        # Held back messages, which are in order now, but not delivered yet
+        self._ready      = deque()
+        print('[ OKAY ] Datagram socket is ready')
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def connect(self, other_host, other_port, timeout=None, stopped=None):
+        self._socket.connect((other_host, other_port))
+        print('[ OKAY ] Datagram socket is bound to the other peer')
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def stop(self):
+        self._socket.close()
+        print('[ OKAY ] Socket closed')
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def send(self, kind, payload=b''):
+        self.post(kind, payload)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def post(self, kind, payload=b''):
+        self.statistics.messages_sent += 1
+        # If message can be lost
+        if kind in LATEST:
+            for datagram in self._fragment(frame(kind, payload)):
+                self._send(datagram)
+            return
+        # If message has to be delivered
+        self._sent = identifier = self._sent + 1
+        datagrams  = self._fragment(
+            frame(MSG_RELIABLE,
+                  RELIABLE.pack(identifier) + frame(kind, payload)))
+        self._unacked[identifier] = perf_counter(), datagrams
+        for datagram in datagrams:
+            self._send(datagram)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def flush(self):
+        # Datagrams are sent immediately, there is nothing to flush
+        pass
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def poll(self):
+        # Resend the reliable messages, which are not acknowledged in time
+        now     = perf_counter()
+        unacked = self._unacked
+        for identifier, (sent, datagrams) in tuple(unacked.items()):
+            if now - sent >= RESEND_INTERVAL:
+                unacked[identifier] = now, datagrams
+                for datagram in datagrams:
+                    self._send(datagram)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def settled(self) -> 'boolean':
+        return not self._unacked
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def receive(self, flags=0) -> 'message type and payload or None':
+        # NOTE: The returned payload is a view into the receiving buffer, which
+        #       is only valid until the next message is received
+        # If there are held back messages which can be delivered
+        if self._ready:
+            self.statistics.messages_received += 1
+            return self._ready.popleft()
+        try:
+            size = self._connection.recv_into(self._buffer, 0, flags)
+        # If the other peer is not up yet
+        except ConnectionRefusedError:
+            return
+        self.statistics.bytes_received += size
+        return self._parse(memoryview(self._buffer)[:size])
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _parse(self, view) -> 'message type and payload or None':
+        # If datagram is broken
+        if len(view) < HEADER.size:
+            return
+        kind, length = HEADER.unpack_from(view)
+        payload = view[HEADER.size:HEADER.size + length]
+
+        # If other peer sent a part of a message
+        if kind == MSG_FRAGMENT:
+            message = self._reassemble(payload)
+            if message is not None:
+                return self._parse(memoryview(message))
+            return
+        # If other peer received a reliable message
+        elif kind == MSG_ACK:
+            self._unacked.pop(RELIABLE.unpack_from(payload)[0], None)
+            return
+        # If other peer sent a reliable message
+        elif kind == MSG_RELIABLE:
+            identifier, = RELIABLE.unpack_from(payload)
+            delivered   = self._delivered
+            # If message is too far ahead to be held back, let it be resent
+            if identifier > delivered + RELIABLE_WINDOW:
+                return
+            self._send(frame(MSG_ACK, RELIABLE.pack(identifier)))
+            # If this is a resent message which has already been received
+            held = self._held
+            if identifier <= delivered or identifier in held:
+                return
+            kind, length = HEADER.unpack_from(payload, RELIABLE.size)
+            offset  = RELIABLE.size + HEADER.size
+            payload = payload[offset:offset + length]
+            # If a message before this one is still missing
+            if identifier > delivered + 1:
+                held[identifier] = kind, bytes(payload)
                 return
+            # Release the held back messages which are in order now
+            delivered = identifier
+            while delivered + 1 in held:
+                delivered += 1
+                self._ready.append(held.pop(delivered))
+            self._delivered = delivered
+        self.statistics.messages_received += 1
+        return kind, payload
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def transfer(self, data):
-        received_data = loads(self._socket.recv(self._buffer_size))
-        self._socket.send(dumps(data, HIGHEST_PROTOCOL))
-        return received_data
+    def receive_nowait(self) -> 'list of message type and payload pairs':
+        # A datagram is either received as a whole, or not at all, and it can
+        # release the messages which were held back behind it
+        try:
+            message = self.receive(MSG_DONTWAIT)
+        except BlockingIOError:
+            return []
+        if message is None:
+            return []
+        kind, payload = message
+        messages = [(kind, bytes(payload))]
+        ready    = self._ready
+        self.statistics.messages_received += len(ready)
+        messages.extend(ready)
+        ready.clear()
+        return messages
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _fragment(self, message) -> 'list of datagrams':
+        # If message fits into a single datagram
+        if len(message) <= self.MAX_DATAGRAM:
+            return [message]
+        size  = self.MAX_DATAGRAM - HEADER.size - FRAGMENT.size
+        count = -(-len(message)//size)
+        self._fragmented = identifier = self._fragmented + 1
+        return [frame(MSG_FRAGMENT, FRAGMENT.pack(identifier, index, count) +
+                                    message[index*size:(index + 1)*size])
+                    for index in range(count)]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _reassemble(self, payload) -> 'framed message or None':
+        identifier, index, count = FRAGMENT.unpack_from(payload)
+        # If fragment is broken
+        if index >= count:
+            return
+        parts = self._parts
+        try:
+            received = parts[identifier]
+        except KeyError:
+            received = parts[identifier] = {}
+            # If too many messages are incomplete, give up the oldest one
+            if len(parts) > FRAGMENT_WINDOW:
+                parts.popitem(last=False)
+        received[index] = bytes(payload[FRAGMENT.size:])
+        # If there are still missing fragments
+        if len(received) < count:
+            return
+        del parts[identifier]
+        return b''.join(received[i] for i in range(count))
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _send(self, datagram):
+        try:
+            self.statistics.bytes_sent += self._connection.send(datagram,
+                                                                MSG_DONTWAIT)
+        # If the buffer is full or the other peer is not up yet, the datagram
+        # is lost (reliable messages will be resent by the next poll calls)
+        except (BlockingIOError, ConnectionRefusedError):
+            pass
+        # If the datagram is still too long for the network (which does not
+        # mean that the connection is lost), it is dropped
+        except OSError as exception:
+            if exception.errno != EMSGSIZE:
+                raise
+            self.statistics.messages_dropped += 1
+
+
+
+#------------------------------------------------------------------------------#
+# Background worker, which owns a connected socket, so the logic tick never has
+# to wait for the network: outgoing and incoming messages of the 'latest' types
+# are exchanged through single-slot buffers (newer messages overwrite the older
+# ones), all the other messages are queued in order
+class Exchange(Thread):
+
+    # Class level constants
+    LINGER = 1
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    @property
+    def statistics(self):
+        return self._connection.statistics
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, connection, latest=LATEST, address=None, reconnect=False):
+        super().__init__(name='commd', daemon=True)
+        self._connection = connection
+        self._latest     = frozenset(latest)
+        # Address of the other peer, if the worker should connect, and whether
+        # it should connect again, if the connection is lost
+        self._address    = address
+        self._reconnect  = reconnect
+        self._running    = True
+        self._closing    = False
+        self._error      = None
+        # Set when stopping, so the worker gives up (re)connecting
+        self._stopped    = Event()
+        # NOTE: deque's append and popleft are atomic, therefore the buffers
+        #       can be shared between the threads without any locking
+        self._outgoing   = deque(maxlen=1)
+        self._incoming   = deque(maxlen=1)
+        self._queued_out = deque()
+        self._queued_in  = deque()
+        # Wake up the worker if there is something to send
+        self._waker, self._wakee = socketpair()
+        self._waker.setblocking(False)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def send(self, kind, payload=b''):
+        if kind in self._latest:
+            self._outgoing.append((kind, payload))
+        else:
+            self._queued_out.append((kind, payload))
+        self._wake()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def receive(self) -> 'list of message type and payload pairs':
+        # If worker stopped because of an error
+        if self._error is not None:
+            raise self._error
+        messages = []
+        queued   = self._queued_in
+        try:
+            while True:
+                messages.append(queued.popleft())
+        except IndexError:
+            pass
+        try:
+            messages.append(self._incoming.popleft())
+        except IndexError:
+            pass
+        return messages
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def run(self):
+        try:
+            # If connection should be established by the worker
+            if self._address is not None:
+                self._connect()
+            while True:
+                try:
+                    return self._exchange()
+                except (ConnectionClosed, OSError, ValueError) as exception:
+                    if not (self._reconnect and
+                            self._running and
+                            not self._closing):
+                        raise exception
+                # If connection has been lost, but it should be restored
+                print('[ FAIL ] Connection lost, reconnecting...')
+                self._connect()
+        except (ConnectionClosed,
+                ConnectionTimeout, OSError, ValueError) as exception:
+            if self._running:
+                self._error = exception
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def stop(self):
+        # Let the worker deliver the queued messages before closing
+        self._closing = True
+        self._stopped.set()
+        self._wake()
+        self.join(timeout=self.LINGER)
+        self._running = False
+        self._waker.close()
+        self._wakee.close()
+        self._connection.stop()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _exchange(self):
+        connection = self._connection
+        statistics = connection.statistics
+        wakee      = self._wakee
+        latest     = self._latest
+        timeout    = min(connection.TIMEOUT or PING_INTERVAL, PING_INTERVAL)
+        pinged     = -PING_INTERVAL
+        while self._running:
+            # If everything has been sent, queue the new messages
+            if not connection.unsent:
+                for message in self._collect():
+                    connection.post(*message)
+                # Measure the round-trip time every now and then
+                now = perf_counter()
+                if now - pinged >= PING_INTERVAL:
+                    pinged = now
+                    connection.post(MSG_PING, PING.pack(now))
+                connection.flush()
+            readable, writable, _ = select((connection, wakee),
+                                           (connection,)
+                                               if connection.unsent else (),
+                                           (),
+                                           timeout)
+            # If there are new incoming messages (only what has arrived is
+            # read, so a large message being received never keeps the worker
+            # from sending, while the other side is doing the same)
+            if connection in readable:
+                for kind, payload in connection.receive_nowait():
+                    # If the other peer is measuring the round-trip time
+                    if kind == MSG_PING:
+                        connection.post(MSG_PONG, payload)
+                        connection.flush()
+                    # If the other peer answered the ping of this one
+                    elif kind == MSG_PONG:
+                        statistics.round_trip(
+                            perf_counter() - PING.unpack(payload)[0])
+                    else:
+                        (self._incoming if kind in latest else
+                         self._queued_in).append((kind, payload))
+            # If there are new outgoing messages
+            if wakee in readable:
+                wakee.recv(4096)
+            # Never block on sending, so the worker can keep receiving,
+            # even if the other side is not reading at the moment
+            if writable:
+                connection.flush()
+            connection.poll()
+            statistics.queue(len(self._queued_out) + len(self._outgoing),
+                             connection.unsent)
+            # If stopping and everything has been delivered
+            if self._closing and connection.settled():
+                return
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _connect(self):
+        self._connection.connect(*self._address, stopped=self._stopped)
+        # The latest message of the previous connection is outdated, and the
+        # application should know, that the other peer has to be resynced
+        self._incoming.clear()
+        self._queued_in.append((MSG_CONNECTED, b''))
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _wake(self):
+        try:
+            self._waker.send(b'\0')
+        # If worker has not consumed the previous wake-ups yet
+        except BlockingIOError:
+            pass
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _collect(self) -> 'list of message type and payload pairs':
+        messages = []
+        queued   = self._queued_out
+        try:
+            while True:
+                messages.append(queued.popleft())
+        except IndexError:
+            pass
+        try:
+            messages.append(self._outgoing.popleft())
+        except IndexError:
+            pass
+        return messages
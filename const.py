@@ -53,6 +53,17 @@ INT_AUTO_SAVE_FOLDER     = expanduser(join(INT_TEMPORARY_FOLDER,
                                            config['Internal']['temp_auto_save_dir']))
 INT_AUTO_SAVE_FILE       = join(INT_AUTO_SAVE_FOLDER,
                                 config['Internal']['temp_auto_save_file'])
+INT_JOURNAL_FILE         = join(INT_AUTO_SAVE_FOLDER,
+                                config['Internal']['temp_journal_file'])
+INT_STATISTICS_FILE      = join(INT_TEMPORARY_FOLDER,
+                                config['Internal']['statistics_file'])
+INT_STATISTICS_INTERVAL  = float(config['Internal']['statistics_interval'])
+INT_HISTORY_SIZE         = int(config['Internal']['history_size'])
+INT_HISTORY_BYTES        = int(float(config['Internal']['history_megabytes'])*
+                               (1 << 20))
+INT_HISTORY_MERGE_WINDOW = float(config['Internal']['history_merge_window'])
+INT_JOURNAL_INTERVAL     = float(config['Internal']['journal_interval'])
+INT_RECOVER_ON_START     = bool(eval(config['Internal']['recover_on_start']))
 #INT_STATE_SHUT_DOWN      = join(config['Internal']['temp_base_dir'],
 #                                config['Internal']['temp_states'],
 #                                config['Internal']['state_shut_down'])
@@ -72,6 +83,25 @@ WINDOW_DISPLAY_Y         = int(config['Render']['display_y'])
 WINDOW_RESOLUTION_X      = int(config['Render']['resolution_x'])
 WINDOW_RESOLUTION_Y      = int(config['Render']['resolution_y'])
 
+# Sculpting settings
+SCULPT_SOFT_SELECTION    = bool(eval(config['Sculpting']['soft_selection']))
+SCULPT_SOFT_RADIUS       = (float(config['Sculpting']['soft_radius'])*
+                            max(float(config['Dimensions']['mesh_face_width']),
+                                float(config['Dimensions']['mesh_face_height'])))
+SCULPT_SOFT_FALLOFF      = config['Sculpting']['soft_falloff']
+SCULPT_DETAIL_LEVELS     = int(config['Sculpting']['detail_levels'])
+SCULPT_DETAIL_RADIUS     = (float(config['Sculpting']['detail_radius'])*
+                            max(float(config['Dimensions']['mesh_face_width']),
+                                float(config['Dimensions']['mesh_face_height'])))
+SCULPT_VOLUME_SHAPE      = config['Sculpting']['volume_shape']
+SCULPT_SMOOTH_RADIUS     = (float(config['Sculpting']['smooth_radius'])*
+                            max(float(config['Dimensions']['mesh_face_width']),
+                                float(config['Dimensions']['mesh_face_height'])))
+SCULPT_SMOOTH_STRENGTH   = float(config['Sculpting']['smooth_strength'])
+SCULPT_SMOOTH_ITERATIONS = int(config['Sculpting']['smooth_iterations'])
+SCULPT_SMOOTH_BUDGET     = float(config['Sculpting']['smooth_budget'])/1000
+SCULPT_MIRROR_AXIS       = config['Sculpting']['mirror_axis']
+
 # Application constants
 APP_RUNNING              =  0
 APP_ESCAPED              = -1
@@ -100,14 +130,19 @@ PROP_TEXT_TIMER          = config['Scripts']['var_text_time']
 
 # Communication settings
 COMM_IS_PAIRED           = bool(eval(config['Communication']['paired']))
+COMM_TRANSPORT           = config['Communication']['transport']
 COMM_DEVICE_NAME         = config['Communication']['device']
 COMM_THIS_HOST           = config['Communication']['this_host']
 COMM_THIS_PORT           = int(config['Communication']['this_port'])
 COMM_OTHER_HOST          = config['Communication']['other_host']
 COMM_OTHER_PORT          = int(config['Communication']['other_port'])
 COMM_IS_MASTER           = bool(eval(config['Communication']['master']))
+COMM_IS_HUB              = bool(eval(config['Communication']['hub']))
+COMM_MAX_CLIENTS         = int(config['Communication']['max_clients'])
 COMM_RUNNING             =  0
 COMM_RESTART             = -1
+COMM_TCP                 = 'tcp'
+COMM_UDP                 = 'udp'
 
 # Colors
 COLOR_GEOMETRY_BASE      = 0.000, 0.448, 0.205, 1.000
@@ -27,10 +27,119 @@
 ##                                                                            ##
 ######################################################################## INFO ##
 
+# Import python modules
+from struct      import Struct
+from time        import perf_counter
+from zlib        import compress, decompress
+from contextlib  import contextmanager
 from collections import deque
+from numpy       import (asarray, argsort, concatenate, diff, cumsum, unique,
+                         bincount, zeros, frombuffer, float32, uint32)
+
+# Import user modules
+from journal import (RECORD_PUSH,
+                     RECORD_UNDO,
+                     RECORD_REDO,
+                     RECORD_MARK,
+                     RECORD_MERGE,
+                     MARKER)
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Module level constants
+# Estimated size of an entry in bytes (of the two functions and the entry),
+# which is added to the size of the data captured by the functions
+ENTRY_SIZE = 512
+# Level of the compression of the movements (the fastest one)
+COMPRESSION_LEVEL = 1
+# Serialised movement => number of the vertices (uint32), packed data
+COUNT = Struct('!I')
 
 
 #------------------------------------------------------------------------------#
+# Movement of vertices packed into bytes: the indices of the moved vertices (in
+# order, as the gaps between them) and the offsets they moved by, compressed.
+# The vertices, which did not move, are left out, and as a translation moves all
+# the vertices by the same offset, it compresses to almost nothing
+class Movement:
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    @property
+    def size(self):
+        return len(self._packed)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, indices, before, after):
+        indices = asarray(indices, dtype=int).reshape(-1)
+        offsets = (asarray(after, dtype=float) -
+                   asarray(before, dtype=float)).reshape(-1, 3)
+        moved   = offsets.any(axis=1)
+        order   = argsort(indices[moved], kind='mergesort')
+        indices = indices[moved][order]
+        offsets = offsets[moved][order]
+        self._count  = len(indices)
+        self._packed = compress(
+            concatenate((indices[:1], diff(indices))).astype(uint32).tobytes() +
+            offsets.astype(float32).tobytes(), COMPRESSION_LEVEL)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    @classmethod
+    def from_bytes(cls, data) -> 'Movement':
+        movement = cls.__new__(cls)
+        movement._count  = COUNT.unpack_from(data)[0]
+        movement._packed = bytes(data[COUNT.size:])
+        return movement
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __len__(self):
+        return self._count
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def to_bytes(self) -> 'bytes':
+        return COUNT.pack(self._count) + self._packed
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def followed_by(self, other) -> 'Movement':
+        # Single movement of this one and the other one after it (the offsets
+        # of the vertices moved by both of them are added up)
+        indices, offsets = self.unpack()
+        others, moved    = other.unpack()
+        indices, rows    = unique(concatenate((indices, others)),
+                                  return_inverse=True)
+        offsets = concatenate((offsets, moved))
+        summed  = zeros((len(indices), 3))
+        for axis in range(3):
+            summed[:, axis] = bincount(rows, weights=offsets[:, axis],
+                                       minlength=len(indices))
+        return Movement(indices, zeros(summed.shape), summed)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def unpack(self) -> 'arrays of indices and offsets':
+        packed  = decompress(self._packed)
+        count   = self._count
+        indices = cumsum(frombuffer(packed, dtype=uint32, count=count))
+        offsets = frombuffer(packed, dtype=float32,
+                             offset=count*4).reshape(-1, 3)
+        return indices.astype(int), offsets
+
+
+
+#------------------------------------------------------------------------------#
+# Undoable events, the oldest ones are forgotten, if there are more than
+# max_size of them, or if they take more memory than max_bytes. If a journal is
+# given, the events are recorded in it as well (the record of an event is its
+# packed movement, or empty, if it did not move any vertices), so the history
+# can be recovered after the application is restarted, with events_of, which
+# recreates the undo and redo functions and the size of a movement. The events
+# pushed in a transaction, or right after an event of the same kind (within the
+# merge_window seconds) are merged into a single event, and so are the
+# movements of a merged event into a single movement. If a shared operation log
+# is given, the movements done, undone and redone are published to the others
 class History(deque):
 
     NONE = -1
@@ -47,8 +156,33 @@ class History(deque):
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def __init__(self, function_if_empty, max_size=64, *args, **kwargs):
+    @staticmethod
+    def _composed(parts) -> 'undo and redo functions':
+        # The parts are undone in the reversed order
+        def undo(direction, prefix):
+            for part in reversed(parts):
+                part[0](direction, prefix)
+        def redo(direction, prefix):
+            for part in parts:
+                part[1](direction, prefix)
+        return undo, redo
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    @property
+    def size(self):
+        return self._bytes
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, function_if_empty, max_size=64,
+                                          max_bytes=None,
+                                          journal=None,
+                                          events_of=None,
+                                          merge_window=0,
+                                          shared=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # Number of the events done (the ones after it are undone)
         self._index = 0
         self._empty = function_if_empty
         # Set memory limit
@@ -58,51 +192,202 @@ class History(deque):
             self._max_size = max_len
         else:
             self._max_size = max_size
+        self._max_bytes = max_bytes
+        # Sizes of the events, and their parts => [(undo, redo, size, record)]
+        self._sizes = deque()
+        self._parts = deque()
+        self._bytes = 0
+        self._journal   = journal
+        self._events_of = events_of
+        self._shared    = shared
+        # Kind and time of the last pushed event
+        self._window = merge_window
+        self._kind   = None
+        self._time   = 0
+        # Depth of the nested transactions, and if they have an event already
+        self._depth  = 0
+        self._opened = False
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def push(self, undo, redo):
-        after_undo = False
-        # If there was an undo before
-        for i in range(self._index + 1, len(self)):
-            after_undo = True
-            self.pop()
-        # If hit the memory limit
-        if len(self) >= self._max_size:
-            self.popleft()
-        # If this is after an undo call
-        elif after_undo:
-            self._index += 2
-        # If this is npot after an undo call
-        # nor hit the memory limit
+    @contextmanager
+    def transaction(self):
+        # All the events pushed in the transaction are merged into one
+        self._depth += 1
+        try:
+            yield self
+        finally:
+            self._depth -= 1
+            if not self._depth:
+                self._opened = False
+                self._kind   = None
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def push(self, undo, redo, size: 'bytes captured by the functions'=0,
+                               record: 'packed movement of the event'=b'',
+                               kind: 'mergeable with the same kind'=None):
+        time = perf_counter()
+        # If the last event is still done, and the new one continues it
+        if (self._index and self._index == len(self) and
+            (self._opened or (kind is not None and
+                              kind == self._kind and
+                              time - self._time <= self._window))):
+            self._merge(undo, redo, size, record)
+            recorded = RECORD_MERGE
         else:
-            self._index += 1
-        # Finally add the new element
-        self.append((undo, redo))
+            self._append(undo, redo, size, record)
+            recorded = RECORD_PUSH
+        self._opened = bool(self._depth)
+        self._kind   = kind
+        self._time   = time
+        if self._journal is not None:
+            self._journal.append(recorded, record)
+        if self._shared is not None and record:
+            self._shared.done(record)
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def do(self):
-        try:
-            self[self._index][self.REDO](self.NONE, self.NONE_PREFIX)
-        except IndexError:
+        # Do the last done event again
+        if self._index:
+            self[self._index - 1][self.REDO](self.NONE, self.NONE_PREFIX)
+        else:
             self._empty(self.NONE, self.NONE_PREFIX)
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def undo(self):
-        try:
+        # Nothing is merged into an undone event
+        self._kind   = None
+        self._opened = False
+        if self._index:
             self._index -= 1
+            if self._journal is not None:
+                self._journal.append(RECORD_UNDO)
             self[self._index][self.UNDO](self.UNDO, self.UNDO_PREFIX)
-        except IndexError:
+            if self._shared is not None:
+                for part in reversed(self._parts[self._index]):
+                    if part[3]:
+                        self._shared.undone(part[3])
+        else:
             self._empty(self.UNDO, self.UNDO_PREFIX)
-            self._index = 0
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def redo(self):
-        try:
+        self._kind   = None
+        self._opened = False
+        if self._index < len(self):
             self._index += 1
-            self[self._index][self.REDO](self.REDO, self.REDO_PREFIX)
-        except IndexError:
+            if self._journal is not None:
+                self._journal.append(RECORD_REDO)
+            self[self._index - 1][self.REDO](self.REDO, self.REDO_PREFIX)
+            if self._shared is not None:
+                for part in self._parts[self._index - 1]:
+                    if part[3]:
+                        self._shared.redone(part[3])
+        else:
             self._empty(self.REDO, self.REDO_PREFIX)
-            self._index = 0
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def records(self) -> 'list of kind and payload pairs':
+        # The shortest journal leading to the current state of the history
+        records = []
+        for parts in self._parts:
+            records.append((RECORD_PUSH, parts[0][3]))
+            records.extend((RECORD_MERGE, part[3]) for part in parts[1:])
+        return records + [(RECORD_UNDO, b'')]*(len(self) - self._index)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def recover(self, records, checksum) -> 'number of the records replayed':
+        # Find the marker of the snapshot the surface was restored from
+        marker = MARKER.pack(checksum)
+        for start in reversed(range(len(records))):
+            if records[start] == (RECORD_MARK, marker):
+                break
+        else:
+            return 0
+        # Rebuild the events from the records (without recording them again),
+        # but only the ones after the snapshot have to be done, as the rest of
+        # them are already in the snapshot (the others will get the recovered
+        # surface from the master user, so nothing is published)
+        journal, self._journal = self._journal, None
+        shared,  self._shared  = self._shared,  None
+        self.clear()
+        self._sizes.clear()
+        self._parts.clear()
+        self._bytes = self._index = 0
+        try:
+            for replayed, (kind, payload) in enumerate(records):
+                if kind in (RECORD_PUSH, RECORD_MERGE):
+                    undo, redo, size = self._events_of(payload)
+                    if kind == RECORD_MERGE and self._index:
+                        self._merge(undo, redo, size, payload)
+                    else:
+                        self._append(undo, redo, size, payload)
+                    if replayed > start:
+                        redo(self.NONE, self.NONE_PREFIX)
+                elif kind == RECORD_UNDO and self._index:
+                    if replayed > start:
+                        self.undo()
+                    else:
+                        self._index -= 1
+                elif kind == RECORD_REDO and self._index < len(self):
+                    if replayed > start:
+                        self.redo()
+                    else:
+                        self._index += 1
+        finally:
+            self._journal = journal
+            self._shared  = shared
+            self._kind    = None
+        return len(records) - start - 1
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _append(self, undo, redo, size, record):
+        # If there was an undo before, the undone events are forgotten
+        while len(self) > self._index:
+            self.pop()
+            self._bytes -= self._sizes.pop()
+            self._parts.pop()
+        # Finally add the new element
+        self.append((undo, redo))
+        self._sizes.append(size + ENTRY_SIZE)
+        self._parts.append([(undo, redo, size, record)])
+        self._bytes += size + ENTRY_SIZE
+        self._forget()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _merge(self, undo, redo, size, record):
+        parts = self._parts[-1]
+        added = size + ENTRY_SIZE
+        # If both the last part and the new one are movements, they are
+        # replaced by a single movement
+        last_record = parts[-1][3]
+        if record and last_record and self._events_of is not None:
+            record = (Movement.from_bytes(last_record)
+                              .followed_by(Movement.from_bytes(record))
+                              .to_bytes())
+            undo, redo, size = self._events_of(record)
+            added = size - parts.pop()[2]
+        parts.append((undo, redo, size, record))
+        self[-1] = (undo, redo) if len(parts) == 1 else self._composed(parts)
+        self._sizes[-1] += added
+        self._bytes     += added
+        self._forget()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _forget(self):
+        # If hit the memory limit (the last event is always kept)
+        while len(self) > 1 and (len(self) > self._max_size or
+                                 (self._max_bytes is not None and
+                                  self._bytes > self._max_bytes)):
+            self.popleft()
+            self._bytes -= self._sizes.popleft()
+            self._parts.popleft()
+        self._index = len(self)
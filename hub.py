@@ -0,0 +1,266 @@
+## INFO ########################################################################
+##                                                                            ##
+##                                  plastey                                   ##
+##                                  =======                                   ##
+##                                                                            ##
+##      Oculus Rift + Leap Motion + Python 3 + C + Blender + Arch Linux       ##
+##                       Version: 0.2.4.144 (20150514)                        ##
+##                                File: hub.py                                ##
+##                                                                            ##
+##               For more information about the project, visit                ##
+##                         <http://plastey.kibu.hu>.                          ##
+##              Copyright (C) 2015 Peter Varo, Kitchen Budapest               ##
+##                                                                            ##
+##  This program is free software: you can redistribute it and/or modify it   ##
+##   under the terms of the GNU General Public License as published by the    ##
+##       Free Software Foundation, either version 3 of the License, or        ##
+##                    (at your option) any later version.                     ##
+##                                                                            ##
+##    This program is distributed in the hope that it will be useful, but     ##
+##         WITHOUT ANY WARRANTY; without even the implied warranty of         ##
+##            MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.            ##
+##            See the GNU General Public License for more details.            ##
+##                                                                            ##
+##     You should have received a copy of the GNU General Public License      ##
+##     along with this program, most likely a file in the root directory,     ##
+##        called 'LICENSE'. If not, see <http://www.gnu.org/licenses>.        ##
+##                                                                            ##
+######################################################################## INFO ##
+
+# Import python modules
+from struct    import error as StructError
+from selectors import DefaultSelector, EVENT_READ, EVENT_WRITE
+
+# Import user modules
+from sync          import VertexSync
+from ownership     import Ownership, OWNERSHIP
+from communication import (MSG_DELTA,
+                           MSG_PING,
+                           MSG_PONG,
+                           MSG_CLAIM,
+                           MSG_RELEASE,
+                           MSG_TRANSFER,
+                           ConnectionClosed,
+                           Server,
+                           Exchange)
+
+
+#------------------------------------------------------------------------------#
+# Identifier of the user of the application running the hub
+LOCAL = 0
+
+
+
+#------------------------------------------------------------------------------#
+# Collaborative server accepting any number of clients: a single background
+# thread multiplexes all the connections, relays the ownership messages of the
+# participants while keeping its own copy of the ownership table, and sends
+# each participant only the changes of the vertices owned by the others. The
+# application running the hub is a participant too, it uses the same send and
+# receive methods as it would use with an Exchange
+class Hub(Exchange):
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, this_host, this_port, device=None, max_clients=8):
+        super().__init__(Server(this_host=this_host,
+                                this_port=this_port,
+                                device=device,
+                                backlog=max_clients))
+        self.name = 'hubd'
+        self._count     = LOCAL
+        self._peers     = {}
+        # Hub side of the synchronisation with each participant
+        self._syncs     = {LOCAL: VertexSync()}
+        # Owners of the held vertices, and the ranks of the participants
+        self._ownership = Ownership()
+        self._ranks     = {}
+        # Last known positions of the held vertices => {index: (x, y, z)}
+        self._positions = {}
+        # Participants which should get a new delta message
+        self._dirty     = set()
+        self._selector  = selector = DefaultSelector()
+        selector.register(self._connection.listener(), EVENT_READ)
+        selector.register(self._wakee, EVENT_READ)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def run(self):
+        selector = self._selector
+        peers    = self._peers
+        wakee    = self._wakee
+        try:
+            while self._running:
+                for kind, payload in self._collect():
+                    self._handle(LOCAL, kind, payload)
+                self._fan_out()
+                unsent = sum(peer.unsent for peer in peers.values())
+                self.statistics.queue(len(self._queued_out) +
+                                      len(self._outgoing), unsent)
+                # If stopping and everything has been delivered
+                if self._closing and not unsent:
+                    return
+                for key, events in selector.select():
+                    identifier = key.data
+                    # If there are new outgoing messages
+                    if key.fileobj is wakee:
+                        wakee.recv(4096)
+                    # If a new client is connecting
+                    elif identifier is None:
+                        self._accept()
+                    # If peer has been dropped in this round
+                    elif identifier not in peers:
+                        continue
+                    else:
+                        peer = peers[identifier]
+                        try:
+                            if events & EVENT_WRITE:
+                                self._flush(identifier, peer)
+                            if events & EVENT_READ:
+                                for message in peer.receive_nowait():
+                                    self._handle(identifier, *message)
+                        except (ConnectionClosed, OSError):
+                            self._drop(identifier)
+        except (OSError, ValueError) as exception:
+            if self._running:
+                self._error = exception
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def stop(self):
+        super().stop()
+        for identifier in tuple(self._peers):
+            self._drop(identifier)
+        self._selector.close()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _accept(self):
+        self._count = identifier = self._count + 1
+        self._peers[identifier] = peer = self._connection.accept()
+        # Count the traffic of all the peers together
+        peer.statistics = self.statistics
+        self._syncs[identifier] = VertexSync()
+        self._selector.register(peer, EVENT_READ, identifier)
+        # Let the new peer know about the currently held vertices
+        for message in self._ownership.announce():
+            peer.post(*message)
+        self._dirty.add(identifier)
+        print('[ OKAY ] Peer #{} joined'.format(identifier))
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _drop(self, identifier):
+        peer = self._peers.pop(identifier, None)
+        # If peer has already been dropped
+        if peer is None:
+            return
+        self._selector.unregister(peer)
+        try:
+            peer.stop()
+        except OSError:
+            pass
+        del self._syncs[identifier]
+        self._dirty.discard(identifier)
+        # Release everything the peer was holding on behalf of the peer
+        rank      = self._ranks.pop(identifier, None)
+        ownership = self._ownership
+        for index, owner in tuple(ownership):
+            if owner == rank:
+                ownership.release(index, rank)
+        for message in ownership.flush():
+            self._relay(identifier, *message)
+            self._dirty.update(self._syncs)
+        print('[ OKAY ] Peer #{} left'.format(identifier))
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _handle(self, source, kind, payload):
+        try:
+            if kind == MSG_DELTA:
+                return self._merge(source, payload)
+            # Answer the round-trip time measurements of the peers
+            elif kind == MSG_PING:
+                peer = self._peers[source]
+                peer.post(MSG_PONG, payload)
+                return self._flush(source, peer)
+            # If ownership has changed, everyone should get new deltas
+            elif kind in (MSG_CLAIM, MSG_RELEASE, MSG_TRANSFER):
+                _, self._ranks[source], _ = OWNERSHIP.unpack_from(payload)
+                self._ownership.apply(kind, payload)
+                self._dirty.update(self._syncs)
+        # If message is malformed, it is dropped (and not relayed), instead of
+        # stopping the hub, and with that, everyone's collaboration
+        except StructError:
+            self.statistics.messages_dropped += 1
+            return
+        self._relay(source, kind, payload)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _relay(self, source, kind, payload):
+        # Pass on the message to all the other participants
+        if source != LOCAL:
+            self._queued_in.append((kind, payload))
+        for identifier, peer in tuple(self._peers.items()):
+            if identifier != source:
+                peer.post(kind, payload)
+                self._flush(identifier, peer)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _merge(self, source, payload):
+        owner     = self._ownership.owner
+        rank      = self._ranks.get(source)
+        positions = self._positions
+        changed   = False
+        # Only the owner of a vertex can move it
+        for index, position in self._syncs[source].unpack(payload)[0]:
+            if rank is not None and owner(index) == rank:
+                positions[index] = position
+                changed = True
+        # Acknowledge the message, and let everyone know about the changes
+        if changed:
+            self._dirty.update(self._syncs)
+        else:
+            self._dirty.add(source)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _fan_out(self):
+        ownership = self._ownership
+        positions = self._positions
+        dirty     = self._dirty
+        for identifier in tuple(dirty):
+            # If peer has been dropped while serving the others in this round
+            if identifier not in self._syncs:
+                continue
+            # If peer has not received the previous message yet, the next
+            # delta will contain the changes of this round as well
+            peer = self._peers.get(identifier)
+            if peer is not None and peer.unsent:
+                continue
+            rank    = self._ranks.get(identifier)
+            payload = self._syncs[identifier].pack(
+                [(index,) + positions[index]
+                    for index, owner in ownership
+                        if owner != rank and index in positions],
+                positions)
+            if peer is None:
+                self._incoming.append((MSG_DELTA, payload))
+            else:
+                peer.post(MSG_DELTA, payload)
+                self._flush(identifier, peer)
+            dirty.discard(identifier)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _flush(self, identifier, peer):
+        try:
+            peer.flush()
+        except OSError:
+            return self._drop(identifier)
+        # Wait for the peer to become writable only if something is left
+        self._selector.modify(peer,
+                              EVENT_READ | EVENT_WRITE if peer.unsent
+                                                       else EVENT_READ,
+                              identifier)
@@ -0,0 +1,247 @@
+## INFO ########################################################################
+##                                                                            ##
+##                                  plastey                                   ##
+##                                  =======                                   ##
+##                                                                            ##
+##      Oculus Rift + Leap Motion + Python 3 + C + Blender + Arch Linux       ##
+##                       Version: 0.2.4.144 (20150514)                        ##
+##                              File: journal.py                              ##
+##                                                                            ##
+##               For more information about the project, visit                ##
+##                         <http://plastey.kibu.hu>.                          ##
+##              Copyright (C) 2015 Peter Varo, Kitchen Budapest               ##
+##                                                                            ##
+##  This program is free software: you can redistribute it and/or modify it   ##
+##   under the terms of the GNU General Public License as published by the    ##
+##       Free Software Foundation, either version 3 of the License, or        ##
+##                    (at your option) any later version.                     ##
+##                                                                            ##
+##    This program is distributed in the hope that it will be useful, but     ##
+##         WITHOUT ANY WARRANTY; without even the implied warranty of         ##
+##            MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.            ##
+##            See the GNU General Public License for more details.            ##
+##                                                                            ##
+##     You should have received a copy of the GNU General Public License      ##
+##     along with this program, most likely a file in the root directory,     ##
+##        called 'LICENSE'. If not, see <http://www.gnu.org/licenses>.        ##
+##                                                                            ##
+######################################################################## INFO ##
+
+# Import python modules
+from struct    import Struct
+from zlib      import crc32
+from threading import Thread, Condition
+from os        import fsync, replace
+
+# Import user modules
+from utils    import save_to_file
+from snapshot import checksum
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Module level constants
+# Record layout
+#   header  => kind of the record (uint8), length of the payload (uint32)
+#   payload => the data of the record
+#   footer  => crc32 of the header and the payload (uint32)
+HEADER = Struct('!BI')
+FOOTER = Struct('!I')
+MARKER = Struct('!I')
+
+# Kinds of the records
+RECORD_PUSH  = 0
+RECORD_UNDO  = 1
+RECORD_REDO  = 2
+RECORD_MARK  = 3
+RECORD_MERGE = 4
+
+# The journal is compacted, when it is this many times larger than its
+# compacted size would be
+COMPACTION_RATIO = 2
+# Suffix of the files written before they replace the originals
+TEMPORARY_SUFFIX = '.tmp'
+
+
+
+#------------------------------------------------------------------------------#
+def encode(kind, payload=b'') -> 'bytes':
+    record = HEADER.pack(kind, len(payload)) + payload
+    return record + FOOTER.pack(crc32(record))
+
+
+
+#------------------------------------------------------------------------------#
+def decode(data) -> 'list of kind and payload pairs':
+    # The records are read until the first torn or corrupted one, which is
+    # where the writing of the journal was interrupted
+    records = []
+    start   = 0
+    while start + HEADER.size <= len(data):
+        kind, length = HEADER.unpack_from(data, start)
+        end = start + HEADER.size + length
+        if end + FOOTER.size > len(data):
+            break
+        if FOOTER.unpack_from(data, end)[0] != crc32(data[start:end]):
+            break
+        records.append((kind, bytes(data[start + HEADER.size:end])))
+        start = end + FOOTER.size
+    return records
+
+
+
+#------------------------------------------------------------------------------#
+def _write_durably(path, data):
+    # Write the data next to the file, and replace the file with it only after
+    # the data is on the disk, so the file is either the old or the new one
+    temporary = path + TEMPORARY_SUFFIX
+    with open(temporary, mode='wb') as file:
+        file.write(data)
+        file.flush()
+        fsync(file.fileno())
+    replace(temporary, path)
+
+
+
+#------------------------------------------------------------------------------#
+# Write-ahead journal of the history: the records are appended to a buffer, and
+# a background thread writes and syncs the buffer to the disk once in every
+# interval, so the logic ticks are never waiting for the disk. The snapshots
+# are written by the same thread (after a marker of their checksums), so the
+# order of the records and the snapshots on the disk is the order they were
+# made in. When the journal grows too large, it is compacted to the records of
+# the events, which can still be undone or redone, followed by the marker
+class Journal:
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    @property
+    def path(self):
+        return self._path
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, path, interval: 'seconds between syncs'=0.5,
+                       fresh: 'drop the records of the last session'=False):
+        self._path     = path
+        self._interval = interval
+        # Cut the torn or corrupted tail (of an interrupted write) off, so the
+        # new records are appended right after the last valid one (or cut all
+        # of them off, if the journal starts over)
+        records = []
+        if not fresh:
+            try:
+                with open(path, mode='rb') as file:
+                    records = decode(file.read())
+            except FileNotFoundError:
+                pass
+        self._size     = sum(HEADER.size + len(payload) + FOOTER.size
+                                 for kind, payload in records)
+        self._file     = open(path, mode='ab')
+        self._file.truncate(self._size)
+        # Records and snapshots waiting to be written
+        self._pending  = []
+        # Number of flushes requested and done
+        self._flushes  = 0
+        self._flushed  = 0
+        self._closed   = False
+        self._written  = Condition()
+        self._thread   = Thread(name='journal', target=self._write)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def append(self, kind, payload=b''):
+        record = encode(kind, payload)
+        with self._written:
+            self._pending.append(record)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def snapshot(self, coords, path, records=None):
+        # Save the coordinates to the path after the records appended so far,
+        # and if the records of the history are given, compact the journal
+        with self._written:
+            self._pending.append((coords, path, records))
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def flush(self):
+        # Wait until everything appended so far is on the disk
+        with self._written:
+            self._flushes += 1
+            flushes = self._flushes
+            self._written.notify_all()
+            while self._flushed < flushes and self._thread.is_alive():
+                self._written.wait(self._interval)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def records(self) -> 'list of kind and payload pairs':
+        self.flush()
+        with open(self._path, mode='rb') as file:
+            return decode(file.read())
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def close(self):
+        self.flush()
+        with self._written:
+            self._closed = True
+            self._written.notify_all()
+        self._thread.join()
+        self._file.close()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _write(self):
+        written = self._written
+        while True:
+            with written:
+                if not self._closed and self._flushed == self._flushes:
+                    written.wait(self._interval)
+                if self._closed:
+                    return
+                pending, self._pending = self._pending, []
+                flushes = self._flushes
+            try:
+                if pending:
+                    for record in pending:
+                        if isinstance(record, bytes):
+                            self._file.write(record)
+                            self._size += len(record)
+                        else:
+                            self._save(*record)
+                    self._file.flush()
+                    fsync(self._file.fileno())
+            except OSError as error:
+                print('[FAIL] journal could not be written:', error)
+            with written:
+                self._flushed = flushes
+                written.notify_all()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _save(self, coords, path, records):
+        # The marker is on the disk before the snapshot is replaced, so the
+        # records after the marker of the snapshot can always be found
+        marker = encode(RECORD_MARK, MARKER.pack(checksum(coords)))
+        file   = self._file
+        file.write(marker)
+        file.flush()
+        fsync(file.fileno())
+        self._size += len(marker)
+        temporary = path + TEMPORARY_SUFFIX
+        save_to_file(path=temporary, data=coords)
+        with open(temporary, mode='rb') as saved:
+            fsync(saved.fileno())
+        replace(temporary, path)
+        # If the journal is much larger than the records it has to keep
+        if records is not None:
+            compacted = b''.join(encode(kind, payload)
+                                     for kind, payload in records) + marker
+            if self._size > COMPACTION_RATIO*len(compacted):
+                file.close()
+                try:
+                    _write_durably(self._path, compacted)
+                    self._size = len(compacted)
+                finally:
+                    self._file = open(self._path, mode='ab')
@@ -0,0 +1,319 @@
+## INFO ########################################################################
+##                                                                            ##
+##                                  plastey                                   ##
+##                                  =======                                   ##
+##                                                                            ##
+##      Oculus Rift + Leap Motion + Python 3 + C + Blender + Arch Linux       ##
+##                       Version: 0.2.4.144 (20150514)                        ##
+##                              File: levels.py                               ##
+##                                                                            ##
+##               For more information about the project, visit                ##
+##                         <http://plastey.kibu.hu>.                          ##
+##              Copyright (C) 2015 Peter Varo, Kitchen Budapest               ##
+##                                                                            ##
+##  This program is free software: you can redistribute it and/or modify it   ##
+##   under the terms of the GNU General Public License as published by the    ##
+##       Free Software Foundation, either version 3 of the License, or        ##
+##                    (at your option) any later version.                     ##
+##                                                                            ##
+##    This program is distributed in the hope that it will be useful, but     ##
+##         WITHOUT ANY WARRANTY; without even the implied warranty of         ##
+##            MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.            ##
+##            See the GNU General Public License for more details.            ##
+##                                                                            ##
+##     You should have received a copy of the GNU General Public License      ##
+##     along with this program, most likely a file in the root directory,     ##
+##        called 'LICENSE'. If not, see <http://www.gnu.org/licenses>.        ##
+##                                                                            ##
+######################################################################## INFO ##
+
+# Import python modules
+from math      import ceil, log2
+from itertools import product
+from numpy     import (array, zeros, ones, arange, median, rint, argsort,
+                       searchsorted, unique, flatnonzero, minimum, isfinite,
+                       where, newaxis, concatenate, einsum, full, clip,
+                       lexsort, sqrt)
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Module level constants
+# Number of the closest vertices of a level, a hidden vertex follows
+PARENTS = 4
+# Number of vertices measured to find the spacing of the surface
+SAMPLES = 64
+# Vertices closer than this many spacings are adjacent
+ADJACENT = 1.5
+# Number of vertices of which the adjacent vertices are collected at once
+CHUNK = 8192
+# Number of vertices of which the vertices within a radius are collected at
+# once (there are many more of those, than of the adjacent ones)
+WITHIN_CHUNK = 512
+# Offsets of a cell and its neighbours
+NEIGHBOURS = array(list(product((-1, 0, 1), repeat=3)))
+INFINITY   = float('inf')
+
+
+#------------------------------------------------------------------------------#
+# Levels of detail of a surface: level 0 has all the vertices, and each coarser
+# level keeps one of the vertices of the previous level in each cell of a grid,
+# the cells of which are twice as large as the ones of the previous level. The
+# vertices missing from a level (hidden) follow the closest vertices of that
+# level. The levels are computed from the positions of the generated surface,
+# so they work for the plane and the sphere (or any other generator) alike. The
+# same grid gives the adjacent vertices of each vertex (e.g. for smoothing)
+class Levels:
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    @property
+    def spacing(self):
+        return self._spacing
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, rest: 'float array of (N, 3)', count):
+        self._rest    = rest
+        self._spacing = None
+        self._units   = None
+        self._members = [ones(len(rest), dtype=bool)]
+        if count > 1 and len(rest) > 1:
+            self._measure()
+            members = arange(len(rest))
+            for level in range(1, count):
+                # The first vertex of each cell of the previous level's vertices
+                _, first = unique(self._cell_ids(level, self._units[members]),
+                                  return_index=True)
+                members = members[first]
+                mask = zeros(len(rest), dtype=bool)
+                mask[members] = True
+                self._members.append(mask)
+        # Parents and weights of the hidden vertices of each level, and the
+        # followers of the vertices (computed on first use)
+        self._parents   = [None]*len(self._members)
+        self._followers = [None]*len(self._members)
+        # Adjacent vertices of the vertices (computed on first use)
+        self._adjacent  = None
+        # Sorted cells of the levels of the grid => {level: (ids, vertices)}
+        self._sorted    = {}
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __len__(self):
+        return len(self._members)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def members(self, level) -> 'bool array of (N,)':
+        return self._members[level]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def parents(self, level) -> 'int and float arrays of (N, PARENTS)':
+        # The closest vertices of the level in the cell of a hidden vertex and
+        # in the neighbouring cells, and how much the hidden vertex follows
+        # them (the weights of the members of the level are zeros)
+        found = self._parents[level]
+        if found is None:
+            rest    = self._rest
+            parents = arange(len(rest)).repeat(PARENTS).reshape(-1, PARENTS)
+            weights = zeros((len(rest), PARENTS))
+            hidden  = flatnonzero(~self._members[level])
+            if len(hidden):
+                members = flatnonzero(self._members[level])
+                ids     = self._cell_ids(level, self._units[members])
+                order   = argsort(ids)
+                ids     = ids[order]
+                members = members[order]
+                # Members of the neighbouring cells of each hidden vertex
+                wanted  = self._cell_ids(level, self._units[hidden],
+                                         NEIGHBOURS)
+                at      = minimum(searchsorted(ids, wanted), len(ids) - 1)
+                keys    = members[at]
+                distances = ((rest[keys] -
+                              rest[hidden][:, newaxis])**2).sum(axis=2)
+                distances[ids[at] != wanted] = INFINITY
+                # (the cell of the hidden vertex always has a member)
+                nearest = argsort(distances, axis=1)[:, :PARENTS]
+                rows    = arange(len(hidden))[:, newaxis]
+                keys    = keys[rows, nearest]
+                distances = distances[rows, nearest]
+                inverse = where(isfinite(distances), 1/(distances + 1e-12), 0)
+                parents[hidden] = keys
+                weights[hidden] = inverse/inverse.sum(axis=1)[:, newaxis]
+            self._parents[level] = found = parents, weights
+        return found
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def followers(self, level) -> 'int arrays of followers and starts':
+        # The hidden vertices following each vertex of the level, grouped by
+        # the vertices => followers[starts[i]:starts[i + 1]] are of vertex i
+        found = self._followers[level]
+        if found is None:
+            parents, weights = self.parents(level)
+            hidden  = flatnonzero(~self._members[level])
+            leaders = parents[hidden].ravel()
+            follows = weights[hidden].ravel() > 0
+            leaders = leaders[follows]
+            order   = argsort(leaders, kind='mergesort')
+            self._followers[level] = found = \
+                (hidden.repeat(PARENTS)[follows][order],
+                 searchsorted(leaders[order], arange(len(self._rest) + 1)))
+        return found
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def adjacent(self) -> 'int arrays of adjacent vertices and starts':
+        # The vertices around each vertex on the generated surface, grouped by
+        # the vertices like the followers => adjacent[starts[i]:starts[i + 1]]
+        # are of vertex i. The vertices closer than ADJACENT spacings are
+        # searched in the neighbouring cells of the grid of the first level
+        # (the cells of which are two spacings large)
+        found = self._adjacent
+        if found is None:
+            rest = self._rest
+            size = len(rest)
+            if size < 2:
+                self._adjacent = found = (zeros(0, dtype=int),
+                                          zeros(size + 1, dtype=int))
+                return found
+            if self._units is None:
+                self._measure()
+            ids, order = self._sorted_cells(1)
+            limit    = (ADJACENT*self._spacing)**2
+            adjacent = []
+            for chunk in range(0, size, CHUNK):
+                rows = arange(chunk, min(chunk + CHUNK, size))
+                owners, others = self._around(ids, order, 1, self._units[rows])
+                owners += chunk
+                offsets = rest[others] - rest[owners]
+                keep    = ((others != owners) &
+                           (einsum('ij,ij->i', offsets, offsets) < limit))
+                adjacent.append((owners[keep], others[keep]))
+            owners = concatenate([owners for owners, _ in adjacent])
+            others = concatenate([others for _, others in adjacent])
+            self._adjacent = found = \
+                others, searchsorted(owners, arange(size + 1))
+        return found
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def within(self, rows: 'int array of vertices',
+                     radius) -> 'int and float arrays':
+        # The vertices closer than radius to any of the given vertices, and
+        # their distances from the closest one of those. The vertices are
+        # searched in the neighbouring cells of the first level of the grid,
+        # the cells of which are larger than the radius (and the rounding of
+        # the positions to units), so there is no loop over the vertices, and
+        # the given vertices are not searched (they are at zero distance)
+        rest    = self._rest
+        closest = full(len(rest), INFINITY)
+        if len(rows) and len(rest) > 1:
+            if self._units is None:
+                self._measure()
+            units = self._units
+            level = min(ceil(log2(radius/self._spacing + 1)),
+                        int(units.max()).bit_length())
+            ids, order = self._sorted_cells(level)
+            given = zeros(len(rest), dtype=bool)
+            given[rows] = True
+            searched   = ~given[order]
+            ids, order = ids[searched], order[searched]
+            for chunk in range(0, len(rows), WITHIN_CHUNK):
+                part = rows[chunk:chunk + WITHIN_CHUNK]
+                owners, others = self._around(ids, order, level, units[part])
+                offsets   = (rest.take(others, axis=0) -
+                             rest.take(part[owners], axis=0))
+                distances = sqrt(einsum('ij,ij->i', offsets, offsets))
+                close     = distances < radius
+                minimum.at(closest, others[close], distances[close])
+        closest[rows] = 0
+        near = flatnonzero(closest < radius)
+        return near, closest[near]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def matching(self, points: 'float array of (M, 3)',
+                       tolerance: 'distance in spacings') -> 'int array':
+        # The closest vertex to each point, if it is closer than tolerance,
+        # otherwise -1 (the tolerance should be less than half of a spacing)
+        rest  = self._rest
+        found = full(len(points), -1, dtype=int)
+        if not len(rest) or not len(points):
+            return found
+        if self._units is None:
+            self._measure()
+        units = rint((points - rest.min(axis=0))/self._spacing).astype(int)
+        units = clip(units, 0, self._units.max(axis=0))
+        limit = (tolerance*self._spacing)**2
+        ids, order = self._sorted_cells(0)
+        for chunk in range(0, len(points), CHUNK):
+            rows = arange(chunk, min(chunk + CHUNK, len(points)))
+            owners, others = self._around(ids, order, 0, units[rows])
+            owners   += chunk
+            offsets   = rest[others] - points[owners]
+            distances = einsum('ij,ij->i', offsets, offsets)
+            close     = distances < limit
+            # The first of the vertices of each point is the closest one
+            closest = lexsort((distances[close], owners[close]))
+            owners  = owners[close][closest]
+            others  = others[close][closest]
+            _, first = unique(owners, return_index=True)
+            found[owners[first]] = others[first]
+        return found
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _sorted_cells(self, level) -> 'int arrays of cell ids and vertices':
+        # The ids of the cells of all the vertices at the level in order, and
+        # the vertices in the same order (sorted only once per level)
+        found = self._sorted.get(level)
+        if found is None:
+            ids   = self._cell_ids(level, self._units)
+            order = argsort(ids, kind='mergesort')
+            self._sorted[level] = found = ids[order], order
+        return found
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _around(self, ids, order, level, units) -> 'int arrays of (K,)':
+        # All the vertices of the neighbouring cells at the level around each
+        # of the positions (in units), and the positions they are around
+        wanted  = self._cell_ids(level, units, NEIGHBOURS).ravel()
+        first   = searchsorted(ids, wanted, side='left')
+        counts  = searchsorted(ids, wanted, side='right') - first
+        counted = counts.reshape(len(units), -1).sum(axis=1)
+        skipped = first - counts.cumsum() + counts
+        return (arange(len(units)).repeat(counted),
+                order[arange(counts.sum()) + skipped.repeat(counts)])
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _cell_ids(self, level, units, offsets=None) -> 'int array':
+        # Single number identifying the cell of each position (in units) at
+        # the level (or the cells at the offsets of each position's cell)
+        cells = (units >> level) + 1
+        if offsets is not None:
+            cells = cells[:, newaxis] + offsets
+        size  = (self._units.max(axis=0) >> level) + 3
+        return (cells[..., 0]*size[1] + cells[..., 1])*size[2] + cells[..., 2]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _measure(self):
+        rest = self._rest
+        self._spacing = spacing = self._measure_spacing(rest)
+        # Positions in the units of the spacing of the surface
+        self._units = rint((rest - rest.min(axis=0))/spacing).astype(int)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _measure_spacing(self, rest) -> 'float':
+        # Typical distance of the neighbouring vertices
+        closest = []
+        for i in range(0, len(rest), max(1, len(rest)//SAMPLES)):
+            offsets   = rest - rest[i]
+            distances = einsum('ij,ij->i', offsets, offsets)
+            distances = distances[distances > 0]
+            if len(distances):
+                closest.append(distances.min()**0.5)
+        return float(median(closest)) if closest else 1
@@ -0,0 +1,408 @@
+## INFO ########################################################################
+##                                                                            ##
+##                                  plastey                                   ##
+##                                  =======                                   ##
+##                                                                            ##
+##      Oculus Rift + Leap Motion + Python 3 + C + Blender + Arch Linux       ##
+##                       Version: 0.2.4.144 (20150514)                        ##
+##                              File: loadgen.py                              ##
+##                                                                            ##
+##               For more information about the project, visit                ##
+##                         <http://plastey.kibu.hu>.                          ##
+##              Copyright (C) 2015 Peter Varo, Kitchen Budapest               ##
+##                                                                            ##
+##  This program is free software: you can redistribute it and/or modify it   ##
+##   under the terms of the GNU General Public License as published by the    ##
+##       Free Software Foundation, either version 3 of the License, or        ##
+##                    (at your option) any later version.                     ##
+##                                                                            ##
+##    This program is distributed in the hope that it will be useful, but     ##
+##         WITHOUT ANY WARRANTY; without even the implied warranty of         ##
+##            MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.            ##
+##            See the GNU General Public License for more details.            ##
+##                                                                            ##
+##     You should have received a copy of the GNU General Public License      ##
+##     along with this program, most likely a file in the root directory,     ##
+##        called 'LICENSE'. If not, see <http://www.gnu.org/licenses>.        ##
+##                                                                            ##
+######################################################################## INFO ##
+
+# Import python modules
+from math        import sin, cos, pi
+from random      import randrange
+from itertools   import count, cycle
+from threading   import Thread
+from argparse    import ArgumentParser
+from collections import OrderedDict
+from time        import perf_counter, sleep
+
+# Import user modules
+from sync          import VertexSync, DELTA
+from ownership     import Ownership, MASTER_RANK
+from utils         import save_to_file, load_from_file
+from communication import (MSG_DELTA,
+                           MSG_CLAIM,
+                           MSG_RELEASE,
+                           MSG_TRANSFER,
+                           MSG_CONNECTED,
+                           Server,
+                           Client,
+                           Datagram,
+                           Exchange)
+
+# Import global level constants
+from const import (COMM_THIS_HOST,
+                   COMM_THIS_PORT,
+                   COMM_OTHER_HOST,
+                   COMM_OTHER_PORT,
+                   COMM_TRANSPORT,
+                   COMM_TCP,
+                   COMM_UDP)
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Module level constants
+LOOPBACK    = '127.0.0.1'
+REPORT      = '[ LOAD ] {:<44} {}'
+PERCENTILES = 50, 95, 99
+OWNERSHIP   = frozenset((MSG_CLAIM, MSG_RELEASE, MSG_TRANSFER))
+# Synthetic vertices are orbiting around their resting positions on a grid
+GRID        = 10
+SPACING     = 0.2
+RADIUS      = 0.05
+
+
+
+# Helper functions
+#------------------------------------------------------------------------------#
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values)*percent/100))]
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def synthetic_stream(vertices, first, rate) -> 'held vertices of each tick':
+    # Every vertex is grabbed all the time, and moved along a small circle, one
+    # revolution per second
+    resting = [(i,
+                (i % GRID)*SPACING,
+                (i//GRID % GRID)*SPACING,
+                (i//GRID//GRID)*SPACING) for i in range(first, first + vertices)]
+    for tick in count():
+        angle = 2*pi*tick/rate
+        dx    = RADIUS*cos(angle)
+        dy    = RADIUS*sin(angle)
+        yield [(i, x + dx, y + dy, z) for i, x, y, z in resting]
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def replayed_stream(path) -> 'held vertices of each tick':
+    # Loop over a recording made by the --record option
+    return cycle(load_from_file(path))
+
+
+
+#------------------------------------------------------------------------------#
+# Impersonates a peer of the paired mode: every tick it sends the vertices it
+# holds through the same ownership and delta path as KibuVR.on_communication,
+# and consumes everything the other peer sends. Latency is measured on the
+# sync path itself: the other peer acknowledges the last delta it received in
+# each of its own deltas, so it works against a running instance too (though
+# it includes the time the other peer is waiting for its next tick)
+class LoadGenerator:
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, exchange, stream, rate, rank=None):
+        self._exchange  = exchange
+        self._stream    = stream
+        self._tick      = 1/rate
+        self._sync      = VertexSync()
+        self._ownership = Ownership(rank=rank)
+        # Indices of the vertices held by this peer, and the vertices held by
+        # the other peer => {index: position}
+        self._held      = set()
+        self._remote    = {}
+        # Send times of the deltas not acknowledged yet => {sequence: time}
+        self._sent      = OrderedDict()
+        self._session   = None
+        self._received  = 0
+        self._recording = None
+        # Counters of a run
+        self.latencies  = []
+        self.connected  = False
+        self.frames     = OrderedDict((('frames sent',                     0),
+                                       ('frames received',                 0),
+                                       ('frames lost by the other peer',   0),
+                                       ('frames lost by this peer',        0),
+                                       ('ticks missed',                    0),
+                                       ('vertices lost to the other peer', 0)))
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def record(self):
+        # Store the vertices held by the other peer in every tick, so the
+        # grabs of a real user can be replayed later
+        self._recording = []
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def recording(self) -> 'held vertices of each tick':
+        return self._recording
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def wait(self, timeout=None):
+        # Wait until the worker connects to the other peer
+        started = perf_counter()
+        while timeout is None or perf_counter() - started < timeout:
+            self._receive()
+            if self.connected:
+                return True
+            sleep(self._tick)
+        return False
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def run(self, duration):
+        tick       = self._tick
+        frames     = self.frames
+        statistics = self._exchange.statistics
+        statistics.snapshot()
+        deadline   = perf_counter()
+        finish     = deadline + duration
+        while deadline < finish:
+            self._send(next(self._stream))
+            self._receive()
+            deadline += tick
+            delay     = deadline - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            # If this tick took longer than it should, do not try to catch up,
+            # as a real frame would not either
+            else:
+                missed = int(-delay/tick)
+                frames['ticks missed'] += missed
+                deadline += missed*tick
+        return statistics.snapshot()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def report(self, snapshot):
+        for name, value in self.frames.items():
+            print(REPORT.format(name, value))
+        for name, unit, scale in (('messages_sent/s',     'msg/s', 1),
+                                  ('messages_received/s', 'msg/s', 1),
+                                  ('bytes_sent/s',        'KiB/s', 1/1024),
+                                  ('bytes_received/s',    'KiB/s', 1/1024)):
+            print(REPORT.format(name.replace('_', ' '),
+                                '{:.1f} {}'.format(snapshot[name]*scale, unit)))
+        if self.latencies:
+            print(REPORT.format(
+                'delta round trip ({})'.format(
+                    ' / '.join('p{}'.format(p) for p in PERCENTILES)),
+                ' / '.join('{:.3f}'.format(percentile(self.latencies, p)*1e3)
+                               for p in PERCENTILES) + ' ms'))
+        if snapshot['round_trip_ms'] is not None:
+            print(REPORT.format('ping round trip (last)',
+                                '{:.3f} ms'.format(snapshot['round_trip_ms'])))
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _send(self, vertices):
+        exchange  = self._exchange
+        ownership = self._ownership
+        # Pick the newly grabbed vertices and release the dropped ones, the
+        # same way as the surface does it, when selecting and deselecting
+        held = {index for index, *_ in vertices}
+        for index in held.difference(self._held):
+            ownership.claim(index)
+        for index in self._held.difference(held):
+            ownership.release(index)
+        self._held = held
+        for message in ownership.flush():
+            exchange.send(*message)
+        delta = self._sync.pack(vertices)
+        self._sent[DELTA.unpack_from(delta)[1]] = perf_counter()
+        exchange.send(MSG_DELTA, delta)
+        self.frames['frames sent'] += 1
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _receive(self):
+        frames = self.frames
+        remote = self._remote
+        for kind, payload in self._exchange.receive():
+            if kind == MSG_DELTA:
+                now = perf_counter()
+                session, sequence, acknowledged = DELTA.unpack_from(payload)
+                # If the other peer is new or has been restarted
+                if session != self._session:
+                    self._session  = session
+                    self._received = sequence - 1
+                # Deltas skipped by the sequence numbers have been replaced by
+                # newer ones, before this peer could have read them
+                if sequence > self._received:
+                    frames['frames received'] += 1
+                    frames['frames lost by the other peer'] += (
+                        sequence - self._received - 1)
+                    self._received = sequence
+                self._acknowledge(acknowledged, now)
+                moved, _, unlocked = self._sync.unpack(payload)
+                remote.update(moved)
+                for index in unlocked:
+                    remote.pop(index, None)
+            # If the other peer has (re)connected, claim the held vertices again
+            elif kind == MSG_CONNECTED:
+                self.connected = True
+                self._ownership.rejoin()
+            elif kind in OWNERSHIP:
+                lost = self._ownership.apply(kind, payload)[2]
+                frames['vertices lost to the other peer'] += len(lost)
+        if self._recording is not None:
+            self._recording.append(
+                [(i, x, y, z) for i, (x, y, z) in sorted(remote.items())])
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _acknowledge(self, acknowledged, now):
+        # Only the acknowledged delta has a round trip, the ones sent before it
+        # were replaced by newer ones, before the other peer could read them
+        sent = self._sent
+        while sent:
+            sequence, started = next(iter(sent.items()))
+            if sequence > acknowledged:
+                break
+            del sent[sequence]
+            if sequence == acknowledged:
+                self.latencies.append(now - started)
+            else:
+                self.frames['frames lost by this peer'] += 1
+
+
+
+#------------------------------------------------------------------------------#
+def connection(transport, master, this_host, this_port) -> 'Socket':
+    if transport == COMM_UDP:
+        return Datagram(this_host=this_host, this_port=this_port)
+    elif master:
+        return Server(this_host=this_host, this_port=this_port)
+    return Client(this_host=this_host, this_port=this_port)
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def loopback(transport) -> 'exchanges of a master and of a client peer':
+    # Two headless peers connected to each other on this machine
+    master = connection(transport, True,  LOOPBACK, 0)
+    client = connection(transport, False, LOOPBACK, 0)
+    master_address = master._socket.getsockname()
+    client_address = client._socket.getsockname()
+    return (Exchange(master, address=client_address),
+            Exchange(client, address=master_address))
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def stream(arguments, first) -> 'held vertices of each tick':
+    if arguments.replay:
+        return replayed_stream(arguments.replay)
+    return synthetic_stream(arguments.vertices, first, arguments.rate)
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def arguments_parser() -> 'ArgumentParser':
+    parser = ArgumentParser(
+        description='Impersonate a peer of the paired mode, replay recorded or '
+                    'synthetic vertex-grab streams and report throughput, '
+                    'latency and dropped frames')
+    parser.add_argument('--master', action='store_true',
+                        help='wait for the other peer to connect')
+    parser.add_argument('--loopback', action='store_true',
+                        help='run against a second headless peer on this '
+                             'machine, instead of a running instance')
+    parser.add_argument('--transport', choices=(COMM_TCP, COMM_UDP),
+                        default=COMM_TRANSPORT)
+    parser.add_argument('--this-host', default=COMM_THIS_HOST)
+    parser.add_argument('--this-port', default=COMM_THIS_PORT, type=int)
+    parser.add_argument('--other-host', default=COMM_OTHER_HOST)
+    parser.add_argument('--other-port', default=COMM_OTHER_PORT, type=int)
+    parser.add_argument('--rate', default=75, type=float,
+                        help='ticks per second (default: %(default)s)')
+    parser.add_argument('--vertices', default=10, type=int,
+                        help='number of grabbed vertices (default: %(default)s)')
+    parser.add_argument('--first', default=0, type=int,
+                        help='index of the first grabbed vertex '
+                             '(default: %(default)s)')
+    parser.add_argument('--duration', default=10, type=float,
+                        help='seconds to run (default: %(default)s)')
+    parser.add_argument('--timeout', default=None, type=float,
+                        help='seconds to wait for the other peer')
+    parser.add_argument('--record', metavar='PATH',
+                        help='save the vertices grabbed by the other peer')
+    parser.add_argument('--replay', metavar='PATH',
+                        help='send a recording instead of synthetic grabs')
+    return parser
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+def main(arguments):
+    if arguments.loopback:
+        master, client = loopback(arguments.transport)
+        # The second headless peer sends the same amount of synthetic grabs, on
+        # vertices not touched by the first one
+        other = LoadGenerator(client,
+                              synthetic_stream(arguments.vertices,
+                                               arguments.first +
+                                                   arguments.vertices,
+                                               arguments.rate),
+                              arguments.rate,
+                              randrange(1, 1 << 32))
+        this  = LoadGenerator(master,
+                              stream(arguments, arguments.first),
+                              arguments.rate,
+                              MASTER_RANK)
+        exchanges = master, client
+    else:
+        this_connection = connection(arguments.transport,
+                                     arguments.master,
+                                     arguments.this_host,
+                                     arguments.this_port)
+        exchange = Exchange(this_connection,
+                            address=(arguments.other_host,
+                                     arguments.other_port),
+                            reconnect=True)
+        other = None
+        this  = LoadGenerator(exchange,
+                              stream(arguments, arguments.first),
+                              arguments.rate,
+                              MASTER_RANK if arguments.master else
+                                  randrange(1, 1 << 32))
+        exchanges = exchange,
+
+    for exchange in exchanges:
+        exchange.start()
+    try:
+        for generator in filter(None, (this, other)):
+            if not generator.wait(arguments.timeout):
+                print('[ FAIL ] Other peer did not connect')
+                return
+        if arguments.record:
+            this.record()
+        # The second headless peer runs on its own thread, as it would on its
+        # own machine
+        if other is not None:
+            thread = Thread(target=other.run, args=(arguments.duration,))
+            thread.start()
+        snapshot = this.run(arguments.duration)
+        if other is not None:
+            thread.join()
+        this.report(snapshot)
+        if arguments.record:
+            save_to_file(arguments.record, this.recording())
+            print('[ OKAY ] Recorded {} ticks'.format(len(this.recording())))
+    finally:
+        for exchange in exchanges:
+            exchange.stop()
+
+
+
+#------------------------------------------------------------------------------#
+if __name__ == '__main__':
+    main(arguments_parser().parse_args())
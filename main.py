@@ -30,6 +30,7 @@
 # Import python modules
 from itertools   import repeat, chain
 from math        import sqrt, radians
+from time        import perf_counter
 
 # Import blender modules
 from mathutils import Matrix, Euler, Quaternion
@@ -38,19 +39,32 @@ from mathutils import Matrix, Euler, Quaternion
 from linmath import Vec3, Mat4x4
 
 # Import user modules
-from history import History
-from utils   import (name_of_vertex,
-                     index_of_vertex)
-from surface import (VertexLocked,
-                     VertexAlreadySelected)
-from app     import (Application,
-                     EscapeApplication,
-                     RestartApplication,
-                     MOUNTED_ON_DESK,
-                     MOUNTED_ON_HEAD)
+from sync     import VertexSync
+from history  import History, Movement
+from operations import OperationLog
+from snapshot import (CHECKSUM,
+                      checksum,
+                      SnapshotSender,
+                      SnapshotReceiver)
+from surface  import (VertexLocked,
+                      VertexAlreadySelected)
+from communication import (MSG_DELTA,
+                           MSG_RESTART,
+                           MSG_SNAPSHOT,
+                           MSG_CHECKSUM,
+                           MSG_CONNECTED,
+                           MSG_OPERATION)
+from app      import (Application,
+                      EscapeApplication,
+                      RestartApplication,
+                      MOUNTED_ON_DESK,
+                      MOUNTED_ON_HEAD)
 
 # Import global level constants
 from const import (APP_ESCAPED,
+                   INT_HISTORY_SIZE,
+                   INT_HISTORY_BYTES,
+                   INT_HISTORY_MERGE_WINDOW,
                    COLOR_ROTATE_PINCH_BASE,
                    COLOR_ROTATE_PINCH_OKAY,
                    COLOR_GRAB_MOVE_OKAY,
@@ -62,6 +76,16 @@ from const import (APP_ESCAPED,
                    COLOR_GEOMETRY_LITE,
                    COLOR_LOCKED,
                    COLOR_UNLOCKED,
+                   COLOR_SELECTED,
+                   SCULPT_SOFT_RADIUS,
+                   SCULPT_SOFT_FALLOFF,
+                   SCULPT_DETAIL_RADIUS,
+                   SCULPT_VOLUME_SHAPE,
+                   SCULPT_SMOOTH_RADIUS,
+                   SCULPT_SMOOTH_STRENGTH,
+                   SCULPT_SMOOTH_ITERATIONS,
+                   SCULPT_SMOOTH_BUDGET,
+                   SCULPT_MIRROR_AXIS,
                    COMM_IS_PAIRED,
                    COMM_IS_MASTER,
                    COMM_RESTART)
@@ -80,6 +104,12 @@ SWIPE_DEVIANCE        =  20
 ZOOM_SCALE_FACTOR     = 0.1
 ROTATE_SCALE_FACTOR   = 0.1
 
+# Kind of the selecting events (a run of them is merged into a single event)
+SELECTION             = 'selection'
+
+# Seconds between two divergence checks
+CHECKSUM_INTERVAL     = 2
+
 
 
 # Helper functions
@@ -131,26 +161,53 @@ class KibuVR(Application):
 
         # Set communication
         if COMM_IS_PAIRED:
+            self._sync = VertexSync()
+            # The master user's surface is the reference, which is sent to the
+            # others when they connect or their surfaces diverge from it
+            self._snapshot_sender   = SnapshotSender()
+            self._snapshot_receiver = SnapshotReceiver()
+            # Check right after connecting (or restarting)
+            self._last_checksum     = -CHECKSUM_INTERVAL
+            # The movements undone and redone are shared with the others
+            self._operations = OperationLog(self.surface.rank,
+                                            self._connection.send,
+                                            self.apply_operation)
             self.append_callback('comm', self.on_communication)
             if not COMM_IS_MASTER:
                 self.vertex_origo.applyRotation((0, 0, radians(180)))
                 self.surface.update()
+        else:
+            self._operations = None
 
         # Create undo stack
         # self._action = None
         @History.event
         def history_is_empty(direction, prefix):
             self.text.write('{PREFIX}History is empty'.format(PREFIX=prefix))
-        self._history = History(history_is_empty)
+        self._history = History(history_is_empty,
+                                max_size=INT_HISTORY_SIZE,
+                                max_bytes=INT_HISTORY_BYTES,
+                                journal=self.journal,
+                                events_of=self._events_of,
+                                merge_window=INT_HISTORY_MERGE_WINDOW,
+                                shared=self._operations)
 
         # Set initial states
         self._is_picked        = False
         self._is_grabbed       = False
         self._is_dual_grabbed  = False
         self._grab_position    = None
+        self._grab_rows        = None
+        self._grab_moving      = None
+        self._grab_mirror      = None
         self._grab_start       = None
+        self._grab_weights     = None
+        self._grab_held        = []
+        self._grab_touched     = set()
         self._dual_grab_vector = None
         self._dual_grab_length = None
+        self._volume_corners   = None
+        self._is_volume_picked = False
 
         self._zoomed_pick_distance = PICK_HOLD_DISTANCE
 
@@ -161,6 +218,7 @@ class KibuVR(Application):
 
         # Set actual callbacks
         self.hands.append_callback('grab', self.on_grab)
+        self.hands.append_callback('volume', self.on_volume)
         self.hands.left.append_callback('pick', self.on_pick)
         self.hands.right.append_callback('pick', self.on_pick)
         self.hands.left.append_callback('swipe_left_right', self.on_swipe_left_right)
@@ -180,36 +238,134 @@ class KibuVR(Application):
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def on_reset(self, states):
         if states['restart'] == COMM_RESTART:
+            # Restart the opponent user's application as well
+            if COMM_IS_PAIRED:
+                self._connection.send(MSG_RESTART)
             raise RestartApplication
 
 
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def journal_records(self):
+        return self._history.records()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def replay_journal(self):
+        # Redo the edits made after the auto-save, and rebuild the history
+        replayed = self._history.recover(self.journal.records(),
+                                         checksum(self.surface.serialise()))
+        print('[OKAY] {} records have been replayed from:'.format(replayed),
+              self.journal.path)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def apply_operation(self, indices, offsets):
+        # Move the vertices by another user's operation (except the ones held
+        # by a third user, who moves them)
+        self.surface.shift(indices, offsets)
+        # If this user is grabbing some of them, the grab's movement starts
+        # from the moved positions, so it does not contain the operation
+        if self._is_grabbed and len(self._grab_rows):
+            offset_of = dict(zip(indices.tolist(), offsets.tolist()))
+            start     = self._grab_start
+            for i, row in enumerate(self._grab_rows):
+                offset = offset_of.get(row)
+                if offset is not None:
+                    start[i] = [s + o for s, o in zip(start[i], offset)]
+
+
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def on_communication(self, states):
-        # Local reference
-        surface = self.surface
+        # Local references
+        surface    = self.surface
+        statistics = self._connection.statistics
         # Prepare and send data
-        data = []
-        for identifier, vertex in surface.selected():
-            vertex_position = vertex.localPosition
-            data.append((index_of_vertex(vertex.name),
-                         vertex_position[0],
-                         vertex_position[1],
-                         vertex_position[2]))
+        started   = perf_counter()
+        data      = surface.selected_positions()
+        collected = perf_counter()
+        delta     = self._sync.pack(data)
+        statistics.time('blender_read', collected - started)
+        statistics.time('pack', perf_counter() - collected)
+
+        # Send data without waiting for the network (picks and releases first,
+        # so the opponent user knows who owns the vertices moved in the delta)
+        connection = self._connection
+        for kind, payload in chain(surface.ownership_messages(),
+                                   self._snapshot_sender.next()):
+            connection.send(kind, payload)
+        connection.send(MSG_DELTA, delta)
+
+        # Let the master user know the state of this user's surface, if nobody
+        # is editing it at the moment, so the surfaces should be the same
+        now = perf_counter()
+        if (not COMM_IS_MASTER and
+            not surface.is_held() and
+            now - self._last_checksum >= CHECKSUM_INTERVAL):
+                self._last_checksum = now
+                connection.send(MSG_CHECKSUM,
+                                CHECKSUM.pack(checksum(surface.serialise())))
 
         # Receive data and act based on it
-        for vertex in surface.unlock_all():
-            vertex.color = COLOR_UNLOCKED
-        try:
-            received_data = self._connection.transfer(data)
-            for i, x, y, z in received_data:
-                vertex_name = name_of_vertex(i)
-                surface[vertex_name].localPosition = x, y, z
-                surface.lock(vertex_name).color = COLOR_LOCKED
-            surface.update()
-        # If 'NoneType|int' object is not iterable
-        except TypeError:
-            if received_data == COMM_RESTART:
+        updated = False
+        for kind, payload in connection.receive():
+            if kind == MSG_RESTART:
                 raise RestartApplication
+            # If the opponent user has (re)connected, let it know what this
+            # user is holding, and check whether the surfaces diverged meanwhile
+            elif kind == MSG_CONNECTED:
+                for vertex in surface.rejoin():
+                    vertex.color = COLOR_UNLOCKED
+                # Start a new delta session, as the acknowledgements of the
+                # messages sent before the reconnection will never arrive
+                self._sync.reset()
+                self._last_checksum = -CHECKSUM_INTERVAL
+            # If another user's surface diverged from this user's one
+            elif kind == MSG_CHECKSUM:
+                if COMM_IS_MASTER and not surface.is_held():
+                    coords = surface.serialise()
+                    if CHECKSUM.unpack(payload)[0] != checksum(coords):
+                        self._snapshot_sender.start(coords)
+            # If another user has undone or redone a movement
+            elif kind == MSG_OPERATION:
+                if self._operations.receive(payload):
+                    updated = True
+            # If (part of) the master user's surface arrived (the vertices
+            # held by this user are kept, if they are grabbed, the snapshot
+            # would move them away from the hands; once they are released, the
+            # next checksum will tell whether they still differ)
+            elif kind == MSG_SNAPSHOT:
+                coords = self._snapshot_receiver.add(payload)
+                if coords is not None:
+                    surface.deserialise(coords, keep_selected=True)
+                    updated = True
+            elif kind == MSG_DELTA:
+                started  = perf_counter()
+                moved    = self._sync.unpack(payload)[0]
+                unpacked = perf_counter()
+                # Never let the opponent user move the vertices owned by this one
+                indices   = []
+                positions = []
+                for i, position in moved:
+                    if not surface.is_selected(i):
+                        indices.append(i)
+                        positions.append(position)
+                if indices:
+                    surface.place(indices, positions)
+                    updated = True
+                statistics.time('unpack', unpacked - started)
+                statistics.time('blender_write', perf_counter() - unpacked)
+            # Only touch the vertices picked or released by the opponent user
+            else:
+                locked, unlocked, lost, gained = surface.apply_ownership(kind,
+                                                                         payload)
+                for vertex in chain(locked, lost):
+                    vertex.color = COLOR_LOCKED
+                for vertex in unlocked:
+                    vertex.color = COLOR_UNLOCKED
+                for vertex in gained:
+                    vertex.color = COLOR_GEOMETRY_LITE
+        if updated:
+            surface.update()
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def on_swipe_left_right(self, states):
@@ -330,17 +486,16 @@ class KibuVR(Application):
                 # Moved up
                 else:
                     surface = self.surface
-                    vertices = set()
-                    for vertex in self.surface.deselect_all():
+                    vertices = self.surface.deselect_all()
+                    for _, vertex in vertices:
                         vertex.color = COLOR_GEOMETRY_DARK
-                        vertices.add(vertex)
                     self.text.write('Deselect all vertices')
 
                     @History.event
                     def select_vertices(direction, prefix):
-                        for vertex in vertices:
+                        for index, vertex in vertices:
                             try:
-                                surface.select(vertex.name)
+                                surface.select(index)
                                 vertex.color = COLOR_GEOMETRY_LITE
                             except (VertexLocked, VertexAlreadySelected):
                                 pass
@@ -348,9 +503,9 @@ class KibuVR(Application):
 
                     @History.event
                     def deselect_vertices(direction, prefix):
-                        for vertex in vertices:
+                        for index, vertex in vertices:
                             try:
-                                surface.deselect(vertex.name)
+                                surface.deselect(index)
                                 vertex.color = COLOR_GEOMETRY_DARK
                             except VertexLocked:
                                 pass
@@ -451,22 +606,57 @@ class KibuVR(Application):
                 # If this is the first cycle of a single grab
                 if not self._is_grabbed:
                     self._is_grabbed = True
-                    self._grab_start = {id: tuple(v.localPosition) for id, v in self.surface.selected()}
-
-                # If this grab is part of a previous grab-cycle
-                try:
-                    # Calculate vector between previous
-                    # and current thumb positions
-                    movement = Vec3.from_line(prev[0], prev[1], prev[2],
-                                              curr[0], curr[1], curr[2])
-                    # Move all selected vertices
-                    for _, vertex in self.surface.selected():
-                        vertex.applyMovement(movement)
-                    # Update geometry
-                    self.surface.update()
-                # If this grab is starting a new grab-cycle
-                except TypeError:
-                    pass
+                    surface = self.surface
+                    rows    = surface.selected_indices()
+                    weights = None
+                    mirror  = SCULPT_MIRROR_AXIS if self._mirroring else None
+                    # If the grab is a stroke of the smoothing brush, it
+                    # collects the vertices it touches while it lasts
+                    if self._smoothing:
+                        rows = []
+                    else:
+                        # If mirrored, the hand moves the vertices on its side
+                        # of the mirror, and they move their mirrors
+                        if mirror is not None:
+                            rows = surface.on_side_of(rows, mirror, curr)
+                        # If the neighbours are moved as well
+                        if self._soft_selection:
+                            rows, weights = surface.falloff(rows,
+                                                            SCULPT_SOFT_RADIUS,
+                                                            SCULPT_SOFT_FALLOFF)
+                    self._grab_moving  = rows
+                    self._grab_weights = weights
+                    self._grab_mirror  = mirror
+                    if not self._smoothing:
+                        if mirror is not None:
+                            rows = surface.symmetric(rows, mirror)[0]
+                        # Hold the moved neighbours and mirrors during the grab,
+                        # so the opponent user receives their movements, and
+                        # cannot pick them in the meantime
+                        self._grab_held = surface.select_many(rows).tolist()
+                    self._grab_rows  = rows
+                    self._grab_start = surface.positions[rows].tolist()
+
+                # If this grab is a stroke of the smoothing brush
+                if self._smoothing:
+                    self.smooth_around(curr)
+                else:
+                    # If this grab is part of a previous grab-cycle
+                    try:
+                        # Calculate vector between previous
+                        # and current thumb positions
+                        movement = Vec3.from_line(prev[0], prev[1], prev[2],
+                                                  curr[0], curr[1], curr[2])
+                        # Move all selected vertices
+                        self.surface.move_vertices(self._grab_moving,
+                                                   translation=movement,
+                                                   weights=self._grab_weights,
+                                                   mirror=self._grab_mirror)
+                        # Update geometry
+                        self.surface.update()
+                    # If this grab is starting a new grab-cycle
+                    except TypeError:
+                        pass
                 # Store current position as previous one for the next cycle
                 self._grab_position = curr
             # If none of the hands are grabbing
@@ -476,37 +666,29 @@ class KibuVR(Application):
 
                 # If this release is the end of a grab cycle
                 if self._is_grabbed:
-                    start = self._grab_start
-                    stop  = {id: tuple(v.localPosition) for id, v in self.surface.selected()}
-
-                    # Create events
-                    @History.event
-                    def move_back_vertices(direction, prefix):
-                        surface = self.surface
-                        # Move all selected vertices
-                        for identifier, position in start.items():
-                            # If opponent user is not using them
-                            if not surface.is_locked(identifier):
-                                surface[identifier].localPosition = position
-                        # Update geometry
-                        surface.update()
-                        self.text.write('{PREFIX}Vertices moved to position'.format(PREFIX=prefix))
-
-                    @History.event
-                    def move_vertices(direction, prefix):
-                        surface = self.surface
-                        # Move all selected vertices
-                        for identifier, position in stop.items():
-                            # If opponent user is not using them
-                            if not surface.is_locked(identifier):
-                                surface[identifier].localPosition = position
-                        # Update geometry
-                        surface.update()
-                        self.text.write('{PREFIX}Vertices moved to position'.format(PREFIX=prefix))
-
-                    # Save events
-                    self._history.push(undo=move_back_vertices,
-                                       redo=move_vertices)
+                    rows = self._grab_rows
+                    # Only the offsets of the moved vertices are remembered
+                    movement = Movement(rows,
+                                        self._grab_start,
+                                        self.surface.positions[rows])
+
+                    # Create and save events
+                    undo, redo = self._movement_events(movement)
+                    # (repeated grabs of the same vertices are merged)
+                    self._history.push(undo=undo,
+                                       redo=redo,
+                                       size=movement.size,
+                                       record=movement.to_bytes(),
+                                       kind=tuple(rows))
+
+                    # Release the neighbours held only for this grab
+                    for index in self._grab_held:
+                        try:
+                            self.surface.deselect(index)
+                        except VertexLocked:
+                            pass
+                    self._grab_held = []
+                    self._grab_touched.clear()
 
                 self._grab_position    = \
                 self._dual_grab_vector = \
@@ -516,10 +698,109 @@ class KibuVR(Application):
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def on_pick(self, states):
-        # If there is a grabbing going on
-        if states['grabbed']:
+    def smooth_around(self, position):
+        # Relax the vertices around the closest one to the hand, as much as
+        # the frame's budget allows
+        surface = self.surface
+        picked  = surface.nearest(position, self._zoomed_pick_distance)
+        if picked is None:
             return
+        rows, weights = surface.falloff((picked[0],),
+                                        SCULPT_SMOOTH_RADIUS,
+                                        SCULPT_SOFT_FALLOFF)
+        # If mirrored, the mirrors are smoothed the same way, at the same time
+        if self._grab_mirror is not None:
+            rows, sources = surface.symmetric(rows, self._grab_mirror)
+            weights       = weights[sources]
+        # Hold the vertices touched first by this stroke, so the opponent user
+        # receives their movements, and remember where they were before it
+        touched = self._grab_touched
+        fresh   = [index for index in rows.tolist() if index not in touched]
+        if fresh:
+            touched.update(fresh)
+            self._grab_rows.extend(fresh)
+            self._grab_start.extend(surface.positions[fresh].tolist())
+            self._grab_held.extend(surface.select_many(fresh).tolist())
+        surface.smooth(rows, weights,
+                       strength=SCULPT_SMOOTH_STRENGTH,
+                       iterations=SCULPT_SMOOTH_ITERATIONS,
+                       budget=SCULPT_SMOOTH_BUDGET)
+        # Update geometry
+        surface.update()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def pinching_hands(self) -> 'list of hands':
+        return [hand for hand in self.hands
+                    if (not hand.get_state('grabbed') and
+                        distance(hand.thumb.position,
+                                 hand.index.position) < PICK_RELEASE_DISTANCE)]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def on_volume(self, states):
+        pinching = self.pinching_hands()
+        # If both hands are picking, the volume is between the two picks
+        if len(pinching) == 2:
+            self._is_volume_picked = True
+            self._volume_corners   = tuple(midpoint(hand.thumb.position,
+                                                    hand.index.position)
+                                               for hand in pinching)
+            for hand in pinching:
+                hand.thumb.color = hand.index.color = COLOR_SELECTED
+        # If this release is the end of a volume selection
+        elif self._volume_corners is not None:
+            self.select_volume(*self._volume_corners)
+            self._volume_corners = None
+        # If both hands are released after the volume selection
+        elif not pinching:
+            self._is_volume_picked = False
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def select_volume(self, first, second):
+        # Select all the vertices in the volume at once, as a single event
+        surface  = self.surface
+        selected = surface.inside(SCULPT_VOLUME_SHAPE, first, second)
+        # If mirrored, the mirrors of the vertices in the volume as well
+        if self._mirroring:
+            selected = surface.symmetric(selected, SCULPT_MIRROR_AXIS)[0]
+        selected = surface.select_many(selected)
+        for index in selected.tolist():
+            surface[index].color = COLOR_GEOMETRY_LITE
+        self.text.write('{COUNT} vertices selected'.format(COUNT=len(selected)))
+        if not len(selected):
+            return
+
+        # Create events
+        @History.event
+        def deselect_vertices(direction, prefix):
+            for index in surface.deselect_many(selected).tolist():
+                surface[index].color = COLOR_GEOMETRY_DARK
+            self.text.write('{PREFIX}Deselect vertices'.format(PREFIX=prefix))
+
+        @History.event
+        def select_vertices(direction, prefix):
+            for index in surface.select_many(selected).tolist():
+                surface[index].color = COLOR_GEOMETRY_LITE
+            self.text.write('{PREFIX}Select vertices'.format(PREFIX=prefix))
+
+        # Save events
+        self._history.push(undo=deselect_vertices,
+                           redo=select_vertices,
+                           size=selected.nbytes,
+                           kind=SELECTION)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def on_pick(self, states):
+        # If there is a grabbing or a volume selection going on (the hands'
+        # callbacks are executed before the volume selection's one, so the
+        # start of the volume selection has to be checked here as well)
+        if (states['grabbed'] or
+            self._is_volume_picked or
+            len(self.pinching_hands()) == 2):
+                return
         # Get local reference of this hand
         hand = states['hand']
         # Local reference
@@ -532,74 +813,84 @@ class KibuVR(Application):
             surface = self.surface
             # Hide non picking fingers
             hand.hide_all('thumb', 'index')
-            # Check all vertices on the surface
-            for vertex in surface:
-                # If vertex's distance to the thumb is in the picking-hold-range
-                if distance(midpoint(thumb_position,
-                                     index_position),
-                            vertex.worldPosition) < self._zoomed_pick_distance:
-                    # If user is already picking
-                    if self._is_picked:
-                        return
-
-                    # Create events
-                    @History.event
-                    def deselect_vertex(direction, prefix):
-                        index = index_of_vertex(vertex.name)
-                        try:
-                            surface.deselect(vertex.name)
-                            vertex.color = COLOR_GEOMETRY_DARK
-                        except VertexLocked:
-                            pass
+            # Find the closest vertex to the midpoint of the fingers in the
+            # picking-hold-range (without checking every vertex)
+            picked = surface.nearest(midpoint(thumb_position,
+                                              index_position),
+                                     self._zoomed_pick_distance)
+            if picked is not None:
+                index, vertex = picked
+                # If user is already picking
+                if self._is_picked:
+                    return
+                # If mirrored, the mirror of the vertex is picked with it
+                mirrors = (surface.symmetric((index,),
+                                             SCULPT_MIRROR_AXIS)[0][1:]
+                               if self._mirroring else ())
+
+                # Create events
+                @History.event
+                def deselect_vertex(direction, prefix):
+                    try:
+                        surface.deselect(index)
+                        vertex.color = COLOR_GEOMETRY_DARK
+                    except VertexLocked:
+                        pass
+                    for i in surface.deselect_many(mirrors).tolist():
+                        surface[i].color = COLOR_GEOMETRY_DARK
+                    self.text.write(
+                        '{PREFIX}Vertex #{INDEX} deselected'.format(
+                            PREFIX = prefix,
+                            INDEX  = index))
+
+                @History.event
+                def select_vertex(direction, prefix):
+                    # If the opponent user is not grabbing the vertex already
+                    try:
+                        surface.select(index)
+                        vertex.color = COLOR_GEOMETRY_LITE
+                        for i in surface.select_many(mirrors).tolist():
+                            surface[i].color = COLOR_GEOMETRY_LITE
                         self.text.write(
-                            '{PREFIX}Vertex #{INDEX} deselected'.format(
+                            '{PREFIX}Vertex #{INDEX} selected'.format(
                                 PREFIX = prefix,
                                 INDEX  = index))
-
-                    @History.event
-                    def select_vertex(direction, prefix):
-                        index = index_of_vertex(vertex.name)
-                        # If the opponent user is not grabbing the vertex already
-                        try:
-                            surface.select(vertex.name)
-                            vertex.color = COLOR_GEOMETRY_LITE
-                            self.text.write(
-                                '{PREFIX}Vertex #{INDEX} selected'.format(
-                                    PREFIX = prefix,
-                                    INDEX  = index))
-                        # If the opponent user is grabbing the vertex
-                        except VertexLocked:
-                            self.text.write(
-                                '{PREFIX}Vertex #{INDEX} is locked'.format(
-                                    PREFIX = prefix,
-                                    INDEX  = index))
-                        # If vertex is already selected
-                        except VertexAlreadySelected:
-                            # If first call
-                            if direction == History.NONE:
-                                raise VertexAlreadySelected
-                            # If unod or redo
-                            self.text.write(
-                                '{PREFIX}Vertex #{INDEX} selected'.format(
-                                    PREFIX = prefix,
-                                    INDEX  = index))
-
-                    # Try to select vertex
-                    try:
-                        select_vertex(History.NONE, History.NONE_PREFIX)
-                        self._history.push(undo=deselect_vertex,
-                                           redo=select_vertex)
-                    # If vertex has already been selected
+                    # If the opponent user is grabbing the vertex
+                    except VertexLocked:
+                        self.text.write(
+                            '{PREFIX}Vertex #{INDEX} is locked'.format(
+                                PREFIX = prefix,
+                                INDEX  = index))
+                    # If vertex is already selected
                     except VertexAlreadySelected:
-                        deselect_vertex(History.NONE, History.NONE_PREFIX)
-                        self._history.push(undo=select_vertex,
-                                           redo=deselect_vertex)
-                    # Set state
-                    self._is_picked = True
-                    # Feedback the user about the pick's state
-                    hand.thumb.color = hand.index.color = COLOR_GRAB_PINCH_OKAY
-                    # Stop the iterations
-                    break
+                        # If first call
+                        if direction == History.NONE:
+                            raise VertexAlreadySelected
+                        # If unod or redo
+                        self.text.write(
+                            '{PREFIX}Vertex #{INDEX} selected'.format(
+                                PREFIX = prefix,
+                                INDEX  = index))
+
+                # Try to select vertex
+                try:
+                    select_vertex(History.NONE, History.NONE_PREFIX)
+                    self._history.push(undo=deselect_vertex,
+                                       redo=select_vertex,
+                                       kind=SELECTION)
+                    # Show the finer vertices around the picked one
+                    if surface.level:
+                        surface.refine((index,), SCULPT_DETAIL_RADIUS)
+                # If vertex has already been selected
+                except VertexAlreadySelected:
+                    deselect_vertex(History.NONE, History.NONE_PREFIX)
+                    self._history.push(undo=select_vertex,
+                                       redo=deselect_vertex,
+                                       kind=SELECTION)
+                # Set state
+                self._is_picked = True
+                # Feedback the user about the pick's state
+                hand.thumb.color = hand.index.color = COLOR_GRAB_PINCH_OKAY
             # Picked in the air
             else:
                 hand.thumb.color = hand.index.color = COLOR_GRAB_PINCH_FAIL
@@ -614,6 +905,46 @@ class KibuVR(Application):
             self._is_picked = False
 
 
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _movement_events(self, movement) -> 'undo and redo events':
+        @History.event
+        def move_back_vertices(direction, prefix):
+            surface = self.surface
+            # Move all selected vertices, except the ones held by the opponent
+            # user (who moves them, when the undo is shared with it)
+            indices, offsets = movement.unpack()
+            surface.shift(indices, -offsets)
+            # Update geometry
+            surface.update()
+            self.text.write('{PREFIX}Vertices moved to position'.format(PREFIX=prefix))
+
+        @History.event
+        def move_vertices(direction, prefix):
+            surface = self.surface
+            # Move all selected vertices, except the ones held by the opponent
+            # user (who moves them, when the redo is shared with it)
+            surface.shift(*movement.unpack())
+            # Update geometry
+            surface.update()
+            self.text.write('{PREFIX}Vertices moved to position'.format(PREFIX=prefix))
+
+        return move_back_vertices, move_vertices
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _events_of(self, record) -> 'undo and redo events and their size':
+        # Only the movements can be recreated from their records, the
+        # selections are not kept between the sessions
+        if record:
+            movement = Movement.from_bytes(record)
+            return self._movement_events(movement) + (movement.size,)
+
+        @History.event
+        def not_recovered(direction, prefix):
+            self.text.write('{PREFIX}Selection was not recovered'.format(PREFIX=prefix))
+        return not_recovered, not_recovered, 0
+
+
 
 #------------------------------------------------------------------------------#
 application = KibuVR()
@@ -0,0 +1,145 @@
+## INFO ########################################################################
+##                                                                            ##
+##                                  plastey                                   ##
+##                                  =======                                   ##
+##                                                                            ##
+##      Oculus Rift + Leap Motion + Python 3 + C + Blender + Arch Linux       ##
+##                       Version: 0.2.4.144 (20150514)                        ##
+##                            File: operations.py                             ##
+##                                                                            ##
+##               For more information about the project, visit                ##
+##                         <http://plastey.kibu.hu>.                          ##
+##              Copyright (C) 2015 Peter Varo, Kitchen Budapest               ##
+##                                                                            ##
+##  This program is free software: you can redistribute it and/or modify it   ##
+##   under the terms of the GNU General Public License as published by the    ##
+##       Free Software Foundation, either version 3 of the License, or        ##
+##                    (at your option) any later version.                     ##
+##                                                                            ##
+##    This program is distributed in the hope that it will be useful, but     ##
+##         WITHOUT ANY WARRANTY; without even the implied warranty of         ##
+##            MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.            ##
+##            See the GNU General Public License for more details.            ##
+##                                                                            ##
+##     You should have received a copy of the GNU General Public License      ##
+##     along with this program, most likely a file in the root directory,     ##
+##        called 'LICENSE'. If not, see <http://www.gnu.org/licenses>.        ##
+##                                                                            ##
+######################################################################## INFO ##
+
+# Import python modules
+from struct      import Struct
+from collections import deque
+from numpy       import array_split, zeros
+
+# Import user modules
+from history       import Movement
+from communication import MSG_OPERATION
+
+
+#------------------------------------------------------------------------------#
+# Operation message layout
+#   header => rank of the user (uint32), sequence number of the operation of
+#             the user (uint32), action (uint8), followed by the serialised
+#             movement of the operation
+OPERATION = Struct('!IIB')
+
+# Actions of the operations
+OPERATION_DONE   = 0
+OPERATION_UNDONE = 1
+OPERATION_REDONE = 2
+
+# Number of the operations remembered of a single user
+LOG_SIZE = 256
+# Maximum size of the movement in a single message (the larger movements are
+# split into more messages, so they fit into datagrams as well)
+MOVEMENT_SIZE = 8192
+
+
+
+#------------------------------------------------------------------------------#
+def _split(record) -> 'list of serialised movements':
+    if len(record) <= MOVEMENT_SIZE:
+        return [record]
+    indices, offsets = Movement.from_bytes(record).unpack()
+    pieces = -(-len(record)//MOVEMENT_SIZE)
+    return [Movement(part, zeros(moved.shape), moved).to_bytes()
+                for part, moved in zip(array_split(indices, pieces),
+                                       array_split(offsets, pieces))]
+
+
+
+#------------------------------------------------------------------------------#
+# Operations of the users shared over the connection: every user publishes the
+# movements it does, undoes and redoes, and logs the ones of the others. As the
+# movements are offsets, the undo of a user reverts only its own movement,
+# while the others' movements made in the meantime stay. The done movements
+# are already streamed to the others, while they are made, so only the undone
+# and redone ones are applied, with the apply function. (The vertices held by
+# a user are moved by that user only, so the others leave them to it)
+class OperationLog:
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, rank, send: 'function of message type and payload',
+                             apply: 'function of indices and offsets'):
+        self._rank     = rank
+        self._send     = send
+        self._apply    = apply
+        self._sequence = 0
+        # Operations of the users => {rank: [(sequence, action, movement)]}
+        self._logs     = {}
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def operations(self, rank) -> 'tuples of sequence, action and movement':
+        return tuple(self._logs.get(rank, ()))
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def done(self, record: 'serialised movement'):
+        self.publish(OPERATION_DONE, record)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def undone(self, record: 'serialised movement'):
+        self.publish(OPERATION_UNDONE, record)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def redone(self, record: 'serialised movement'):
+        self.publish(OPERATION_REDONE, record)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def publish(self, action, record: 'serialised movement'):
+        self._sequence += 1
+        header = OPERATION.pack(self._rank, self._sequence, action)
+        # As the movements are offsets, the parts of a split movement can be
+        # applied in any order
+        for record in _split(record):
+            self._log(self._rank, self._sequence, action, record)
+            self._send(MSG_OPERATION, header + record)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def receive(self, payload) -> 'boolean':
+        # Returns True, if the operation has moved any vertices
+        rank, sequence, action = OPERATION.unpack_from(payload)
+        movement = self._log(rank, sequence, action, payload[OPERATION.size:])
+        if action == OPERATION_DONE or not len(movement):
+            return False
+        indices, offsets = movement.unpack()
+        self._apply(indices,
+                    -offsets if action == OPERATION_UNDONE else offsets)
+        return True
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _log(self, rank, sequence, action, record) -> 'Movement':
+        movement = Movement.from_bytes(record)
+        try:
+            log = self._logs[rank]
+        except KeyError:
+            log = self._logs[rank] = deque(maxlen=LOG_SIZE)
+        log.append((sequence, action, movement))
+        return movement
@@ -0,0 +1,216 @@
+## INFO ########################################################################
+##                                                                            ##
+##                                  plastey                                   ##
+##                                  =======                                   ##
+##                                                                            ##
+##      Oculus Rift + Leap Motion + Python 3 + C + Blender + Arch Linux       ##
+##                       Version: 0.2.4.144 (20150514)                        ##
+##                             File: ownership.py                             ##
+##                                                                            ##
+##               For more information about the project, visit                ##
+##                         <http://plastey.kibu.hu>.                          ##
+##              Copyright (C) 2015 Peter Varo, Kitchen Budapest               ##
+##                                                                            ##
+##  This program is free software: you can redistribute it and/or modify it   ##
+##   under the terms of the GNU General Public License as published by the    ##
+##       Free Software Foundation, either version 3 of the License, or        ##
+##                    (at your option) any later version.                     ##
+##                                                                            ##
+##    This program is distributed in the hope that it will be useful, but     ##
+##         WITHOUT ANY WARRANTY; without even the implied warranty of         ##
+##            MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.            ##
+##            See the GNU General Public License for more details.            ##
+##                                                                            ##
+##     You should have received a copy of the GNU General Public License      ##
+##     along with this program, most likely a file in the root directory,     ##
+##        called 'LICENSE'. If not, see <http://www.gnu.org/licenses>.        ##
+##                                                                            ##
+######################################################################## INFO ##
+
+# Import python modules
+from struct import Struct
+
+# Import user modules
+from communication import (MSG_CLAIM,
+                           MSG_RELEASE,
+                           MSG_TRANSFER)
+
+
+#------------------------------------------------------------------------------#
+# Ownership message layout
+#   header => logical clock (uint32), sender rank (uint32), receiver rank (uint32)
+#   record => vertex index (uint32)
+OWNERSHIP = Struct('!III')
+INDEX     = Struct('!I')
+
+# Rank of the master user, which wins every tie
+MASTER_RANK = 0
+
+
+
+#------------------------------------------------------------------------------#
+def indices(count) -> 'Struct':
+    return Struct('!{}I'.format(count))
+
+
+
+#------------------------------------------------------------------------------#
+# Table of the vertices held by the users: claims, releases and transfers are
+# recorded locally, queued as messages for the peers, and the messages of the
+# peers are applied to the same table. If two users claim the same vertex at
+# the same time, the claim with the lower (logical clock, rank) stamp wins, and
+# as every user applies the same rule, all the tables agree on the owner
+class Ownership:
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, rank=None, shared=True):
+        self.rank    = rank
+        # If there are no peers, the changes are not queued as messages
+        self._shared = shared
+        # Lamport clock, ordering the claims of the users
+        self._clock  = 0
+        # Owners of the held vertices => {index: (clock, rank)}
+        self._owners = {}
+        # Queued messages => [(kind, clock, sender, receiver, indices)]
+        self._queued = []
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __iter__(self) -> 'tuples of index and owner rank':
+        for index, (_, rank) in self._owners.items():
+            yield index, rank
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def owner(self, index) -> 'rank or None':
+        try:
+            return self._owners[index][1]
+        except KeyError:
+            return None
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def is_locked(self, index) -> 'boolean':
+        owner = self.owner(index)
+        return owner is not None and owner != self.rank
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def claim(self, index) -> 'boolean':
+        owner = self.owner(index)
+        if owner is None:
+            self._owners[index] = self._queue(MSG_CLAIM, self.rank, index)
+        return owner is None or owner == self.rank
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def release(self, index, rank=None):
+        # NOTE: if rank is specified, the vertex is released on behalf of that
+        #       user, e.g. because the user has been disconnected
+        rank = self.rank if rank is None else rank
+        if self.owner(index) == rank:
+            del self._owners[index]
+            self._queue(MSG_RELEASE, rank, index)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def transfer(self, index, rank):
+        if self.owner(index) == self.rank:
+            clock, _ = self._queue(MSG_TRANSFER, self.rank, index, rank)
+            self._owners[index] = clock, rank
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def flush(self) -> 'list of message type and payload pairs':
+        messages = []
+        for kind, clock, sender, receiver, queued in self._queued:
+            messages.append((kind, OWNERSHIP.pack(clock, sender, receiver) +
+                                   indices(len(queued)).pack(*queued)))
+        self._queued = []
+        return messages
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def announce(self) -> 'list of message type and payload pairs':
+        # Claims reproducing the whole table, e.g. for a newly joined user
+        return [(MSG_CLAIM, OWNERSHIP.pack(clock, rank, rank) +
+                            indices(len(claimed)).pack(*claimed))
+                    for (clock, rank), claimed in self._claims().items()]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def rejoin(self) -> 'indices of the vertices held by the other users':
+        # After reconnecting, forget the vertices of the other users (they will
+        # announce them again), and queue the claims of this user's vertices
+        owners  = self._owners
+        dropped = [i for i, (_, rank) in owners.items() if rank != self.rank]
+        for index in dropped:
+            del owners[index]
+        for (clock, rank), claimed in self._claims().items():
+            self._queued.append((MSG_CLAIM, clock, rank, rank, claimed))
+        return dropped
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def apply(self, kind, payload) -> 'locked, unlocked, lost and gained indices':
+        locked   = []
+        unlocked = []
+        lost     = []
+        gained   = []
+        clock, sender, receiver = OWNERSHIP.unpack_from(payload)
+        self._clock = max(self._clock, clock)
+        # If this user's own changes are echoed back
+        if sender == self.rank:
+            return locked, unlocked, lost, gained
+        owners = self._owners
+        stamp  = clock, sender
+        for index, in INDEX.iter_unpack(payload[OWNERSHIP.size:]):
+            current = owners.get(index)
+            # If vertex is free, or the claim is older than the current one
+            if kind == MSG_CLAIM:
+                if current is None:
+                    locked.append(index)
+                elif current[1] == sender or stamp > current:
+                    continue
+                elif current[1] == self.rank:
+                    lost.append(index)
+                owners[index] = stamp
+            # Only the owner can release or pass on a vertex
+            elif current is None or current[1] != sender:
+                continue
+            elif kind == MSG_RELEASE:
+                del owners[index]
+                unlocked.append(index)
+            elif kind == MSG_TRANSFER:
+                owners[index] = clock, receiver
+                if receiver == self.rank:
+                    gained.append(index)
+        return locked, unlocked, lost, gained
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _claims(self) -> 'indices grouped by stamps':
+        claims = {}
+        for index, stamp in self._owners.items():
+            claims.setdefault(stamp, []).append(index)
+        return claims
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _queue(self, kind, sender, index, receiver=None) -> 'clock and rank':
+        receiver = sender if receiver is None else receiver
+        if not self._shared:
+            self._clock += 1
+            return self._clock, receiver
+        queued   = self._queued
+        # Extend the last message if it is the same kind of change
+        try:
+            last = queued[-1]
+            if last[:1] + last[2:4] == (kind, sender, receiver):
+                last[4].append(index)
+                return last[1], receiver
+        except IndexError:
+            pass
+        self._clock = clock = self._clock + 1
+        queued.append((kind, clock, sender, receiver, [index]))
+        return clock, receiver
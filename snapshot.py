@@ -0,0 +1,176 @@
+## INFO ########################################################################
+##                                                                            ##
+##                                  plastey                                   ##
+##                                  =======                                   ##
+##                                                                            ##
+##      Oculus Rift + Leap Motion + Python 3 + C + Blender + Arch Linux       ##
+##                       Version: 0.2.4.144 (20150514)                        ##
+##                             File: snapshot.py                              ##
+##                                                                            ##
+##               For more information about the project, visit                ##
+##                         <http://plastey.kibu.hu>.                          ##
+##              Copyright (C) 2015 Peter Varo, Kitchen Budapest               ##
+##                                                                            ##
+##  This program is free software: you can redistribute it and/or modify it   ##
+##   under the terms of the GNU General Public License as published by the    ##
+##       Free Software Foundation, either version 3 of the License, or        ##
+##                    (at your option) any later version.                     ##
+##                                                                            ##
+##    This program is distributed in the hope that it will be useful, but     ##
+##         WITHOUT ANY WARRANTY; without even the implied warranty of         ##
+##            MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.            ##
+##            See the GNU General Public License for more details.            ##
+##                                                                            ##
+##     You should have received a copy of the GNU General Public License      ##
+##     along with this program, most likely a file in the root directory,     ##
+##        called 'LICENSE'. If not, see <http://www.gnu.org/licenses>.        ##
+##                                                                            ##
+######################################################################## INFO ##
+
+# Import python modules
+from array  import array
+from sys    import byteorder
+from struct import Struct, error as StructError
+from zlib   import compress, decompress, crc32, error as ZlibError
+
+# Import user modules
+from communication import MSG_SNAPSHOT
+
+
+#------------------------------------------------------------------------------#
+# Snapshot message layout
+#   header => snapshot identifier (uint16), chunk index (uint16),
+#             chunk count (uint16), followed by a slice of the compressed data
+#   data   => quantisation bits (uint8), and if quantised, bounding box of the
+#             coordinates (6 x float32) followed by the coordinates as uint16,
+#             otherwise the coordinates as float32 (both in little endian)
+CHUNK    = Struct('!HHH')
+BITS     = Struct('!B')
+BOUNDS   = Struct('!6f')
+CHECKSUM = Struct('!I')
+
+# Maximum size of the compressed data in a single message
+CHUNK_SIZE = 8192
+# Compression level, fastest is good enough for coordinates
+LEVEL      = 1
+
+
+
+#------------------------------------------------------------------------------#
+class SnapshotCorrupted(Exception): pass
+
+
+
+#------------------------------------------------------------------------------#
+def _little_endian(values) -> 'array':
+    if byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+
+#------------------------------------------------------------------------------#
+def checksum(coords) -> 'int':
+    # Both peers store the coordinates as float32 (the delta messages carry
+    # float32 values as well), so the same surfaces have the same checksums
+    return crc32(_little_endian(array('f', coords)).tobytes())
+
+
+
+#------------------------------------------------------------------------------#
+def encode(coords, bits=0) -> 'bytes':
+    # If coordinates should be stored as float32 values
+    if not bits:
+        return compress(BITS.pack(0) +
+                        _little_endian(array('f', coords)).tobytes(), LEVEL)
+    # Quantise the coordinates of each axis inside the bounding box
+    axes   = coords[0::3], coords[1::3], coords[2::3]
+    lows   = [min(axis, default=0) for axis in axes]
+    highs  = [max(axis, default=0) for axis in axes]
+    steps  = (1 << bits) - 1
+    scales = [steps/(h - l) if h > l else 0 for l, h in zip(lows, highs)]
+    values = array('H', [round((c - lows[i%3])*scales[i%3])
+                            for i, c in enumerate(coords)])
+    return compress(BITS.pack(bits) + BOUNDS.pack(*(lows + highs)) +
+                    _little_endian(values).tobytes(), LEVEL)
+
+
+
+#------------------------------------------------------------------------------#
+def decode(data) -> 'array of coordinates':
+    data = decompress(data)
+    bits = BITS.unpack_from(data)[0]
+    if not bits:
+        coords = array('f')
+        coords.frombytes(data[BITS.size:])
+        return _little_endian(coords)
+    bounds = BOUNDS.unpack_from(data, BITS.size)
+    values = array('H')
+    values.frombytes(data[BITS.size + BOUNDS.size:])
+    _little_endian(values)
+    steps  = (1 << bits) - 1
+    lows   = bounds[:3]
+    units  = [(h - l)/steps for l, h in zip(lows, bounds[3:])]
+    return array('f', [lows[i%3] + v*units[i%3] for i, v in enumerate(values)])
+
+
+
+#------------------------------------------------------------------------------#
+# Splits a snapshot into messages, which can be sent over several logic ticks
+class SnapshotSender:
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, chunk_size=CHUNK_SIZE, chunks_per_call=1):
+        self._chunk_size      = chunk_size
+        self._chunks_per_call = chunks_per_call
+        self._identifier      = 0
+        self._chunks          = []
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def start(self, coords, bits=0):
+        # Drop the rest of the previous snapshot, as it is outdated anyway
+        self._identifier = identifier = (self._identifier + 1) & 0xFFFF
+        data  = encode(coords, bits)
+        size  = self._chunk_size
+        count = max(1, -(-len(data)//size))
+        # NOTE: the chunks are reversed, so they can be popped from the end
+        self._chunks = [(MSG_SNAPSHOT, CHUNK.pack(identifier, index, count) +
+                                       data[index*size:(index + 1)*size])
+                            for index in reversed(range(count))]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def next(self) -> 'list of message type and payload pairs':
+        chunks = self._chunks
+        return [chunks.pop() for _ in range(min(len(chunks),
+                                                self._chunks_per_call))]
+
+
+
+#------------------------------------------------------------------------------#
+# Collects the chunks of a snapshot, and decodes it when all of them arrived
+class SnapshotReceiver:
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self):
+        self._identifier = None
+        self._chunks     = []
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def add(self, payload) -> 'array of coordinates or None':
+        identifier, index, count = CHUNK.unpack_from(payload)
+        # If this is the beginning of a new snapshot, forget the previous one
+        if identifier != self._identifier:
+            self._identifier = identifier
+            self._chunks     = [None]*count
+        chunks = self._chunks
+        chunks[index] = bytes(payload[CHUNK.size:])
+        if None in chunks:
+            return None
+        self._identifier = None
+        try:
+            return decode(b''.join(chunks))
+        except (ZlibError, StructError, ValueError) as exception:
+            raise SnapshotCorrupted from exception
@@ -0,0 +1,174 @@
+## INFO ########################################################################
+##                                                                            ##
+##                                  plastey                                   ##
+##                                  =======                                   ##
+##                                                                            ##
+##      Oculus Rift + Leap Motion + Python 3 + C + Blender + Arch Linux       ##
+##                       Version: 0.2.4.144 (20150514)                        ##
+##                              File: spatial.py                              ##
+##                                                                            ##
+##               For more information about the project, visit                ##
+##                         <http://plastey.kibu.hu>.                          ##
+##              Copyright (C) 2015 Peter Varo, Kitchen Budapest               ##
+##                                                                            ##
+##  This program is free software: you can redistribute it and/or modify it   ##
+##   under the terms of the GNU General Public License as published by the    ##
+##       Free Software Foundation, either version 3 of the License, or        ##
+##                    (at your option) any later version.                     ##
+##                                                                            ##
+##    This program is distributed in the hope that it will be useful, but     ##
+##         WITHOUT ANY WARRANTY; without even the implied warranty of         ##
+##            MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.            ##
+##            See the GNU General Public License for more details.            ##
+##                                                                            ##
+##     You should have received a copy of the GNU General Public License      ##
+##     along with this program, most likely a file in the root directory,     ##
+##        called 'LICENSE'. If not, see <http://www.gnu.org/licenses>.        ##
+##                                                                            ##
+######################################################################## INFO ##
+
+# Import python modules
+from math      import floor
+from itertools import product
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Module level constants
+INFINITY = float('inf')
+
+
+#------------------------------------------------------------------------------#
+# Uniform grid of points in three dimensions, for radius and nearest-neighbour
+# queries. Points are stored by their keys in sparse cells, so moving a point is
+# two dictionary operations, and a query only checks the points of the cells
+# overlapping the searched sphere (or of all the cells, if there are less cells
+# than that)
+class Grid:
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    @property
+    def cell_size(self):
+        return self._size
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, cell_size):
+        self._size  = cell_size
+        # Points in cells => {cell: {key: position}}
+        self._cells = {}
+        # Cells of the points => {key: cell}
+        self._keys  = {}
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __len__(self):
+        return len(self._keys)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __contains__(self, key):
+        return key in self._keys
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def insert(self, key, position):
+        # Add a new point, or move an existing one
+        size = self._size
+        cell = (floor(position[0]/size),
+                floor(position[1]/size),
+                floor(position[2]/size))
+        cells = self._cells
+        old   = self._keys.get(key)
+        if old != cell:
+            if old is not None:
+                points = cells[old]
+                del points[key]
+                if not points:
+                    del cells[old]
+            self._keys[key] = cell
+        try:
+            cells[cell][key] = tuple(position)
+        except KeyError:
+            cells[cell] = {key: tuple(position)}
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def remove(self, key):
+        cell   = self._keys.pop(key)
+        points = self._cells[cell]
+        del points[key]
+        if not points:
+            del self._cells[cell]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def within(self, position, radius,
+                     scale=(1, 1, 1)) -> 'list of key and position pairs':
+        # If the space is scaled, the distances are measured after scaling, and
+        # the searched (scaled) sphere is covered by a box in the grid's space
+        x, y, z    = position
+        sx, sy, sz = scale
+        limit      = radius*radius
+        found      = []
+        for points in self._overlapping(position, radius, scale):
+            for key, (px, py, pz) in points.items():
+                if ((sx*(px - x))**2 +
+                    (sy*(py - y))**2 +
+                    (sz*(pz - z))**2) < limit:
+                        found.append((key, (px, py, pz)))
+        return found
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def nearest(self, position, radius=INFINITY,
+                      scale=(1, 1, 1)) -> 'key and position pair or None':
+        x, y, z    = position
+        sx, sy, sz = scale
+        limit      = radius*radius
+        found      = None
+        # If there is no upper bound of the distance, search the whole grid
+        if radius == INFINITY:
+            cells = self._cells.values()
+        else:
+            cells = self._overlapping(position, radius, scale)
+        for points in cells:
+            for key, (px, py, pz) in points.items():
+                distance = ((sx*(px - x))**2 +
+                            (sy*(py - y))**2 +
+                            (sz*(pz - z))**2)
+                if distance < limit:
+                    limit = distance
+                    found = key, (px, py, pz)
+        return found
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _overlapping(self, position, radius, scale) -> 'points of cells':
+        size   = self._size
+        cells  = self._cells
+        ranges = [range(floor((c - radius/abs(s))/size),
+                        floor((c + radius/abs(s))/size) + 1)
+                      for c, s in zip(position, scale)]
+        # If the box covers more cells, than the number of existing ones
+        if len(ranges[0])*len(ranges[1])*len(ranges[2]) > len(cells):
+            return [points for (i, j, k), points in cells.items()
+                               if (i in ranges[0] and
+                                   j in ranges[1] and
+                                   k in ranges[2])]
+        return [cells[cell] for cell in product(*ranges) if cell in cells]
+
+
+
+#------------------------------------------------------------------------------#
+def grid_of(points: 'float array of (N, 3)',
+            keys: 'sequence of N keys'=None) -> 'Grid':
+    # Size cells to hold a few points each, as if the points were evenly spread
+    # on a surface spanning their bounding box (the keys are the indices of
+    # the points, if they are not given)
+    extent = 0
+    if len(points):
+        extent = float((points.max(axis=0) - points.min(axis=0)).max())
+    grid = Grid(2*extent/len(points)**0.5 if extent else 1)
+    for key, position in zip(range(len(points)) if keys is None else keys,
+                             points.tolist()):
+        grid.insert(key, position)
+    return grid
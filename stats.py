@@ -0,0 +1,156 @@
+## INFO ########################################################################
+##                                                                            ##
+##                                  plastey                                   ##
+##                                  =======                                   ##
+##                                                                            ##
+##      Oculus Rift + Leap Motion + Python 3 + C + Blender + Arch Linux       ##
+##                       Version: 0.2.4.144 (20150514)                        ##
+##                               File: stats.py                               ##
+##                                                                            ##
+##               For more information about the project, visit                ##
+##                         <http://plastey.kibu.hu>.                          ##
+##              Copyright (C) 2015 Peter Varo, Kitchen Budapest               ##
+##                                                                            ##
+##  This program is free software: you can redistribute it and/or modify it   ##
+##   under the terms of the GNU General Public License as published by the    ##
+##       Free Software Foundation, either version 3 of the License, or        ##
+##                    (at your option) any later version.                     ##
+##                                                                            ##
+##    This program is distributed in the hope that it will be useful, but     ##
+##         WITHOUT ANY WARRANTY; without even the implied warranty of         ##
+##            MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.            ##
+##            See the GNU General Public License for more details.            ##
+##                                                                            ##
+##     You should have received a copy of the GNU General Public License      ##
+##     along with this program, most likely a file in the root directory,     ##
+##        called 'LICENSE'. If not, see <http://www.gnu.org/licenses>.        ##
+##                                                                            ##
+######################################################################## INFO ##
+
+# Import python modules
+from json        import dumps
+from time        import perf_counter, time
+from collections import OrderedDict
+
+
+#------------------------------------------------------------------------------#
+# Round-trip times are counted in buckets: the upper bound of the Nth bucket is
+# 2**N milliseconds, the last one collects everything above that
+BUCKETS = 12
+
+
+
+#------------------------------------------------------------------------------#
+def dump_counters(path, counters):
+    # Append the counters (with the time of saving them) as a single JSON line
+    line = OrderedDict(time=time())
+    line.update(counters)
+    with open(path, mode='a', encoding='utf-8') as file:
+        file.write(dumps(line) + '\n')
+
+
+
+#------------------------------------------------------------------------------#
+# Counters of a connection: the byte and message counters are plain attributes,
+# incremented directly by the sockets, everything else is recorded by a method
+# call doing a few additions only. The counters are updated by the network
+# thread and read by the logic tick, without locking: a snapshot may be off by
+# a message, which is fine for statistics
+class Statistics:
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self):
+        self.bytes_sent        = 0
+        self.bytes_received    = 0
+        self.messages_sent     = 0
+        self.messages_received = 0
+        # Malformed messages, which could not be handled
+        self.messages_dropped  = 0
+        # Last round-trip time and the histogram of them since the last snapshot
+        self.round_trip_time   = None
+        self._round_trips      = [0]*BUCKETS
+        # Depth of the outgoing queues => (messages, bytes), and their maximums
+        self.queue_depth       = 0, 0
+        self._max_depth        = [0, 0]
+        # Durations since the last snapshot => {name: [count, total, maximum]}
+        self._timings          = {}
+        self._last_time        = perf_counter()
+        self._last_counters    = 0, 0, 0, 0
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def time(self, name, seconds):
+        try:
+            timing = self._timings[name]
+            timing[0] += 1
+            timing[1] += seconds
+            if seconds > timing[2]:
+                timing[2] = seconds
+        except KeyError:
+            self._timings[name] = [1, seconds, seconds]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def round_trip(self, seconds):
+        self.round_trip_time = seconds
+        self._round_trips[min(int(seconds*1e3).bit_length(), BUCKETS - 1)] += 1
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def queue(self, messages, size):
+        self.queue_depth = messages, size
+        max_depth = self._max_depth
+        if messages > max_depth[0]:
+            max_depth[0] = messages
+        if size > max_depth[1]:
+            max_depth[1] = size
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def snapshot(self) -> 'OrderedDict':
+        # Collect the counters, and start a new measurement interval
+        now      = perf_counter()
+        elapsed  = (now - self._last_time) or 1e-9
+        counters = (self.bytes_sent,
+                    self.bytes_received,
+                    self.messages_sent,
+                    self.messages_received)
+        rates    = [(c - l)/elapsed for c, l in zip(counters,
+                                                    self._last_counters)]
+        snapshot = OrderedDict()
+        snapshot['time']     = time()
+        snapshot['interval'] = elapsed
+        for name, value, rate in zip(('bytes_sent',
+                                      'bytes_received',
+                                      'messages_sent',
+                                      'messages_received'), counters, rates):
+            snapshot[name]        = value
+            snapshot[name + '/s'] = rate
+        snapshot['messages_dropped'] = self.messages_dropped
+        snapshot['round_trip_ms'] = (None if self.round_trip_time is None
+                                          else self.round_trip_time*1e3)
+        snapshot['round_trips_below_ms'] = OrderedDict(
+            (str(1 << i), count) for i, count in enumerate(self._round_trips)
+                                     if count)
+        snapshot['max_queued_messages'] = self._max_depth[0]
+        snapshot['max_queued_bytes']    = self._max_depth[1]
+        for name, (count, total, maximum) in sorted(self._timings.items()):
+            snapshot[name + '_count']   = count
+            snapshot[name + '_mean_ms'] = total/count*1e3
+            snapshot[name + '_max_ms']  = maximum*1e3
+
+        self._last_time     = now
+        self._last_counters = counters
+        self._round_trips   = [0]*BUCKETS
+        self._max_depth     = list(self.queue_depth)
+        self._timings       = {}
+        return snapshot
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def dump(self, path, extra=None):
+        # Append a snapshot (and the extra counters) as a single JSON line
+        snapshot = self.snapshot()
+        if extra:
+            snapshot.update(extra)
+        dump_counters(path, snapshot)
@@ -28,12 +28,40 @@
 ######################################################################## INFO ##
 
 # Import python modules
-from random    import choice
-from itertools import count
-from pickle    import dump, load, HIGHEST_PROTOCOL
+from random      import choice
+from itertools   import count
+from time        import perf_counter
+from collections import OrderedDict
+from pickle      import dump, load, HIGHEST_PROTOCOL
+from numpy       import (array, zeros, ones, full, diag, dot, sqrt, minimum,
+                         maximum, concatenate, einsum, asarray, ndarray,
+                         flatnonzero, float32, arange, bincount)
 
 # Import user modules
-from utils import name_of_vertex
+from levels    import Levels
+from spatial   import grid_of
+from ownership import Ownership, MASTER_RANK
+from utils     import name_of_vertex
+
+
+#- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+# Module level constants
+# Falloff curves of the soft selection => the weight of a vertex by its
+# closeness to the selection (1 at the selected vertices, 0 at the radius)
+FALLOFF_CURVES = {'smooth': lambda t: t*t*(3 - 2*t),
+                  'linear': lambda t: t,
+                  'sharp' : lambda t: t*t,
+                  'sphere': lambda t: sqrt(t*(2 - t))}
+# Number of selections, the falloffs of which are remembered
+FALLOFF_CACHE_SIZE = 16
+# Shapes of the volume selection
+VOLUME_BOX    = 'box'
+VOLUME_SPHERE = 'sphere'
+# Axes of the mirror (in the space of the vertices' parent), and how far the
+# mirrored position of a vertex can be from its mirror (in the spacing of the
+# generated surface)
+MIRROR_AXES      = 'x', 'y', 'z'
+MIRROR_TOLERANCE = 0.25
 
 
 #------------------------------------------------------------------------------#
@@ -64,52 +92,378 @@ class Surface:
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def __init__(self, surface_creator, vertex_creator, base_color):
+    @property
+    def positions(self) -> 'float32 array of (N, 3) local positions':
+        # NOTE: read-only, use the place, restore and move_vertices methods
+        return self._positions
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    @property
+    def level(self):
+        return self._level
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    @property
+    def rank(self):
+        return self._ownership.rank
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, surface_creator,
+                       vertex_creator,
+                       base_color,
+                       rank=MASTER_RANK,
+                       shared=True,
+                       detail_levels=1):
+        # Vertices selected by this and locked by the other users => {index: vertex}
         self._locked   = {}
         self._selected = {}
+        # Persistent table of the vertices held by this and the other users,
+        # it only changes when a vertex is picked, released or handed over
+        # (and only queues messages of the changes, if the surface is shared)
+        self._ownership = Ownership(rank, shared)
+        # Spatial index of the local positions of the vertices (built on first
+        # use, and updated with the vertices moved since the last query)
+        self._grid      = None
         self._surface  = surface_creator#()
         self._vertices = vertex_creator#()
+        # Placement of the vertices' parent at the last update of the mesh
+        self._placement = None
+        # Counters of the updates => requested by update, performed by refresh
+        self.updates_requested = 0
+        self.updates_performed = 0
+        self.vertices_written  = 0
+        self._update_time      = [0, 0]
+        self._last_time        = perf_counter()
+        self._last_counters    = 0, 0, 0
 
         for vertex in self._vertices.children:
             vertex.color = base_color
 
+        # The vertices are identified by their indices everywhere, the names
+        # of the blender objects are only formatted once, to collect them
+        self._by_index = vertices = []
+        children = self._vertices.children
+        try:
+            for i in count():
+                vertices.append(children[name_of_vertex(i)])
+        except KeyError:
+            pass
+
+        # The local positions of the vertices (rows ordered by the indices of
+        # the vertices) are the source of truth, the blender objects are only
+        # written when the surface is updated, and only the moved ones
+        size = len(vertices)
+        self._positions = zeros((size, 3), dtype=float32)
+        self._dirty     = zeros(size, dtype=bool)
+        self._moved     = zeros(size, dtype=bool)
+        # Masks of the selected and locked vertices
+        self._selection = zeros(size, dtype=bool)
+        self._locks     = zeros(size, dtype=bool)
+        self.pull()
+        # Positions as the surface was generated, the neighbours of the soft
+        # selection are measured on this, so they don't change while sculpting
+        self._rest      = self._positions.copy()
+        # Rows and weights of the recent soft selections => {key: (rows, weights)}
+        self._falloffs  = OrderedDict()
+        # Mirrors of the vertices on the generated surface => {axis: array},
+        # and the mirrors' local coordinates on each axis (in the middle)
+        self._mirrors   = {}
+        self._planes    = ((self._rest.min(axis=0) + self._rest.max(axis=0))/2
+                               if size else zeros(3))
+        # Marks of the vertices while the mirrors are looked up (all -1 between
+        # the look ups, so they are never allocated for all the vertices again)
+        self._marks     = full(size, -1, dtype=int)
+        self._last_mirrored = None, None
+
+        # Levels of detail: only the vertices of the current level (and of the
+        # refined regions) are shown and can be picked, the hidden ones follow
+        # them (start with the coarsest level)
+        self._levels  = Levels(self._rest, detail_levels)
+        self._level     = 0
+        self._parents   = None
+        self._followers = None
+        self._active    = ones(size, dtype=bool)
+        self.set_level(len(self._levels) - 1)
+        # The adjacent vertices are smoothed towards each other, they are found
+        # now, so the first stroke of the smoothing brush does not stall
+        self._levels.adjacent()
+
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     # TODO: Check if self._vertices.children is still a KX_VertexProxy. It is
     #       most probably not => update all the function definition's return signatures
     def __iter__(self) -> 'KX_VertexProxy':
-        yield from self._vertices.children
+        yield from self._by_index
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def __getitem__(self, identifier: 'index or name') -> 'KX_VertexProxy':
-        return self._vertices.children[identifier]
+    def __len__(self):
+        return len(self._by_index)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __getitem__(self, index) -> 'KX_VertexProxy':
+        return self._by_index[index]
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def serialise(self) -> 'list':
-        coords = []
-        vertices_children = self._vertices.children
-        try:
-            for i in count():
-                coords.extend(vertices_children[name_of_vertex(i)].localPosition)
-        except KeyError:
-            return coords
+        return self._positions.ravel().tolist()
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def deserialise(self, coords):
-        vertices_children = self._vertices.children
-        try:
-            for i, coord in enumerate(zip(*(iter(coords),)*3)):
-                vertices_children[name_of_vertex(i)].localPosition = coord
-        except KeyError:
+    def deserialise(self, coords: 'flat sequence of coordinates',
+                          keep_selected=False):
+        # NOTE: if keep_selected is set, the vertices selected by this user are
+        #       not overwritten, e.g. while they are being grabbed
+        positions = self._positions
+        if len(coords) > positions.size:
             raise SerialisedDataUnmatched
+        coords = array(coords[:len(coords) - len(coords)%3],
+                       dtype=float32).reshape(-1, 3)
+        # Only the vertices at different positions have to be written back
+        rows    = len(coords)
+        changed = (positions[:rows] != coords).any(axis=1)
+        if keep_selected:
+            changed &= ~self._selection[:rows]
+        positions[:rows][changed] = coords[changed]
+        self._dirty[:rows] |= changed
+        self._moved[:rows] |= changed
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def update(self):
+        # Request an update of the mesh: it is done by the next refresh (at the
+        # end of the logic tick), so any number of requests cost one update
+        self.updates_requested += 1
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def refresh(self) -> 'boolean':
+        # Write the moved vertices to blender, and update the mesh once, but
+        # only if any vertex moved, or the surface was moved, rotated or scaled
+        parent    = self._vertices
+        placement = (tuple(parent.worldPosition),
+                     tuple(map(tuple, parent.worldOrientation)),
+                     tuple(parent.worldScale))
+        if placement == self._placement and not self._dirty.any():
+            return False
+        started = perf_counter()
+        self.flush()
         self._surface.update()
+        self._placement = placement
+        self.updates_performed += 1
+        duration = perf_counter() - started
+        self._update_time[0] += duration
+        if duration > self._update_time[1]:
+            self._update_time[1] = duration
+        return True
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def flush(self):
+        # Write the moved vertices to blender
+        dirty = flatnonzero(self._dirty)
+        if len(dirty):
+            vertices = self._by_index
+            for i, position in zip(dirty.tolist(),
+                                   self._positions[dirty].tolist()):
+                vertices[i].localPosition = position
+            self._dirty[dirty] = False
+            self.vertices_written += len(dirty)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def update_counters(self) -> 'OrderedDict':
+        # Collect the update counters, and start a new measurement interval
+        now      = perf_counter()
+        elapsed  = (now - self._last_time) or 1e-9
+        counters = (self.updates_requested,
+                    self.updates_performed,
+                    self.vertices_written)
+        counted  = OrderedDict()
+        for name, value, last in zip(('updates_requested',
+                                      'updates_performed',
+                                      'vertices_written'),
+                                     counters, self._last_counters):
+            counted[name]        = value
+            counted[name + '/s'] = (value - last)/elapsed
+        performed = counters[1] - self._last_counters[1]
+        counted['update_mean_ms'] = (self._update_time[0]/performed*1e3
+                                         if performed else 0)
+        counted['update_max_ms']  = self._update_time[1]*1e3
+
+        self._last_time     = now
+        self._last_counters = counters
+        self._update_time   = [0, 0]
+        return counted
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def pull(self):
+        # Read all the positions from blender, if it has moved the vertices
+        vertices = self._by_index
+        if vertices:
+            self._positions[:] = [tuple(vertex.localPosition)
+                                     for vertex in vertices]
+        self._dirty[:] = False
+        self._grid     = None
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def selected_positions(self) -> 'list of (index, x, y, z)':
+        rows = flatnonzero(self._selection)
+        return [(i, x, y, z) for i, (x, y, z) in
+                    zip(rows.tolist(), self._positions[rows].tolist())]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def selected_indices(self) -> 'array of indices':
+        return flatnonzero(self._selection)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def place(self, indices,
+                    positions: 'sequence of x, y, z'):
+        # The vertices placed explicitly (e.g. by the opponent user) are shown,
+        # as they are edited at a finer level
+        rows = self._rows(indices)
+        if not len(rows):
+            return
+        before = self._positions[rows]
+        self._positions[rows] = positions
+        self._dirty[rows]     = True
+        self._moved[rows]     = True
+        self._follow(rows, self._positions[rows] - before)
+        if not self._active[rows].all():
+            self._reveal(rows)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def restore(self, indices,
+                      positions: 'sequence of x, y, z'):
+        # Put the vertices back to the given positions (e.g. undo or redo),
+        # except the ones locked by the other users at the moment
+        rows = self._rows(indices)
+        keep = ~self._locks[rows]
+        self.place(rows[keep], asarray(positions)[keep])
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def shift(self, indices,
+                    offsets: 'sequence of x, y, z'):
+        # Move the vertices by the offsets (e.g. undo or redo), except the ones
+        # locked by the other users at the moment
+        rows = self._rows(indices)
+        keep = ~self._locks[rows]
+        rows = rows[keep]
+        self.place(rows, self._positions[rows] + asarray(offsets)[keep])
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def nearest(self, position: 'world position',
+                      radius) -> 'tuple of index and KX_VertexProxy or None':
+        # The closest vertex within radius
+        position, scale = self._to_local(position)
+        found = self._spatial_grid().nearest(position, radius, scale)
+        if found is not None:
+            return found[0], self._by_index[found[0]]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def within(self, position: 'world position',
+                     radius) -> 'list of tuples of index and KX_VertexProxy':
+        position, scale = self._to_local(position)
+        vertices = self._by_index
+        return [(i, vertices[i]) for i, _ in self._spatial_grid().within(
+                                                    position, radius, scale)]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def inside(self, shape: 'VOLUME_BOX or VOLUME_SPHERE',
+                     first: 'world position',
+                     second: 'world position') -> 'array of indices':
+        # The shown vertices inside the box of two opposite corners, or inside
+        # the sphere of the two ends of a diameter (in world space), checking
+        # all the vertices at once
+        rows = flatnonzero(self._active)
+        if not len(rows):
+            return rows
+        parent = self._vertices
+        axes   = (asarray(parent.worldOrientation, dtype=float32)*
+                  asarray(parent.worldScale, dtype=float32))
+        world  = (dot(self._positions[rows], axes.T) +
+                  asarray(parent.worldPosition, dtype=float32))
+        first  = asarray(first, dtype=float32)
+        second = asarray(second, dtype=float32)
+        if shape == VOLUME_SPHERE:
+            centre = (first + second)/2
+            limit  = ((second - first)**2).sum()/4
+            return rows[((world - centre)**2).sum(axis=1) <= limit]
+        low  = minimum(first, second)
+        high = maximum(first, second)
+        return rows[((low <= world) & (world <= high)).all(axis=1)]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def falloff(self, indices,
+                      radius: 'local distance',
+                      curve: 'name of falloff curve'='smooth'
+                      ) -> 'arrays of indices and weights':
+        # The given vertices and their neighbours closer than radius, weighted
+        # by the curve of the distance to the closest given vertex. As the
+        # distances are measured on the generated surface, the weights of a
+        # selection never change, so they are computed only once
+        rows = self._rows(indices)
+        key  = rows.tobytes(), radius, curve
+        try:
+            found = self._falloffs.pop(key)
+        except KeyError:
+            near, closest = self._levels.within(rows, radius)
+            weights = FALLOFF_CURVES[curve](1 - closest/radius)
+            # If the radius is zero, only the given vertices are moved
+            if not len(near):
+                near, weights = rows.copy(), ones(len(rows))
+            found = near, weights
+            if len(self._falloffs) >= FALLOFF_CACHE_SIZE:
+                self._falloffs.popitem(last=False)
+        self._falloffs[key] = found
+        return found
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def symmetric(self, indices,
+                        axis: 'one of MIRROR_AXES'
+                        ) -> 'arrays of indices and of where they come from':
+        # The given vertices followed by their mirrors (except the ones given
+        # already), and the position of each vertex's source among the given
+        # ones, e.g. to look up the weights of the mirrors
+        rows = self._rows(indices)
+        which, mirrors = self._mirrored(rows, axis)
+        return (concatenate((rows, mirrors)),
+                concatenate((arange(len(rows)), which)))
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def on_side_of(self, indices,
+                         axis: 'one of MIRROR_AXES',
+                         position: 'world position') -> 'array of indices':
+        # The given vertices, which are on the same side of the mirror as the
+        # position, and the ones, the mirrors of which are not given
+        rows    = self._rows(indices)
+        mirrors = self._mirror_map(axis)[rows]
+        given   = zeros(len(self._positions) + 1, dtype=bool)
+        given[rows] = True
+        # (the missing mirrors are -1, which is never given)
+        paired  = given[mirrors] & (mirrors != rows)
+        k       = MIRROR_AXES.index(axis)
+        plane   = self._planes[k]
+        side    = -1 if self._to_local(position)[0][k] < plane else 1
+        near    = (self._positions[rows, k] - plane)*side >= 0
+        return rows[~paired | near]
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -118,38 +472,134 @@ class Surface:
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def is_selected(self, identifier: 'index or name') -> 'boolean':
-        return identifier in self._selected
+    def is_selected(self, index) -> 'boolean':
+        return index in self._selected
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def select(self, identifier: 'index or name') -> 'KX_VertexProxy':
-        if identifier in self._locked:
+    def select(self, index) -> 'KX_VertexProxy':
+        if index in self._locked:
             raise VertexLocked
-        if identifier in self._selected:
+        if index in self._selected:
             raise VertexAlreadySelected
-        vertex = self._vertices.children[identifier]
-        self._selected[identifier] = vertex
+        vertex = self._by_index[index]
+        if not self._ownership.claim(index):
+            raise VertexLocked
+        self._selected[index]  = vertex
+        self._selection[index] = True
         return vertex
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def deselect(self, identifier: 'index or name') -> 'KX_VertexProxy':
-        if identifier in self._locked:
+    def deselect(self, index) -> 'KX_VertexProxy':
+        if index in self._locked:
             raise VertexLocked
-        return self._selected.pop(identifier, None)
+        vertex = self._selected.pop(index, None)
+        if vertex is not None:
+            self._ownership.release(index)
+            self._selection[index] = False
+        return vertex
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def select_many(self, indices) -> 'array of the selected indices':
+        # Select the vertices, which are not locked, or selected already
+        rows = self._rows(indices)
+        rows = rows[~(self._locks[rows] | self._selection[rows])]
+        vertices = self._by_index
+        selected = self._selected
+        claim    = self._ownership.claim
+        claimed  = []
+        for index in rows.tolist():
+            if claim(index):
+                selected[index] = vertices[index]
+                claimed.append(index)
+        claimed = array(claimed, dtype=int)
+        self._selection[claimed] = True
+        return claimed
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def deselect_many(self, indices) -> 'array of the deselected indices':
+        # Deselect the vertices, which are selected (and not locked)
+        rows = self._rows(indices)
+        rows = rows[self._selection[rows] & ~self._locks[rows]]
+        selected = self._selected
+        release  = self._ownership.release
+        for index in rows.tolist():
+            del selected[index]
+            release(index)
+        self._selection[rows] = False
+        return rows
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def deselect_all(self) -> 'tuple of KX_VertexProxies':
-        selected = tuple(self._selected.values())
+    def deselect_all(self) -> 'tuple of index and KX_VertexProxy pairs':
+        selected = tuple(self._selected.items())
         self._selected = {}
+        self._selection[:] = False
+        for index, _ in selected:
+            self._ownership.release(index)
         return selected
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def is_locked(self, identifier: 'index or name') -> 'boolean':
-        return identifier in self._locked
+    def transfer(self, index, rank) -> 'KX_VertexProxy':
+        # Hand over a selected vertex to another user
+        vertex = self._selected.pop(index)
+        self._ownership.transfer(index, rank)
+        self._selection[index] = False
+        self._locks[index]     = True
+        self._locked[index]    = vertex
+        return vertex
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def ownership_messages(self) -> 'list of message type and payload pairs':
+        # Claims and releases since the last call
+        return self._ownership.flush()
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def rejoin(self) -> 'unlocked KX_VertexProxies':
+        # Forget the vertices of the other users after a reconnection, as they
+        # will be claimed again, and claim the ones selected by this user again
+        return [vertex for vertex in map(self.unlock, self._ownership.rejoin())
+                            if vertex is not None]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def apply_ownership(self, kind, payload) -> 'changed KX_VertexProxies':
+        locked, unlocked, lost, gained = self._ownership.apply(kind, payload)
+        vertices  = self._by_index
+        selected  = self._selected
+        selection = self._selection
+        # Vertices claimed by the other users
+        locked = [self.lock(index) for index in locked]
+        # Vertices released by the other users
+        unlocked = [vertex for vertex in map(self.unlock, unlocked)
+                                if vertex is not None]
+        # Vertices selected by this user, but claimed earlier by another one
+        for i, index in enumerate(lost):
+            selected.pop(index, None)
+            selection[index] = False
+            lost[i] = self.lock(index)
+        # Vertices handed over to this user
+        for i, index in enumerate(gained):
+            selection[index] = True
+            selected[index]  = gained[i] = self.unlock(index) or vertices[index]
+        return locked, unlocked, lost, gained
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def is_held(self) -> 'boolean':
+        # If any vertex is selected by this or locked by another user
+        return bool(self._selected or self._locked)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def is_locked(self, index) -> 'boolean':
+        return index in self._locked
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
@@ -158,31 +608,306 @@ class Surface:
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def lock(self, identifier: 'index or name') -> 'KX_VertexProxy':
-        vertex = self._vertices.children[identifier]
-        self._locked[identifier] = vertex
+    def lock(self, index) -> 'KX_VertexProxy':
+        vertex = self._locked[index] = self._by_index[index]
+        self._locks[index] = True
         return vertex
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def unlock(self, identifier: 'index or name') -> 'KX_VertexProxy':
-        return self._locked.pop(identifier, None)
+    def unlock(self, index) -> 'KX_VertexProxy':
+        vertex = self._locked.pop(index, None)
+        if vertex is not None:
+            self._locks[index] = False
+        return vertex
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
     def unlock_all(self) -> 'tuple of KX_VertexProxies':
         locked = tuple(self._locked.values())
         self._locked = {}
+        self._locks[:] = False
         return locked
 
 
     #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
-    def move_vertices(self, identifiers, move_vector):
-        error = None
-        for identifier in identifiers:
-            if identifier in self._locked:
-                error = VertexLocked('Some vertices are locked')
-            else:
-                vertex.applyMovement(vector)
-        if error:
-            raise error
+    def move_vertices(self, indices,
+                            translation: 'world space x, y, z'=None,
+                            rotation: 'world space 3x3 matrix'=None,
+                            scale: 'factor or factors of the world axes'=None,
+                            pivot: 'world position'=None,
+                            weights: 'falloff factor of each vertex'=None,
+                            mirror: 'one of MIRROR_AXES'=None
+                            ) -> 'moved indices, before and after arrays':
+        # Scale, rotate (around the pivot, or the centre of the vertices) and
+        # translate the vertices, which are not locked by the other users, and
+        # if weighted, move each vertex only that much of its way. If mirrored,
+        # the mirrors of the vertices are moved the mirrored way
+        rows = self._rows(indices)
+        keep = ~self._locks[rows]
+        rows = rows[keep]
+        if weights is not None:
+            weights = asarray(weights, dtype=float)[keep]
+        count = len(rows)
+        if mirror is not None:
+            which, mirrors = self._mirrored(rows, mirror)
+            keep    = ~self._locks[mirrors]
+            which   = which[keep]
+            rows    = concatenate((rows, mirrors[keep]))
+            if weights is not None:
+                weights = concatenate((weights, weights[which]))
+        positions = self._positions
+        before    = positions[rows]
+        if not len(rows):
+            return rows, before, before.copy()
+
+        # The mirrors are transformed with the others in the mirrored space,
+        # that is, they are reflected before, and reflected back after it
+        after = before.astype(float)
+        if mirror is not None:
+            self._reflect(after[count:], mirror)
+        if rotation is not None or scale is not None:
+            # The transformation is in world space, while the positions are in
+            # the space of the vertices' parent: world = origin + axes*local
+            parent = self._vertices
+            world  = asarray(parent.worldOrientation, dtype=float)
+            factor = asarray(parent.worldScale, dtype=float)
+            matrix = diag(ones(3)*(1 if scale is None else scale))
+            if rotation is not None:
+                matrix = dot(asarray(rotation, dtype=float), matrix)
+            matrix = dot(world.T/factor[:, None], dot(matrix, world*factor))
+            centre = (after[:count].mean(axis=0) if pivot is None
+                                                 else self._to_local(pivot)[0])
+            after  = dot(after - centre, matrix.T) + centre
+        if translation is not None:
+            after += self._to_local_vector(translation)
+        if mirror is not None:
+            self._reflect(after[count:], mirror)
+        if weights is not None:
+            after = before + weights[:, None]*(after - before)
+
+        positions[rows]   = after
+        self._dirty[rows] = True
+        self._moved[rows] = True
+        self._follow(rows, positions[rows] - before)
+        return rows, before, positions[rows]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def smooth(self, indices,
+                     weights: 'strength factor of each vertex'=None,
+                     strength: 'fraction of the way to the average'=0.5,
+                     iterations=1,
+                     budget: 'seconds'=None
+                     ) -> 'moved indices, before and after arrays':
+        # Move the vertices, which are not locked by the other users, towards
+        # the average of their adjacent vertices on the generated surface. All
+        # the vertices are moved at once in an iteration, and the iterations
+        # stop early, if the next one would not fit in the budget
+        started = perf_counter()
+        rows = self._rows(indices)
+        keep = ~self._locks[rows]
+        rows = rows[keep]
+        positions = self._positions
+        before    = positions[rows]
+        if not len(rows):
+            return rows, before, before.copy()
+
+        factors = full(len(rows), float(strength))
+        if weights is not None:
+            factors *= asarray(weights, dtype=float)[keep]
+        # The adjacent vertices of all the smoothed ones in a single array, and
+        # the smoothed vertices they belong to
+        adjacent, starts = self._levels.adjacent()
+        first    = starts[rows]
+        counts   = starts[rows + 1] - first
+        owners   = arange(len(rows)).repeat(counts)
+        skipped  = first - counts.cumsum() + counts
+        adjacent = adjacent[arange(counts.sum()) + skipped.repeat(counts)]
+        factors[counts == 0] = 0
+        shares   = (factors/maximum(counts, 1))[:, None]
+        factors  = factors[:, None]
+        total    = zeros((len(rows), 3))
+        for done in range(1, iterations + 1):
+            around = positions.take(adjacent, axis=0)
+            for axis in range(3):
+                total[:, axis] = bincount(owners, around[:, axis],
+                                          minlength=len(rows))
+            current = positions[rows]
+            positions[rows] = current + shares*total - factors*current
+            # If another iteration (as long as the average so far) would not fit
+            if (budget is not None and
+                (perf_counter() - started)*(done + 1)/done > budget):
+                    break
+
+        self._dirty[rows] = True
+        self._moved[rows] = True
+        self._follow(rows, positions[rows] - before)
+        return rows, before, positions[rows]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def set_level(self, level) -> 'level set':
+        # Show the vertices of the level only (and the held ones), the refined
+        # regions of the previous level are hidden again
+        level  = max(0, min(level, len(self._levels) - 1))
+        active = self._levels.members(level) | self._selection | self._locks
+        self._level     = level
+        self._parents   = self._levels.parents(level)
+        self._followers = self._levels.followers(level)
+        self._show(active)
+        self._grid = None
+        return level
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def refine(self, indices, radius: 'local distance'):
+        # Show all the vertices around the given ones (on the generated surface)
+        self._reveal(self.falloff(indices, radius)[0])
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def is_active(self, index) -> 'boolean':
+        return bool(self._active[index])
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _follow(self, rows, change):
+        # Move the hidden vertices with the shown vertices they follow (except
+        # the ones which are moved themselves, or shown since)
+        followers, starts = self._followers
+        if not len(followers) or not len(rows):
+            return
+        count  = len(self._positions)
+        moved  = zeros(count, dtype=bool)
+        moved[rows] = True
+        hidden = zeros(count, dtype=bool)
+        hidden[concatenate([followers[starts[i]:starts[i + 1]]
+                                for i in rows.tolist()])] = True
+        hidden = flatnonzero(hidden & ~moved & ~self._active)
+        if len(hidden):
+            parents, weights = self._parents
+            offsets = zeros((count, 3), dtype=float32)
+            offsets[rows] = change
+            offsets = offsets.take(parents.take(hidden, axis=0), axis=0)
+            weights = weights.take(hidden, axis=0)
+            self._positions[hidden] += einsum('ij,ijk->ik', weights, offsets)
+            self._dirty[hidden] = True
+            self._moved[hidden] = True
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _mirrored(self, rows, axis) -> 'arrays of sources and mirrors':
+        # The mirrors of the vertices, which are not among the vertices, and
+        # which of the vertices they are the mirrors of (each mirror once)
+        # (a grab moves the same vertices in each frame, so the last ones are
+        # remembered, as the mirrors of the vertices never change)
+        key = axis, rows.tobytes()
+        if self._last_mirrored[0] == key:
+            return self._last_mirrored[1]
+        mirrors = self._mirror_map(axis)[rows]
+        which   = flatnonzero(mirrors >= 0)
+        found   = mirrors[which]
+        # Mark the vertices, and drop their mirrors, then mark the mirrors, and
+        # keep the last one of each (all the marks are cleared after it)
+        marks = self._marks
+        marks[rows] = -2
+        fresh = marks[found] != -2
+        which = which[fresh]
+        found = found[fresh]
+        order = arange(len(found))
+        marks[found] = order
+        once  = marks[found] == order
+        marks[rows]  = -1
+        marks[found] = -1
+        self._last_mirrored = key, (which[once], found[once])
+        return self._last_mirrored[1]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _mirror_map(self, axis) -> 'int array of mirrors (or -1)':
+        # The vertex at the reflected position of each vertex on the generated
+        # surface (found once for each axis)
+        mirrors = self._mirrors.get(axis)
+        if mirrors is None:
+            reflected = self._rest.astype(float)
+            self._reflect(reflected, axis)
+            self._mirrors[axis] = mirrors = \
+                self._levels.matching(reflected, MIRROR_TOLERANCE)
+        return mirrors
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _reflect(self, positions, axis):
+        # Reflect the positions to the mirror (in place)
+        k = MIRROR_AXES.index(axis)
+        positions[:, k] = 2*self._planes[k] - positions[:, k]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _reveal(self, rows):
+        rows = rows[~self._active[rows]]
+        if len(rows):
+            active = self._active.copy()
+            active[rows] = True
+            self._show(active)
+            # Only the new vertices have to be added to the index
+            if self._grid is not None:
+                self._moved[rows] = True
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _show(self, active):
+        vertices = self._by_index
+        for i in flatnonzero(active != self._active).tolist():
+            vertices[i].visible = bool(active[i])
+        self._active = active
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _rows(self, indices) -> 'array of indices':
+        if isinstance(indices, ndarray):
+            return indices
+        return array(indices, dtype=int).reshape(-1)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _to_local(self, position) -> 'local position and scale':
+        # The index is in the space of the vertices' parent, so rotating or
+        # scaling the surface does not change it: the query is transformed
+        # instead (world = origin + orientation*(scale*local))
+        ox, oy, oz = self._vertices.worldPosition
+        return self._to_local_vector((position[0] - ox,
+                                      position[1] - oy,
+                                      position[2] - oz)), \
+               tuple(self._vertices.worldScale)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _to_local_vector(self, vector) -> 'tuple of x, y, z':
+        parent = self._vertices
+        matrix = parent.worldOrientation
+        scale  = parent.worldScale
+        dx, dy, dz = vector
+        return tuple((matrix[0][i]*dx +
+                      matrix[1][i]*dy +
+                      matrix[2][i]*dz)/scale[i] for i in range(3))
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _spatial_grid(self) -> 'Grid':
+        grid = self._grid
+        # If index has to be (re)built (only the shown vertices can be picked)
+        if grid is None:
+            active = flatnonzero(self._active)
+            self._grid = grid = grid_of(self._positions[active],
+                                        active.tolist())
+            self._moved[:] = False
+        # If vertices moved (or were shown) since the last query
+        elif self._moved.any():
+            moved = flatnonzero(self._moved & self._active)
+            for index, position in zip(moved.tolist(),
+                                       self._positions[moved].tolist()):
+                grid.insert(index, position)
+            self._moved[:] = False
+        return grid
@@ -0,0 +1,206 @@
+## INFO ########################################################################
+##                                                                            ##
+##                                  plastey                                   ##
+##                                  =======                                   ##
+##                                                                            ##
+##      Oculus Rift + Leap Motion + Python 3 + C + Blender + Arch Linux       ##
+##                       Version: 0.2.4.144 (20150514)                        ##
+##                               File: sync.py                                ##
+##                                                                            ##
+##               For more information about the project, visit                ##
+##                         <http://plastey.kibu.hu>.                          ##
+##              Copyright (C) 2015 Peter Varo, Kitchen Budapest               ##
+##                                                                            ##
+##  This program is free software: you can redistribute it and/or modify it   ##
+##   under the terms of the GNU General Public License as published by the    ##
+##       Free Software Foundation, either version 3 of the License, or        ##
+##                    (at your option) any later version.                     ##
+##                                                                            ##
+##    This program is distributed in the hope that it will be useful, but     ##
+##         WITHOUT ANY WARRANTY; without even the implied warranty of         ##
+##            MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.            ##
+##            See the GNU General Public License for more details.            ##
+##                                                                            ##
+##     You should have received a copy of the GNU General Public License      ##
+##     along with this program, most likely a file in the root directory,     ##
+##        called 'LICENSE'. If not, see <http://www.gnu.org/licenses>.        ##
+##                                                                            ##
+######################################################################## INFO ##
+
+# Import python modules
+from struct      import Struct
+from random      import getrandbits
+from collections import OrderedDict
+
+
+#------------------------------------------------------------------------------#
+# Delta message layout
+#   header => session (uint32), sequence number (uint32),
+#             last received sequence number (uint32)
+#   record => vertex index (uint32), flags (uint8), local position (3 x float32)
+DELTA  = Struct('!III')
+RECORD = Struct('!IB3f')
+
+# Record flags
+FLAG_LOCKED = 1
+
+# Movements below this distance (on any axis) are not sent
+EPSILON = 1e-4
+
+
+
+#------------------------------------------------------------------------------#
+# Keeps track of what the peer knows about the vertices held by this user, and
+# what this user knows about the vertices held by the peer: only the vertices,
+# which moved or changed their lock state since the last acknowledged message
+# are packed, and only the really changed ones are reported after unpacking
+class VertexSync:
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def __init__(self, epsilon=EPSILON):
+        self._epsilon  = epsilon
+        # Random identifier of this instance, and the last seen one of the peer:
+        # if the peer restarts or reconnects, its sequence numbers start again
+        self._session      = getrandbits(32)
+        self._peer_session = None
+        # Sequence number of the last sent and the last received message
+        self._sent     = 0
+        self._received = 0
+        # Acknowledged states of the locked vertices => {index: (x, y, z)}
+        self._acked    = {}
+        # Unacknowledged records => {sequence: {index: (x, y, z, locked)}}
+        # (only the latest record of a vertex is kept, so even if the peer
+        # never acknowledges anything, there is at most one per vertex)
+        self._pending  = OrderedDict()
+        # Sequence of the unacknowledged record per vertex => {index: sequence}
+        self._unsettled = {}
+        # States of the vertices locked by the peer => {index: (x, y, z)}
+        self._remote   = {}
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def reset(self):
+        self.__init__(self._epsilon)
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def remote(self) -> 'indices of vertices locked by the peer':
+        yield from self._remote
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def pack(self, vertices: 'iterable of (index, x, y, z)',
+                   released: 'positions of released vertices'={}) -> 'bytes':
+        epsilon = self._epsilon
+        acked   = self._acked
+        records = {}
+        held    = set()
+        # Collect vertices, which moved or just got locked
+        for index, x, y, z in vertices:
+            held.add(index)
+            try:
+                ax, ay, az = acked[index]
+                if (abs(ax - x) <= epsilon and
+                    abs(ay - y) <= epsilon and
+                    abs(az - z) <= epsilon and
+                    index not in self._unsettled):
+                        continue
+            except KeyError:
+                pass
+            records[index] = x, y, z, True
+        # Collect vertices, which are (or could be) still
+        # locked by the peer, but not held by this user anymore
+        for index in set(acked).union(self._unsettled).difference(held):
+            try:
+                x, y, z = released[index]
+            except KeyError:
+                if index in self._unsettled:
+                    x, y, z, _ = self._last_record(index)
+                else:
+                    x, y, z = acked[index]
+            records[index] = x, y, z, False
+
+        # Store records until the peer acknowledges them, in place of the older
+        # unacknowledged records of the same vertices
+        self._sent = sequence = self._sent + 1
+        pending   = self._pending
+        unsettled = self._unsettled
+        for index in records:
+            try:
+                older = pending[unsettled[index]]
+                del older[index]
+                if not older:
+                    del pending[unsettled[index]]
+            except KeyError:
+                pass
+            unsettled[index] = sequence
+        if records:
+            pending[sequence] = records
+
+        pack = RECORD.pack
+        return DELTA.pack(self._session, sequence, self._received) + b''.join(
+            [pack(index, FLAG_LOCKED if locked else 0, x, y, z)
+                for index, (x, y, z, locked) in records.items()])
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def unpack(self, payload) -> 'moved, locked and unlocked vertices':
+        moved    = []
+        locked   = []
+        unlocked = []
+        session, sequence, acknowledged = DELTA.unpack_from(payload)
+        # If this is the first message of a new peer (or of a peer which has
+        # been restarted), forget everything it knew, and this one knew about it
+        if session != self._peer_session:
+            self._peer_session = session
+            self._received     = 0
+            self._acked        = {}
+            self._pending      = OrderedDict()
+            self._unsettled    = {}
+            unlocked.extend(self._remote)
+            self._remote       = {}
+        # If message is a duplicate or arrived out of order
+        elif sequence <= self._received:
+            return moved, locked, unlocked
+        self._received = sequence
+        self._acknowledge(acknowledged)
+
+        remote = self._remote
+        for index, flags, x, y, z in RECORD.iter_unpack(payload[DELTA.size:]):
+            # If peer is holding the vertex
+            if flags & FLAG_LOCKED:
+                try:
+                    if remote[index] == (x, y, z):
+                        continue
+                except KeyError:
+                    locked.append(index)
+                remote[index] = x, y, z
+                moved.append((index, (x, y, z)))
+            # If peer released the vertex
+            elif index in remote:
+                if remote.pop(index) != (x, y, z):
+                    moved.append((index, (x, y, z)))
+                unlocked.append(index)
+        return moved, locked, unlocked
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _acknowledge(self, acknowledged):
+        pending   = self._pending
+        acked     = self._acked
+        unsettled = self._unsettled
+        while pending:
+            sequence = next(iter(pending))
+            if sequence > acknowledged:
+                return
+            for index, (x, y, z, locked) in pending.pop(sequence).items():
+                if locked:
+                    acked[index] = x, y, z
+                else:
+                    acked.pop(index, None)
+                del unsettled[index]
+
+
+    #- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - #
+    def _last_record(self, index):
+        return self._pending[self._unsettled[index]][index]